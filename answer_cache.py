@@ -0,0 +1,179 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Dict
+
+import numpy as np
+
+from incremental_index import chunk_id
+
+def normalize_query(query: str) -> str:
+    """Case-fold, collapse whitespace and drop trailing punctuation"""
+    return re.sub(r"\s+", " ", query).strip().rstrip("?.! ").lower()
+
+def context_key(chunks: List[Dict], index_version: str = "") -> str:
+    """Hash of the index version and the retrieved chunk IDs, in rank order"""
+    ids = ",".join(str(chunk_id(chunk["metadata"].get("doc_id", ""), chunk["start_char"]))
+                   for chunk in chunks)
+    return hashlib.sha256(f"{index_version}\0{ids}".encode("utf-8")).hexdigest()
+
+def answer_key(query: str, context: str, model: str) -> str:
+    """Exact-match key: hash of (model, normalised query, context key)"""
+    return hashlib.sha256(f"{model}\0{normalize_query(query)}\0{context}".encode("utf-8")).hexdigest()
+
+class AnswerCache:
+    """
+    Two-level cache of generated answers stored in SQLite.
+
+    Level one is an exact match on the normalised query plus the hash of the
+    retrieved chunk IDs. Level two is semantic: among answers cached for the
+    same retrieved chunks, the one whose query embedding is nearest the new
+    query's is reused if it lies within `max_distance` (L2). Entries expire
+    after `ttl_seconds` and the least recently used are evicted past
+    `max_entries`.
+
+    Both levels are scoped to the `index_version` passed to `get` and `put`,
+    which is part of the context key. Callers read it once, before
+    retrieving, and pass the same value to both, so an index reload between
+    lookup and store cannot file an answer under the wrong version. Answers
+    cached against another version of the index are never served, and they
+    age out rather than being deleted, so processes serving different
+    indexes can share one cache file.
+    """
+
+    def __init__(self, path: str = "answer_cache.db", max_entries: int = 10000,
+                 ttl_seconds: float = 7 * 24 * 3600, max_distance: float = 0.3):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._seen_version = ""
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " key TEXT PRIMARY KEY,"
+            " context_key TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " query TEXT NOT NULL,"
+            " embedding BLOB NOT NULL,"
+            " answer TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS answers_context ON answers (context_key, model)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS answers_created ON answers (created)"
+        )
+        self._conn.commit()
+
+    def get(self, query: str, query_embedding: List[float], chunks: List[Dict],
+            index_version: str = "", model: str = "gpt-3.5-turbo") -> Optional[str]:
+        """Return a cached answer for this query and the context retrieved from it, or None"""
+        now = time.time()
+
+        with self._lock:
+            # Only counted: the version a lookup is keyed by is the caller's
+            if index_version != self._seen_version:
+                if self._seen_version:
+                    self.invalidations += 1
+                self._seen_version = index_version
+            context = context_key(chunks, index_version)
+            key = answer_key(query, context, model)
+            self._expire(now)
+
+            # Level one: exact normalised query over the same chunks
+            row = self._conn.execute("SELECT answer FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.exact_hits += 1
+            else:
+                # Level two: nearest cached query over the same chunks
+                candidates = self._conn.execute(
+                    "SELECT key, embedding, answer FROM answers WHERE context_key = ? AND model = ?",
+                    (context, model)
+                ).fetchall()
+                if candidates:
+                    vectors = np.stack([np.frombuffer(c[1], dtype=np.float32) for c in candidates])
+                    distances = np.linalg.norm(vectors - np.asarray(query_embedding, dtype=np.float32), axis=1)
+                    best = int(np.argmin(distances))
+                    if distances[best] <= self.max_distance:
+                        key, row = candidates[best][0], (candidates[best][2],)
+                        self.semantic_hits += 1
+
+            if row is None:
+                self.misses += 1
+            else:
+                self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return row[0] if row is not None else None
+
+    def put(self, query: str, query_embedding: List[float], chunks: List[Dict], answer: str,
+            index_version: str = "", model: str = "gpt-3.5-turbo") -> None:
+        """Store an answer, evicting least recently used entries if over capacity"""
+        now = time.time()
+        with self._lock:
+            context = context_key(chunks, index_version)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers "
+                "(key, context_key, model, query, embedding, answer, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (answer_key(query, context, model), context, model, query,
+                 np.asarray(query_embedding, dtype=np.float32).tobytes(), answer, now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _expire(self, now: float) -> None:
+        cursor = self._conn.execute("DELETE FROM answers WHERE created < ?",
+                                    (now - self.ttl_seconds,))
+        self.expirations += cursor.rowcount
+
+    def _evict(self) -> None:
+        """Trim to 90% of capacity so eviction is not paid on every insert"""
+        count = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        excess = count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM answers WHERE key IN "
+            "(SELECT key FROM answers ORDER BY last_used LIMIT ?)", (excess,)
+        )
+        self.evictions += excess
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters for this instance plus current cache size"""
+        hits = self.exact_hits + self.semantic_hits
+        lookups = hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "entries": len(self),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
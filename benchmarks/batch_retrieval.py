@@ -0,0 +1,88 @@
+"""
+Batch vs per-query retrieval throughput
+
+Builds a synthetic flat index and metadata store in a temporary directory, then
+times Retriever.search in a loop against Retriever.search_batch over the same
+queries. Embeddings come from FakeEmbeddingClient with simulated per-request
+latency, so no API key is needed.
+
+Run from the repo root:
+    python -m benchmarks.batch_retrieval --vectors 20000 --queries 1000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+from embedding_engine import FakeEmbeddingClient
+from metadata_store import build_metadata_store
+from query_retrieve import Retriever
+from store_faiss import save_index
+
+def build_corpus(directory: str, num_vectors: int, dimension: int):
+    """Write a random flat index and matching metadata store; returns their paths"""
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((num_vectors, dimension)).astype("float32")
+    index = faiss.IndexFlatL2(dimension)
+    index.add(vectors)
+
+    index_path = os.path.join(directory, "faiss_index.bin")
+    metadata_path = os.path.join(directory, "chunk_metadata.json")
+    save_index(index, index_path, "flat", {})
+    build_metadata_store(({"text": f"chunk {i}", "metadata": {"doc_id": "bench"},
+                           "start_char": i, "end_char": i + 1} for i in range(num_vectors)),
+                         os.path.splitext(metadata_path)[0])
+    return index_path, metadata_path
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.02, help="Simulated seconds per embedding request")
+    args = parser.parse_args()
+
+    queries = [f"benchmark query {i}" for i in range(args.queries)]
+    results = {"vectors": args.vectors, "queries": args.queries, "k": args.k,
+               "latency": args.latency, "faiss_threads": faiss.omp_get_max_threads()}
+
+    with tempfile.TemporaryDirectory() as directory:
+        index_path, metadata_path = build_corpus(directory, args.vectors, args.dimension)
+
+        for mode in ("loop", "batch"):
+            # Fresh cache per mode so neither run benefits from the other's embeddings
+            cache = EmbeddingCache(os.path.join(directory, f"cache_{mode}.db"))
+            retriever = Retriever(index_path, metadata_path,
+                                  api_client=FakeEmbeddingClient(args.dimension, args.latency),
+                                  cache=cache)
+            retriever.load()
+
+            start = time.perf_counter()
+            if mode == "loop":
+                for query in queries:
+                    retriever.search(query, args.k)
+            else:
+                retriever.search_batch(queries, args.k)
+            elapsed = time.perf_counter() - start
+
+            stats = retriever.get_stats()
+            results[mode] = {
+                "seconds": elapsed,
+                "queries_per_sec": args.queries / elapsed,
+                "embed_seconds": stats["embed_time"],
+                "search_seconds": stats["search_time"],
+                "embedding_requests": retriever.api_client.requests,
+            }
+            cache.close()
+
+    results["speedup"] = results["loop"]["seconds"] / results["batch"]["seconds"]
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
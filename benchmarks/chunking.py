@@ -0,0 +1,132 @@
+"""
+Chunking throughput and allocation benchmark
+
+Compares TextChunker's span-based chunking against the previous join-based
+implementation (reproduced below) on one document. It reports chunks/sec, the
+number and size of allocations made while chunking (tracemalloc), and how many
+chunks have text matching source[start_char:end_char]. The span-based chunker
+is measured twice: with lazy text left unread, and with every chunk's text
+read.
+
+Run from the repo root:
+    python -m benchmarks.chunking --file data/openai_api_docs.txt --chunk-size 500
+"""
+import argparse
+import json
+import re
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from chunker import Chunk, TextChunker
+
+def legacy_chunk_by_sentences(text: str, chunk_size: int, doc_id: str) -> List[Chunk]:
+    """The ' '.join-based sentence chunker this benchmark compares against"""
+    chunks = []
+    current_chunk = []
+    current_length = 0
+    start_char = 0
+    for sentence in re.split(r'(?<=[.!?])\s+', text):
+        if current_length + len(sentence) > chunk_size and current_chunk:
+            chunk_text = ' '.join(current_chunk)
+            end_char = start_char + len(chunk_text)
+            chunks.append(Chunk(chunk_text, {"doc_id": doc_id, "strategy": "sentence",
+                                             "chunk_size": chunk_size}, start_char, end_char))
+            overlap_text = ' '.join(current_chunk[-2:])
+            current_chunk = [overlap_text]
+            current_length = len(overlap_text)
+            start_char = end_char - len(overlap_text)
+        current_chunk.append(sentence)
+        current_length += len(sentence) + 1
+    if current_chunk:
+        chunk_text = ' '.join(current_chunk)
+        chunks.append(Chunk(chunk_text, {"doc_id": doc_id, "strategy": "sentence",
+                                         "chunk_size": chunk_size},
+                            start_char, start_char + len(chunk_text)))
+    return chunks
+
+def legacy_chunk_by_paragraphs(text: str, chunk_size: int, doc_id: str) -> List[Chunk]:
+    """The '\\n\\n'.join-based paragraph chunker this benchmark compares against"""
+    chunks = []
+    current_chunk = []
+    current_length = 0
+    start_char = 0
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current_length + len(paragraph) > chunk_size and current_chunk:
+            chunk_text = '\n\n'.join(current_chunk)
+            end_char = start_char + len(chunk_text)
+            chunks.append(Chunk(chunk_text, {"doc_id": doc_id, "strategy": "paragraph",
+                                             "chunk_size": chunk_size}, start_char, end_char))
+            current_chunk = []
+            current_length = 0
+            start_char = end_char + 2
+        current_chunk.append(paragraph)
+        current_length += len(paragraph) + 2
+    if current_chunk:
+        chunk_text = '\n\n'.join(current_chunk)
+        chunks.append(Chunk(chunk_text, {"doc_id": doc_id, "strategy": "paragraph",
+                                         "chunk_size": chunk_size},
+                            start_char, start_char + len(chunk_text)))
+    return chunks
+
+def measure(chunk: Callable[[], List[Chunk]], text: str, repeats: int, read_text: bool) -> Dict:
+    """Time `chunk` over several runs, then count allocations for one more run"""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        chunks = chunk()
+        if read_text:
+            for c in chunks:
+                c.text
+    elapsed = (time.perf_counter() - start) / repeats
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    chunks = chunk()
+    if read_text:
+        for c in chunks:
+            c.text
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    allocated = [stat for stat in after.compare_to(before, "lineno") if stat.size_diff > 0]
+
+    return {
+        "chunks": len(chunks),
+        "seconds": elapsed,
+        "chunks_per_sec": len(chunks) / elapsed if elapsed else 0.0,
+        "retained_blocks": sum(stat.count_diff for stat in allocated),
+        "retained_kb": sum(stat.size_diff for stat in allocated) / 1024,
+        "peak_kb": peak / 1024,
+        "avg_chunk_chars": sum(c.end_char - c.start_char for c in chunks) / max(len(chunks), 1),
+        "exact_offsets": sum(c.text == text[c.start_char:c.end_char] for c in chunks) / max(len(chunks), 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--file", default="data/openai_api_docs.txt")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(args.file, 'r', encoding='utf-8') as f:
+        text = f.read()
+    chunker = TextChunker(chunk_size=args.chunk_size)
+    results = {"file": args.file, "chars": len(text), "chunk_size": args.chunk_size}
+
+    for strategy, legacy in (("sentences", legacy_chunk_by_sentences),
+                             ("paragraphs", legacy_chunk_by_paragraphs)):
+        method = getattr(chunker, f"chunk_by_{strategy}")
+        results[strategy] = {
+            "legacy": measure(lambda: legacy(text, args.chunk_size, "bench"), text, args.repeats, True),
+            "spans": measure(lambda: method(text, "bench"), text, args.repeats, False),
+            "spans_with_text": measure(lambda: method(text, "bench"), text, args.repeats, True),
+        }
+        results[strategy]["speedup"] = (results[strategy]["legacy"]["seconds"]
+                                        / results[strategy]["spans_with_text"]["seconds"])
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
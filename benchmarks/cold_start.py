@@ -0,0 +1,119 @@
+"""
+Cold start of a one-shot CLI query: index files vs an index bundle
+
+Builds a synthetic flat index (with its BM25 and metadata filter indexes)
+and packs it into a bundle (see bundle.py) in a temporary directory, with
+the query's embedding already in the embedding cache. Each variant then
+runs in a fresh interpreter, so the timings include imports and loading:
+
+    python   the interpreter alone
+    import   import query_retrieve
+    files    Retriever("faiss_index.bin", "chunk_metadata.json").search(...)
+    bundle   Retriever("index.ragb").search(...)
+
+It also times opening (and validating) the bundle in-process against
+verifying every section's checksum.
+
+Run from the repo root:
+    python -m benchmarks.cold_start --vectors 50000 --runs 10
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from bundle import Bundle, build_bundle
+from embedding_cache import EmbeddingCache
+from query_retrieve import EMBEDDING_MODEL
+from store_faiss import store_in_faiss
+from vector_store import VectorStoreWriter
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUERY = "How do I stream chat completion responses?"
+
+WORDS = ("stream", "chat", "completion", "embedding", "token", "model", "request", "response",
+         "batch", "file", "limit", "error", "retry", "function", "tool", "image")
+
+def build_corpus(directory: str, num_vectors: int, dimension: int, batch: int = 10000) -> None:
+    """Write an index, its metadata and a bundle of both, and cache the query's embedding"""
+    rng = np.random.default_rng(0)
+    prefix = os.path.join(directory, "embeddings")
+    with VectorStoreWriter(prefix) as writer:
+        for start in range(0, num_vectors, batch):
+            rows = range(start, min(start + batch, num_vectors))
+            words = rng.choice(WORDS, size=(len(rows), 8))
+            writer.append(rng.standard_normal((len(rows), dimension)).astype("float32"),
+                          [{"text": f"Chunk {i} covers " + " ".join(words[j]),
+                            "metadata": {"doc_id": f"doc_{i // 100}", "strategy": "character",
+                                         "chunk_size": 500},
+                            "start_char": (i % 100) * 400, "end_char": (i % 100) * 400 + 500}
+                           for j, i in enumerate(rows)])
+    with contextlib.redirect_stdout(sys.stderr):
+        store_in_faiss(prefix, os.path.join(directory, "faiss_index.bin"),
+                       os.path.join(directory, "chunk_metadata.json"), "flat", report_recall=False)
+    build_bundle(os.path.join(directory, "index.ragb"), os.path.join(directory, "faiss_index.bin"),
+                 os.path.join(directory, "chunk_metadata.json"), chunk_overlap=100)
+
+    cache = EmbeddingCache(os.path.join(directory, "embedding_cache.db"))
+    cache.put(QUERY, rng.standard_normal(dimension).astype("float32").tolist(), EMBEDDING_MODEL)
+    cache.close()
+
+def time_command(code: str, directory: str, runs: int) -> dict:
+    """Wall-clock milliseconds of `python -c code` in a fresh interpreter"""
+    env = {**os.environ, "PYTHONPATH": REPO_ROOT}
+    # Nothing here may need the API; a missing key shows up as a failure
+    env.pop("OPENAI_API_KEY", None)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=directory, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"p50_ms": statistics.median(timings), "min_ms": min(timings)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    search = f"chunks, _ = retriever.search({QUERY!r}, 5); assert len(chunks) == 5"
+    no_openai = "import sys; assert 'openai' not in sys.modules"
+    commands = {
+        "python": "pass",
+        "import": f"import query_retrieve; {no_openai}",
+        "files": ("from query_retrieve import Retriever; "
+                  f"retriever = Retriever('faiss_index.bin', 'chunk_metadata.json'); {search}; {no_openai}"),
+        "bundle": f"from query_retrieve import Retriever; retriever = Retriever('index.ragb'); {search}; {no_openai}",
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        build_corpus(directory, args.vectors, args.dimension)
+        bundle_path = os.path.join(directory, "index.ragb")
+        results = {"vectors": args.vectors, "dimension": args.dimension, "runs": args.runs,
+                   "bundle_bytes": os.path.getsize(bundle_path)}
+        for name, code in commands.items():
+            results[name] = time_command(code, directory, args.runs)
+            print(f"{name:<7} p50={results[name]['p50_ms']:.1f}ms min={results[name]['min_ms']:.1f}ms",
+                  file=sys.stderr)
+
+        start = time.perf_counter()
+        with Bundle(bundle_path) as bundle:
+            opened = time.perf_counter()
+            corrupted = bundle.verify()
+        results["bundle_open_ms"] = (opened - start) * 1000
+        results["bundle_verify_ms"] = (time.perf_counter() - opened) * 1000
+        results["bundle_corrupted_sections"] = corrupted
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Offline embedding throughput benchmark
+
+Compares the old one-chunk-per-request loop against EmbeddingEngine using a
+deterministic FakeEmbeddingClient with simulated network latency, so it runs
+in CI without an API key.
+
+Run from the repo root:
+    python -m benchmarks.embedding_throughput --chunks 2000 --latency 0.05
+"""
+import argparse
+import json
+import time
+
+from chunker import TextChunker
+from embedding_engine import EmbeddingEngine, FakeEmbeddingClient
+
+def sequential_baseline(client, texts):
+    """One request per chunk, as embed_chunks used to do (without the 0.5s sleep)"""
+    return [client.embeddings.create(input=text, model="text-embedding-ada-002").data[0].embedding
+            for text in texts]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--file", default="data/openai_api_docs.txt")
+    parser.add_argument("--chunks", type=int, default=1000, help="Number of chunks to embed")
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated seconds per request")
+    parser.add_argument("--rps", type=float, default=None, help="Simulated server request limit")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--batch-tokens", type=int, default=50000)
+    parser.add_argument("--skip-baseline", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.file, 'r', encoding='utf-8') as f:
+        text = f.read()
+    chunks = TextChunker(chunk_size=500, chunk_overlap=100).chunk_by_characters(text, "bench")
+    texts = [chunks[i % len(chunks)].text for i in range(args.chunks)]
+
+    results = {"chunks": len(texts), "latency": args.latency}
+
+    if not args.skip_baseline:
+        client = FakeEmbeddingClient(latency=args.latency)
+        start = time.perf_counter()
+        sequential_baseline(client, texts)
+        elapsed = time.perf_counter() - start
+        results["sequential"] = {"seconds": elapsed, "chunks_per_sec": len(texts) / elapsed,
+                                 "requests": client.requests}
+
+    client = FakeEmbeddingClient(latency=args.latency, requests_per_second=args.rps)
+    engine = EmbeddingEngine(client, max_batch_tokens=args.batch_tokens,
+                             concurrency=args.concurrency)
+    start = time.perf_counter()
+    vectors = engine.embed(texts)
+    elapsed = time.perf_counter() - start
+    results["engine"] = {"seconds": elapsed, "chunks_per_sec": len(texts) / elapsed,
+                         "requests": client.requests, "rate_limited": client.rate_limited,
+                         "missing": sum(v is None for v in vectors), **engine.stats}
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Load test for server.py
+
+Fires requests at the service from a fixed number of concurrent clients and
+reports QPS and p50/p95/p99 latency (time to full response, plus time to
+first byte for streamed answers).
+
+Run from the repo root against a running server:
+    python -m benchmarks.load_test --url http://127.0.0.1:8000/answer --requests 500 --concurrency 32
+
+Or self-contained, starting the mock OpenAI API and the server in-process on a
+synthetic index:
+    python -m benchmarks.load_test --self-hosted --requests 500 --concurrency 32
+
+Add --trace to break the server's time down by pipeline stage.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from typing import Dict, List
+from urllib.parse import urlsplit
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+async def send_request(host: str, port: int, path: str, payload: Dict) -> Dict:
+    """POST a JSON body and read the whole response, timing first byte and completion"""
+    body = json.dumps(payload).encode("utf-8")
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"POST {path} HTTP/1.1\r\nHost: {host}\r\n"
+                 f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                 f"Connection: close\r\n\r\n".encode("latin1") + body)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    first_byte = time.perf_counter()
+    await reader.read()
+    finished = time.perf_counter()
+    writer.close()
+
+    return {"status": int(status_line.split()[1]), "ttfb": first_byte - start,
+            "latency": finished - start}
+
+async def run_load(url: str, num_requests: int, concurrency: int, k: int) -> Dict:
+    parts = urlsplit(url)
+    queue = asyncio.Queue()
+    for i in range(num_requests):
+        queue.put_nowait(i)
+    results = []
+
+    async def client():
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            payload = {"query": f"How do I use endpoint number {i % 50}?", "k": k}
+            try:
+                results.append(await send_request(parts.hostname, parts.port or 80,
+                                                   parts.path, payload))
+            except OSError as e:
+                results.append({"status": 0, "error": str(e)})
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r["status"] == 200]
+    latencies = [r["latency"] for r in ok]
+    ttfbs = [r["ttfb"] for r in ok]
+    statuses = {}
+    for r in results:
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+
+    return {
+        "url": url,
+        "requests": num_requests,
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "qps": len(ok) / elapsed,
+        "statuses": statuses,
+        "latency_ms": {p: 1000 * percentile(latencies, q)
+                       for p, q in (("p50", 50), ("p95", 95), ("p99", 99))},
+        "ttfb_ms": {p: 1000 * percentile(ttfbs, q)
+                    for p, q in (("p50", 50), ("p95", 95), ("p99", 99))},
+    }
+
+async def self_hosted(args) -> Dict:
+    """Start the mock OpenAI API and the RAG server in-process, then load test them"""
+    from benchmarks.batch_retrieval import build_corpus
+    from answer_cache import AnswerCache
+    from embedding_cache import EmbeddingCache
+    from mock_openai_server import run_mock_server
+    from query_retrieve import Retriever
+    from server import RAGServer, make_async_client
+    from tracing import enable, stage_stats
+
+    if args.trace:
+        enable()
+
+    mock = run_mock_server(port=0, dimension=args.dimension, latency=args.api_latency,
+                           token_latency=args.token_latency, background=True)
+    base_url = f"http://127.0.0.1:{mock.server_port}/v1"
+
+    with tempfile.TemporaryDirectory() as directory:
+        index_path, metadata_path = build_corpus(directory, args.vectors, args.dimension)
+        server = RAGServer(Retriever(index_path, metadata_path), make_async_client(base_url, api_key="mock"),
+                           cache=EmbeddingCache(os.path.join(directory, "cache.db")),
+                           answer_cache=AnswerCache(os.path.join(directory, "answers.db")),
+                           max_concurrency=args.max_concurrency, max_queue=args.max_queue)
+        listener = await server.serve("127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        async with listener:
+            result = await run_load(f"http://127.0.0.1:{port}{args.path}",
+                                    args.requests, args.concurrency, args.k)
+        result["server"] = dict(server.stats)
+        result["answer_cache"] = server.answer_cache.stats()
+        if args.trace:
+            result["stages"] = stage_stats()
+    mock.shutdown()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000/answer")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--self-hosted", action="store_true",
+                        help="Run the mock API and server in-process")
+    parser.add_argument("--path", default="/answer", help="Endpoint for --self-hosted")
+    parser.add_argument("--vectors", type=int, default=10000)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--api-latency", type=float, default=0.02)
+    parser.add_argument("--token-latency", type=float, default=0.002)
+    parser.add_argument("--max-concurrency", type=int, default=32)
+    parser.add_argument("--max-queue", type=int, default=256)
+    parser.add_argument("--trace", action="store_true",
+                        help="With --self-hosted, record spans and report per-stage timings")
+    args = parser.parse_args()
+
+    if args.self_hosted:
+        result = asyncio.run(self_hosted(args))
+    else:
+        result = asyncio.run(run_load(args.url, args.requests, args.concurrency, args.k))
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
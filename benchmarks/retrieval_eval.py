@@ -0,0 +1,345 @@
+"""
+Retrieval benchmark and evaluation harness
+
+For every chunking strategy and index type, chunks the documents under
+--data, embeds them, builds the index with store_in_faiss and queries it
+through Retriever. It reports:
+    build time, on-disk size of the index, metadata, BM25 and filter files,
+    resident memory of the loaded retriever,
+    per-query latency percentiles, batch throughput,
+    recall@k / MRR@10 against a labelled query set, and ANN recall vs exact search.
+
+The labelled queries are generated from the chunks in chunk_metadata.json.
+Each is a word window from one line of a chunk, with some words dropped; a
+retrieved chunk counts as relevant if it contains the whole window. The
+queries can also be loaded from a JSONL file of {"query", "answer"}.
+
+By default embeddings are synthetic (hashed bag-of-words, so similar texts
+get similar vectors) and the run is fully offline. With --embedder openai,
+real embeddings are recorded in --cache on the first run and read back from
+it afterwards.
+
+Disk and memory are reported separately: `*_bytes` are file sizes and
+`disk_bytes` their total, while `index_memory_bytes` is the size of the FAISS
+index as loaded, `load_rss_bytes` the process's resident memory growth over
+Retriever.load() and `resident_rss_bytes` its growth up to the end of the
+index's runs, which adds the memory-mapped pages queries touched. The RSS
+figures need /proc (Linux) and are approximate, since freed memory is reused.
+
+--compression, --dimensions and --reduction build every index compressed the
+same way (see store_faiss.py), so their footprint and recall can be compared
+with an uncompressed run.
+
+--rerankers adds, for every mode, runs that over-fetch --rerank-candidates
+chunks and re-rank them (see reranker.py) under each of --rerank-budgets-ms,
+so end-to-end latency and recall/MRR can be read against plain k-NN runs of
+the same index. "lexical" needs no model; cross-encoders need
+sentence-transformers.
+
+Results are written as JSON. Passing an earlier results file as --baseline
+lists any run whose recall/MRR dropped or whose latency rose beyond the
+tolerances, and exits non-zero if there are any.
+
+Run from the repo root:
+    python -m benchmarks.retrieval_eval --output results.json
+    python -m benchmarks.retrieval_eval --baseline results.json --output new.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import re
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+
+from benchmarks.load_test import percentile
+from bm25_index import bm25_paths, bm25_prefix
+from embed_chunks import embed_chunks
+from embedding_cache import EmbeddingCache
+from embedding_engine import EmbeddingEngine, FakeEmbeddingClient, hashed_embedding
+from ingest import iter_ingested
+from metadata_filter import filter_paths, filter_prefix
+from metadata_store import store_paths
+from query_retrieve import SEARCH_MODES, Retriever, get_embeddings
+from reranker import DEFAULT_CANDIDATES, get_reranker
+from store_faiss import COMPRESSIONS, INDEX_TYPES, REDUCTIONS, rerank_vectors_path, store_in_faiss
+
+# (chunk_size, chunk_overlap) per strategy; the token strategy counts tokens
+STRATEGY_SIZES = {
+    "characters": (500, 100),
+    "sentences": (500, 100),
+    "paragraphs": (500, 100),
+    "tokens": (128, 32),
+}
+
+K_VALUES = (1, 5, 10)
+
+def make_queries(texts: List[str], num_queries: int, seed: int = 0,
+                 min_words: int = 6, max_words: int = 12, keep: float = 0.7) -> List[Dict]:
+    """Labelled queries: a word window from one line of a text, with some words dropped"""
+    rng = random.Random(seed)
+    queries = []
+    answers = set()
+    for _ in range(num_queries * 20):
+        if len(queries) >= num_queries:
+            break
+        lines = [line for line in rng.choice(texts).split("\n") if len(line.split()) >= min_words]
+        if not lines:
+            continue
+        words = list(re.finditer(r"\S+", rng.choice(lines)))
+        size = rng.randint(min_words, min(max_words, len(words)))
+        first = rng.randrange(len(words) - size + 1)
+        window = words[first:first + size]
+        answer = window[0].string[window[0].start():window[-1].end()]
+        if answer in answers:
+            continue
+        answers.add(answer)
+        kept = [w.group() for w in window if rng.random() < keep] or [window[0].group()]
+        queries.append({"query": " ".join(kept), "answer": answer})
+    return queries
+
+def load_queries(args) -> List[Dict]:
+    if args.queries:
+        with open(args.queries, 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    with open(args.labels_from, 'r') as f:
+        texts = [record["text"] for record in json.load(f).values()]
+    return make_queries(texts, args.num_queries, args.seed)
+
+def rank_metrics(results: List[List[Dict]], queries: List[Dict]) -> Dict[str, float]:
+    """recall@k (any relevant chunk in the top k) and MRR@10 over labelled queries"""
+    first_hits = []
+    for chunks, query in zip(results, queries):
+        rank = next((i + 1 for i, chunk in enumerate(chunks) if query["answer"] in chunk["text"]), None)
+        first_hits.append(rank)
+    n = max(len(first_hits), 1)
+    metrics = {f"recall@{k}": sum(r is not None and r <= k for r in first_hits) / n for k in K_VALUES}
+    metrics["mrr@10"] = sum(1 / r for r in first_hits if r is not None and r <= 10) / n
+    return metrics
+
+def budget_ms(value: str) -> Optional[float]:
+    """Re-ranking budget argument: milliseconds, or "none" for unlimited"""
+    return None if value.lower() == "none" else float(value)
+
+def file_bytes(*paths: str) -> int:
+    return sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+
+def rss_bytes() -> Optional[int]:
+    """Resident set size of this process, or None without /proc"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+def rss_growth(before: Optional[int]) -> Optional[int]:
+    after = rss_bytes()
+    return after - before if before is not None and after is not None else None
+
+def evaluate(retriever: Retriever, queries: List[Dict], vectors: List[List[float]],
+             mode: str, batch: bool) -> Dict:
+    """Per-query latency, batch throughput and ranking quality for one retrieval mode"""
+    k = max(K_VALUES)
+    latencies = []
+    results = []
+    for query, vector in zip(queries, vectors):
+        start = time.perf_counter()
+        chunks, _ = retriever.search_embedded(query["query"], vector, k, mode)
+        latencies.append(time.perf_counter() - start)
+        results.append(chunks)
+
+    run = {"latency_ms": {p: 1000 * percentile(latencies, q)
+                          for p, q in (("p50", 50), ("p95", 95), ("p99", 99))}}
+    if batch:
+        # Query embeddings are already cached, so this times lookup + one search call
+        start = time.perf_counter()
+        retriever.search_batch([q["query"] for q in queries], k)
+        run["batch_qps"] = len(queries) / (time.perf_counter() - start)
+    run.update(rank_metrics(results, queries))
+    return run
+
+def run_strategy(strategy: str, args, queries: List[Dict], client, directory: str) -> List[Dict]:
+    chunk_size, chunk_overlap = STRATEGY_SIZES[strategy]
+    prefix = os.path.join(directory, strategy)
+    cache = EmbeddingCache(args.cache or os.path.join(directory, "cache.db"))
+    engine = EmbeddingEngine(client, model=args.model)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        chunks = [chunk for document in iter_ingested(args.data, chunk_size, chunk_overlap,
+                                                      strategy, workers=1)
+                  for chunk in document.chunks]
+        texts = [chunk.text for chunk in chunks]
+        embed_chunks(chunks, prefix, engine=engine, cache=cache)
+        vectors = get_embeddings([q["query"] for q in queries], model=args.model,
+                                 api_client=client, cache=cache)
+
+    # Only queries whose answer survives chunking intact can be scored
+    labelled = [i for i, q in enumerate(queries) if any(q["answer"] in text for text in texts)]
+    queries = [queries[i] for i in labelled]
+    vectors = [vectors[i] for i in labelled]
+
+    runs = []
+    for index_type in args.index_types:
+        index_dir = os.path.join(directory, f"{strategy}_{index_type}")
+        os.makedirs(index_dir)
+        index_path = os.path.join(index_dir, "faiss_index.bin")
+        metadata_path = os.path.join(index_dir, "chunk_metadata.json")
+        with contextlib.redirect_stdout(sys.stderr):
+            summary = store_in_faiss(prefix, index_path, metadata_path, index_type,
+                                     compression=args.compression, dimensions=args.dimensions,
+                                     reduction=args.reduction)
+
+        retriever = Retriever(index_path, metadata_path, api_client=client, cache=cache)
+        # The previous index's retriever is released by now, so its memory is not counted
+        rss_before_load = rss_bytes()
+        retriever.load()
+        footprint = {
+            "index_bytes": file_bytes(index_path),
+            "vectors_bytes": file_bytes(f"{prefix}.npy"),
+            "metadata_bytes": file_bytes(*store_paths(os.path.splitext(metadata_path)[0])),
+            "bm25_bytes": file_bytes(*bm25_paths(bm25_prefix(index_path)).values()),
+            "filters_bytes": file_bytes(*filter_paths(filter_prefix(index_path)).values()),
+            "rerank_vectors_bytes": file_bytes(rerank_vectors_path(index_path)),
+        }
+        # Everything the retriever serves from; the vector store is only read at build time
+        footprint["disk_bytes"] = sum(value for key, value in footprint.items() if key != "vectors_bytes")
+        footprint["index_memory_bytes"] = int(faiss.serialize_index(retriever.index).size)
+        footprint["load_rss_bytes"] = rss_growth(rss_before_load)
+        index_runs = []
+        # Plain k-NN first, then each re-ranker under each budget
+        rerankings = [(None, None)] + [(name, budget) for name in args.rerankers
+                                       for budget in args.rerank_budgets_ms]
+        for mode in args.modes:
+            for reranker, budget in rerankings:
+                retriever.reranker = get_reranker(reranker) if reranker else None
+                retriever.rerank_candidates = args.rerank_candidates
+                retriever.rerank_budget_ms = budget
+                run = {"strategy": strategy, "index_type": index_type, "mode": mode,
+                       "compression": args.compression, "dimensions": args.dimensions,
+                       "chunk_size": chunk_size, "chunk_overlap": chunk_overlap,
+                       "chunks": len(chunks), "labelled_queries": len(queries),
+                       "build_seconds": summary["build_seconds"], "params": summary["params"],
+                       **footprint}
+                if reranker:
+                    run.update(reranker=reranker, rerank_candidates=args.rerank_candidates,
+                               rerank_budget_ms=budget)
+                if "recall" in summary:
+                    run["ann_recall@10"] = summary["recall"]["recall"]
+                    if "reranked_recall" in summary["recall"]:
+                        run["reranked_ann_recall@10"] = summary["recall"]["reranked_recall"]
+                run.update(evaluate(retriever, queries, vectors, mode,
+                                    batch=mode == "vector" and not reranker))
+                index_runs.append(run)
+                label = (f"{reranker}@{'unlimited' if budget is None else f'{budget}ms'}"
+                         if reranker else "k-NN")
+                print(f"{strategy:<10} {index_type:<8} {mode:<6} {label:<18} "
+                      f"recall@5={run['recall@5']:.3f} mrr@10={run['mrr@10']:.3f} "
+                      f"p50={run['latency_ms']['p50']:.2f}ms", file=sys.stderr)
+        resident = rss_growth(rss_before_load)
+        for run in index_runs:
+            run["resident_rss_bytes"] = resident
+        runs.extend(index_runs)
+    cache.close()
+    return runs
+
+def run_key(run: Dict) -> str:
+    key = f"{run['strategy']}/{run['index_type']}/{run['mode']}"
+    if run.get("compression", "none") != "none" or run.get("dimensions"):
+        key += f"/{run.get('compression', 'none')}/{run.get('dimensions') or 'full'}"
+    if run.get("reranker"):
+        key += f"/{run['reranker']}@{run['rerank_budget_ms']}"
+    return key
+
+def compare(results: Dict, baseline: Dict, quality_tolerance: float,
+            latency_tolerance: float) -> List[str]:
+    """Regressions against a baseline run: quality drops (absolute) or latency rises (relative)"""
+    previous = {run_key(run): run for run in baseline["runs"]}
+    regressions = []
+    for run in results["runs"]:
+        old = previous.get(run_key(run))
+        if old is None:
+            continue
+        for metric in [f"recall@{k}" for k in K_VALUES] + ["mrr@10"]:
+            if run[metric] < old[metric] - quality_tolerance:
+                regressions.append(f"{run_key(run)} {metric} {old[metric]:.3f} -> {run[metric]:.3f}")
+        for p in ("p50", "p95"):
+            before, after = old["latency_ms"][p], run["latency_ms"][p]
+            if after > before * (1 + latency_tolerance):
+                regressions.append(f"{run_key(run)} latency {p} {before:.3f}ms -> {after:.3f}ms")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--data", default="data", help="Directory of documents to index")
+    parser.add_argument("--labels-from", default="chunk_metadata.json",
+                        help="Chunk metadata to generate labelled queries from")
+    parser.add_argument("--queries", default=None, help='JSONL of {"query", "answer"} instead')
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--strategies", nargs="+", choices=list(STRATEGY_SIZES),
+                        default=list(STRATEGY_SIZES))
+    parser.add_argument("--index-types", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES))
+    parser.add_argument("--compression", choices=COMPRESSIONS, default="none")
+    parser.add_argument("--dimensions", type=int, default=None,
+                        help="Reduce vectors to this many dimensions inside the index")
+    parser.add_argument("--reduction", choices=REDUCTIONS, default="pca")
+    parser.add_argument("--modes", nargs="+", choices=SEARCH_MODES, default=["vector", "hybrid"])
+    parser.add_argument("--rerankers", nargs="+", default=[],
+                        help="Also run with these re-rankers: cross-encoder names or 'lexical'")
+    parser.add_argument("--rerank-candidates", type=int, default=DEFAULT_CANDIDATES)
+    parser.add_argument("--rerank-budgets-ms", nargs="+", type=budget_ms, default=[None],
+                        help="Re-ranking latency budgets to compare; 'none' is unlimited")
+    parser.add_argument("--embedder", choices=("hashed", "openai"), default="hashed")
+    parser.add_argument("--dimension", type=int, default=256, help="Dimension of hashed embeddings")
+    parser.add_argument("--model", default="text-embedding-ada-002")
+    parser.add_argument("--cache", default=None,
+                        help="Embedding cache to record/replay real embeddings (default: temporary)")
+    parser.add_argument("--output", default=None, help="Write results JSON here")
+    parser.add_argument("--baseline", default=None, help="Earlier results JSON to check for regressions")
+    parser.add_argument("--quality-tolerance", type=float, default=0.02)
+    parser.add_argument("--latency-tolerance", type=float, default=0.5)
+    args = parser.parse_args()
+
+    if args.embedder == "hashed":
+        client = FakeEmbeddingClient(args.dimension, embedding_function=hashed_embedding)
+    else:
+        from embed_chunks import get_client
+        client = get_client()
+
+    queries = load_queries(args)
+    results = {
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("output", "baseline")},
+        "environment": {"python": platform.python_version(), "faiss": faiss.__version__,
+                        "numpy": np.__version__, "faiss_threads": faiss.omp_get_max_threads(),
+                        "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "queries": len(queries),
+        "runs": [],
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        for strategy in args.strategies:
+            results["runs"].extend(run_strategy(strategy, args, queries, client, directory))
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            results["regressions"] = compare(results, json.load(f), args.quality_tolerance,
+                                             args.latency_tolerance)
+        exit_code = 1 if results["regressions"] else 0
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+    sys.exit(exit_code)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import List, Dict, Tuple, Iterable, Optional
+
+import numpy as np
+
+from bundle import FILES
+
+# Identifiers such as `chat.completions.create`, `max_tokens` or `/v1/embeddings`
+# are kept whole and also split into their parts, so both exact and partial
+# identifier queries match.
+COMPOUND_TOKEN = re.compile(r"[a-z0-9_]+(?:[./:-][a-z0-9_]+)+|[a-z0-9_]+")
+WORD_TOKEN = re.compile(r"[a-z0-9_]+")
+
+# Terms longer than this are truncated in the on-disk vocabulary
+MAX_TERM_BYTES = 48
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms for BM25, including whole compound identifiers"""
+    text = text.lower()
+    tokens = []
+    for match in COMPOUND_TOKEN.finditer(text):
+        token = match.group()
+        tokens.append(token)
+        if not token.isalnum():
+            parts = WORD_TOKEN.findall(token)
+            if len(parts) > 1:
+                tokens.extend(parts)
+    return tokens
+
+def term_key(term: str) -> bytes:
+    """Vocabulary key of a term; terms sharing their first MAX_TERM_BYTES bytes share a key"""
+    return term.encode("utf-8")[:MAX_TERM_BYTES]
+
+def bm25_paths(prefix: str) -> Dict[str, str]:
+    """Files making up a BM25 index"""
+    paths = {name: f"{prefix}.{name}.npy" for name in ("vocab", "offsets", "docs", "tfs", "doclens")}
+    paths["meta"] = f"{prefix}.meta.json"
+    return paths
+
+class BM25Builder:
+    """Accumulates postings for documents added in position order, then writes them to disk"""
+
+    def __init__(self):
+        self.postings: Dict[bytes, List[Tuple[int, int]]] = {}
+        self.doc_lengths: List[int] = []
+
+    def add(self, text: str) -> None:
+        position = len(self.doc_lengths)
+        tokens = tokenize(text)
+        self.doc_lengths.append(len(tokens))
+        # Counted per key, so long terms truncated to the same key post this document once
+        for key, tf in Counter(term_key(t) for t in tokens).items():
+            self.postings.setdefault(key, []).append((position, tf))
+
+    def save(self, prefix: str, k1: float = 1.2, b: float = 0.75) -> None:
+        """Write a sorted vocabulary, CSR-style postings and document lengths"""
+        paths = bm25_paths(prefix)
+        terms = sorted(self.postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(self.postings[term])
+
+        docs = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.float32)
+        for i, term in enumerate(terms):
+            postings = np.array(self.postings[term], dtype=np.int64).reshape(-1, 2)
+            docs[offsets[i]:offsets[i + 1]] = postings[:, 0]
+            tfs[offsets[i]:offsets[i + 1]] = postings[:, 1]
+
+        np.save(paths["vocab"], np.array(terms, dtype=f"S{MAX_TERM_BYTES}"))
+        np.save(paths["offsets"], offsets)
+        np.save(paths["docs"], docs)
+        np.save(paths["tfs"], tfs)
+        np.save(paths["doclens"], np.array(self.doc_lengths, dtype=np.int32))
+        num_docs = len(self.doc_lengths)
+        with open(paths["meta"], "w") as f:
+            json.dump({"num_docs": num_docs, "num_terms": len(terms),
+                       "avg_doc_length": sum(self.doc_lengths) / num_docs if num_docs else 0.0,
+                       "k1": k1, "b": b}, f)
+
+def build_bm25_index(texts: Iterable[str], prefix: str) -> None:
+    """Build and save a BM25 index over texts given in position order"""
+    builder = BM25Builder()
+    for text in texts:
+        builder.add(text)
+    builder.save(prefix)
+
+class BM25Index:
+    """
+    Memory-mapped BM25 index over chunk positions.
+
+    Term lookup is a binary search in the sorted vocabulary, and scoring
+    touches only the postings of the query's terms.
+    """
+
+    def __init__(self, prefix: str, sections=FILES):
+        paths = bm25_paths(prefix)
+        meta = sections.json(paths["meta"])
+        self.num_docs = meta["num_docs"]
+        self.k1 = meta["k1"]
+        self.b = meta["b"]
+        self.vocab = sections.array(paths["vocab"])
+        self.offsets = sections.array(paths["offsets"])
+        self.docs = sections.array(paths["docs"])
+        self.tfs = sections.array(paths["tfs"])
+
+        # Per-document length normalisation, k1 * (1 - b + b * dl / avgdl)
+        avg_doc_length = meta["avg_doc_length"] or 1.0
+        doc_lengths = sections.array(paths["doclens"])
+        self._norms = (self.k1 * (1 - self.b + self.b * doc_lengths / avg_doc_length)).astype(np.float32)
+
+    def _postings(self, key: bytes):
+        key = np.array(key, dtype=self.vocab.dtype)
+        i = int(np.searchsorted(self.vocab, key))
+        if i >= len(self.vocab) or self.vocab[i] != key:
+            return None
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.docs[start:end], self.tfs[start:end]
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every chunk for the query"""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for key, query_tf in Counter(term_key(t) for t in tokenize(query)).items():
+            postings = self._postings(key)
+            if postings is None:
+                continue
+            docs, tfs = postings
+            df = len(docs)
+            idf = math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+            # Each term's postings hold a document at most once, so fancy-index += is safe
+            scores[docs] += query_tf * idf * tfs * (self.k1 + 1) / (tfs + self._norms[docs])
+        return scores
+
+    def search(self, query: str, k: int = 10,
+               mask: Optional[np.ndarray] = None) -> Tuple[List[int], List[float]]:
+        """Top-k chunk positions by BM25 score (only chunks matching some query term, and `mask` if given)"""
+        scores = self.scores(query)
+        if mask is not None:
+            scores[~mask] = 0
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return [], []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return top.tolist(), scores[top].tolist()
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int, rrf_k: int = 60) -> Tuple[List[int], List[float]]:
+    """Fuse ranked lists of positions: score = sum over lists of 1 / (rrf_k + rank)"""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, position in enumerate(ranking, start=1):
+            fused[position] = fused.get(position, 0.0) + 1.0 / (rrf_k + rank)
+    ordered = sorted(fused.items(), key=lambda item: (-item[1], item[0]))[:k]
+    return [position for position, _ in ordered], [score for _, score in ordered]
+
+def bm25_prefix(index_file: str) -> str:
+    """Prefix of the BM25 index stored alongside a FAISS index file"""
+    return os.path.splitext(index_file)[0] + "_bm25"
@@ -0,0 +1,414 @@
+"""
+Single-file, versioned index bundle
+
+A bundle (index.ragb) holds everything retrieval needs in one file:
+
+    magic "RAGBNDL\\0" | uint32 format version | uint32 reserved | uint64 manifest length
+    manifest (JSON) | sections, each starting on a 4096-byte boundary
+
+The manifest records the embedding model and dimension, the chunking
+parameters, the vector count, the index type and search parameters, and
+each section's offset, length and SHA-256. The sections are the files
+store_faiss.py writes next to an index: the FAISS index ("index.faiss"),
+the metadata store ("metadata.bin", "metadata.idx.npy"), the BM25 and
+filter indexes ("bm25.*", "filters.*") and any re-ranking vectors
+("vectors.npy"). `.npy` sections and the metadata blob are memory-mapped in
+place, and so, on FAISS versions with a zero-copy reader, are the index's
+vectors: loading a bundle reads little more than headers, however large it is.
+
+Opening a bundle validates it in O(1): magic and format version, file size
+against the manifest, section bounds, and the vector count against the row
+counts in the sections' headers (Retriever also checks the loaded index's
+size and dimension). The checksums are only read back by `verify`, which
+hashes every section.
+
+This module only imports numpy at load time; FAISS and the pipeline
+modules are imported when a bundle is built, queried or its index read.
+
+Usage:
+    python bundle.py build --output index.ragb      # from faiss_index.bin + chunk_metadata.*
+    python bundle.py info index.ragb
+    python bundle.py verify index.ragb
+    python bundle.py query index.ragb "How do I stream responses?"
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+MAGIC = b"RAGBNDL\x00"
+FORMAT_VERSION = 1
+
+# Sections start on page boundaries so they can be mapped directly
+ALIGNMENT = 4096
+
+_HEADER = struct.Struct("<8sIIQ")
+
+def is_bundle(path: str) -> bool:
+    """Whether a file starts with the bundle magic"""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+class SectionView:
+    """Read-only byte range of a memory-mapped file; slicing returns bytes"""
+
+    def __init__(self, buffer: mmap.mmap, offset: int, length: int, owned: bool = False):
+        self._buffer = buffer
+        self.offset = offset
+        self.length = length
+        self._owned = owned
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, key: slice) -> bytes:
+        start, stop, _ = key.indices(self.length)
+        return self._buffer[self.offset + start:self.offset + stop]
+
+    def close(self) -> None:
+        if self._owned:
+            self._buffer.close()
+
+class FileSections:
+    """Sections read from separate files on disk, by path"""
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(path)
+
+    def array(self, path: str) -> np.ndarray:
+        return np.load(path, mmap_mode="r")
+
+    def json(self, path: str):
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def buffer(self, path: str):
+        with open(path, "rb") as f:
+            # mmap cannot map an empty file
+            if not os.fstat(f.fileno()).st_size:
+                return b""
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return SectionView(mapped, 0, len(mapped), owned=True)
+
+FILES = FileSections()
+
+class Bundle:
+    """
+    An open bundle; offers the FileSections interface over its sections, by name.
+
+    Raises ValueError if the file is not a bundle, is of an unknown format
+    version, or its manifest does not match the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            header = self._file.read(_HEADER.size)
+            if len(header) < _HEADER.size or header[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not an index bundle")
+            _, version, _, manifest_length = _HEADER.unpack(header)
+            if version != FORMAT_VERSION:
+                raise ValueError(f"{path} is bundle format {version}; this version reads {FORMAT_VERSION}")
+            self.manifest = json.loads(self._file.read(manifest_length))
+            self.sections: Dict[str, Dict] = self.manifest["sections"]
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.validate()
+        except Exception:
+            self._file.close()
+            raise
+
+    @property
+    def id(self) -> str:
+        """Content identifier, derived from the section checksums"""
+        return self.manifest["id"]
+
+    @property
+    def num_vectors(self) -> int:
+        return self.manifest["vectors"]
+
+    @property
+    def embedding_model(self) -> str:
+        return self.manifest["embedding"]["model"]
+
+    @property
+    def dimension(self) -> int:
+        return self.manifest["embedding"]["dimension"]
+
+    @property
+    def index_params(self) -> Dict:
+        return dict(self.manifest["index"].get("params", {}))
+
+    def validate(self) -> None:
+        """O(1) consistency checks of the manifest against the file and the sections' headers"""
+        size = os.fstat(self._file.fileno()).st_size
+        if size != self.manifest["file_size"]:
+            raise ValueError(f"{self.path} is {size} bytes but its manifest says "
+                             f"{self.manifest['file_size']}; it is truncated or was modified")
+        for name, section in self.sections.items():
+            if section["offset"] % ALIGNMENT or section["offset"] + section["length"] > size:
+                raise ValueError(f"Section {name} of {self.path} is out of bounds")
+        for name in ("index.faiss", "metadata.bin", "metadata.idx.npy"):
+            if name not in self.sections:
+                raise ValueError(f"{self.path} has no {name} section")
+
+        rows = {"metadata": self.array("metadata.idx.npy").shape[0] - 1}
+        for prefix in ("bm25", "filters"):
+            if self.exists(f"{prefix}.meta.json"):
+                rows[prefix] = self.json(f"{prefix}.meta.json")["num_docs"]
+        if self.exists("vectors.npy"):
+            vectors = self.array("vectors.npy")
+            rows["vectors"] = vectors.shape[0]
+            if vectors.shape[1] != self.dimension:
+                raise ValueError(f"Re-ranking vectors in {self.path} have {vectors.shape[1]} dimensions, "
+                                 f"not {self.dimension}")
+        for name, count in rows.items():
+            if count != self.num_vectors:
+                raise ValueError(f"{self.path} holds {self.num_vectors} vectors but its {name} "
+                                 f"section has {count} rows")
+
+    def _section(self, name: str) -> Tuple[int, int]:
+        section = self.sections.get(name)
+        if section is None:
+            raise KeyError(f"{self.path} has no {name} section")
+        return section["offset"], section["length"]
+
+    def exists(self, name: str) -> bool:
+        return name in self.sections
+
+    def array(self, name: str) -> np.ndarray:
+        """A .npy section as a read-only array over the mapped file"""
+        offset, length = self._section(name)
+        header = memoryview(self._mmap)[offset:offset + min(length, ALIGNMENT)]
+        version = np.lib.format.read_magic(_Reader(header))
+        reader = _Reader(header, 8)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(reader)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(reader)
+        return np.ndarray(shape, dtype=dtype, buffer=self._mmap, offset=offset + reader.position,
+                          order="F" if fortran_order else "C")
+
+    def json(self, name: str):
+        offset, length = self._section(name)
+        return json.loads(self._mmap[offset:offset + length])
+
+    def buffer(self, name: str) -> SectionView:
+        offset, length = self._section(name)
+        return SectionView(self._mmap, offset, length)
+
+    def read_index(self):
+        """
+        Read the FAISS index section
+
+        Where FAISS supports it (ZeroCopyIOReader), the index's vectors and
+        codes are views of the mapped file rather than copies, so loading
+        costs about as much as parsing the index's headers; such an index
+        must not be added to or trained. Otherwise the section is streamed
+        into memory as faiss.read_index would read the file.
+        """
+        import faiss
+        offset, length = self._section("index.faiss")
+        data = np.frombuffer(self._mmap, dtype=np.uint8, count=length, offset=offset)
+        if hasattr(faiss, "ZeroCopyIOReader"):
+            index = faiss.read_index(faiss.ZeroCopyIOReader(faiss.swig_ptr(data), length))
+            # FAISS's convention for keeping Python buffers alive as long as the index using them
+            index.referenced_objects = [data]
+            return index
+
+        position = 0
+        def read(size: int) -> bytes:
+            nonlocal position
+            block = self._mmap[offset + position:offset + min(position + size, length)]
+            position += len(block)
+            return block
+        return faiss.read_index(faiss.PyCallbackIOReader(read))
+
+    def verify(self) -> List[str]:
+        """Names of the sections whose content does not match its checksum (reads every section)"""
+        corrupted = []
+        for name, section in self.sections.items():
+            digest = hashlib.sha256()
+            view = memoryview(self._mmap)
+            for start in range(section["offset"], section["offset"] + section["length"], 1 << 20):
+                digest.update(view[start:min(start + (1 << 20), section["offset"] + section["length"])])
+            view.release()
+            if digest.hexdigest() != section["sha256"]:
+                corrupted.append(name)
+        return corrupted
+
+    def close(self) -> None:
+        """Unmap the file; arrays and views taken from the bundle must no longer be used"""
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Arrays over the mapping are still alive; the mapping goes when they do
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class _Reader:
+    """Minimal file-like reader over a memoryview, for numpy's .npy header parsers"""
+
+    def __init__(self, view: memoryview, position: int = 0):
+        self._view = view
+        self.position = position
+
+    def read(self, size: int) -> bytes:
+        data = bytes(self._view[self.position:self.position + size])
+        self.position += len(data)
+        return data
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+def bundle_sections(index_path: str = "faiss_index.bin",
+                    metadata_path: str = "chunk_metadata.json") -> Dict[str, str]:
+    """Section name -> file for the index files store_faiss.py wrote"""
+    from bm25_index import bm25_paths, bm25_prefix
+    from metadata_filter import filter_paths, filter_prefix
+    from metadata_store import store_paths
+    from query_retrieve import ensure_metadata_store
+    from store_faiss import rerank_vectors_path
+
+    blob_path, offsets_path = store_paths(ensure_metadata_store(metadata_path))
+    files = {"index.faiss": index_path, "metadata.bin": blob_path, "metadata.idx.npy": offsets_path}
+    for paths, prefix, name in ((bm25_paths, bm25_prefix(index_path), "bm25"),
+                                (filter_paths, filter_prefix(index_path), "filters")):
+        if os.path.exists(paths(prefix)["meta"]):
+            files.update({section: paths(prefix)[key] for key, section in paths(name).items()})
+    if os.path.exists(rerank_vectors_path(index_path)):
+        files["vectors.npy"] = rerank_vectors_path(index_path)
+    return files
+
+def build_bundle(output: str = "index.ragb", index_path: str = "faiss_index.bin",
+                 metadata_path: str = "chunk_metadata.json",
+                 embedding_model: str = "text-embedding-ada-002",
+                 chunk_overlap: Optional[int] = None) -> Dict:
+    """
+    Pack an index built by store_faiss.py and its metadata into one bundle file
+
+    The chunking strategy and size are read from the chunk metadata; the
+    overlap is not recorded there, so pass it to have it in the manifest.
+    The file is written to a temporary name and renamed into place. Returns
+    the manifest.
+    """
+    from metadata_store import MetadataStore
+    from query_retrieve import load_index_params
+    from store_faiss import index_config_path
+
+    files = bundle_sections(index_path, metadata_path)
+    with open(index_config_path(index_path), 'r') as f:
+        config = json.load(f)
+    store = MetadataStore(os.path.splitext(files["metadata.bin"])[0])
+    try:
+        first = store[0]["metadata"] if len(store) else {}
+        num_records = len(store)
+    finally:
+        store.close()
+    if config["ntotal"] != num_records:
+        raise ValueError(f"{index_path} holds {config['ntotal']} vectors but {metadata_path} has "
+                         f"{num_records} records; rebuild them together")
+
+    names = sorted(files)
+    sizes = {name: os.path.getsize(files[name]) for name in names}
+    digests = {name: _file_digest(files[name]) for name in names}
+    manifest = {
+        "format": "rag-bundle",
+        "version": FORMAT_VERSION,
+        "id": hashlib.sha256("".join(digests[name] for name in names).encode()).hexdigest()[:16],
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "embedding": {"model": embedding_model, "dimension": config["dimension"]},
+        "chunking": {"strategy": first.get("strategy"), "chunk_size": first.get("chunk_size"),
+                     "chunk_overlap": chunk_overlap},
+        "vectors": num_records,
+        "index": {"type": config["index_type"], "params": load_index_params(index_path)},
+        "sections": {},
+        "file_size": 0,
+    }
+
+    # Lay the sections out after the manifest, which grows as their offsets are filled in
+    data_start = ALIGNMENT
+    while True:
+        offset = data_start
+        for name in names:
+            manifest["sections"][name] = {"offset": offset, "length": sizes[name], "sha256": digests[name]}
+            offset = _align(offset + sizes[name])
+        manifest["file_size"] = manifest["sections"][names[-1]]["offset"] + sizes[names[-1]]
+        encoded = json.dumps(manifest, indent=2).encode("utf-8")
+        if _HEADER.size + len(encoded) <= data_start:
+            break
+        data_start = _align(_HEADER.size + len(encoded))
+
+    tmp_path = output + ".tmp"
+    with open(tmp_path, "wb") as out:
+        out.write(_HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(encoded)))
+        out.write(encoded)
+        for name in names:
+            out.seek(manifest["sections"][name]["offset"])
+            with open(files[name], "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    out.write(block)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, output)
+    return manifest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build, inspect and query single-file index bundles")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Pack faiss_index.bin and chunk_metadata.* into a bundle")
+    build.add_argument("--index", default="faiss_index.bin")
+    build.add_argument("--metadata", default="chunk_metadata.json")
+    build.add_argument("--output", default="index.ragb")
+    build.add_argument("--model", default="text-embedding-ada-002", help="Model the vectors were embedded with")
+    build.add_argument("--chunk-overlap", type=int, default=None)
+    for name, description in (("info", "Print a bundle's manifest"),
+                              ("verify", "Check every section against its checksum")):
+        commands.add_parser(name, help=description).add_argument("bundle")
+    query = commands.add_parser("query", help="Retrieve the top-k chunks for a query")
+    query.add_argument("bundle")
+    query.add_argument("query")
+    query.add_argument("-k", type=int, default=5)
+    query.add_argument("--mode", default="vector")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        manifest = build_bundle(args.output, args.index, args.metadata, args.model, args.chunk_overlap)
+        print(f"Wrote {args.output} ({manifest['file_size'] / 1e6:.1f} MB, {manifest['vectors']} vectors, "
+              f"id {manifest['id']})")
+    elif args.command == "info":
+        with Bundle(args.bundle) as bundle:
+            print(json.dumps(bundle.manifest, indent=2))
+    elif args.command == "verify":
+        with Bundle(args.bundle) as bundle:
+            corrupted = bundle.verify()
+        print(f"Corrupted sections: {', '.join(corrupted)}" if corrupted else "All sections match")
+        raise SystemExit(1 if corrupted else 0)
+    else:
+        from query_retrieve import Retriever
+        chunks, scores = Retriever(args.bundle).search(args.query, args.k, args.mode)
+        for rank, (chunk, score) in enumerate(zip(chunks, scores), 1):
+            print(f"{rank}. [{score:.4f}] {chunk['metadata'].get('doc_id')} "
+                  f"{chunk['start_char']}-{chunk['end_char']}: {chunk['text'][:200]!r}")
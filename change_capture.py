@@ -0,0 +1,249 @@
+"""
+Change-data capture: re-chunk and re-embed only the edited regions of documents
+
+`diff_document` compares a document's new text with the chunks indexed for
+it in an IncrementalIndex (their text and start_char/end_char):
+
+    1. Each stored chunk, in offset order, is anchored in the new text: at
+       its old offset plus the shift of the previous anchor or, failing
+       that, at the next occurrence of its text a little further on. A chunk
+       anchored at its old offset is kept; one anchored elsewhere is moved
+       (same text, so it keeps its ID and vector and only its offsets are
+       updated); one whose text no longer appears is removed.
+    2. Every stretch of the new text that no anchored chunk covers and that
+       holds more than whitespace is re-chunked with the document's strategy
+       (padded by the overlap for character chunks, so new chunks overlap
+       their neighbours as usual). Only these chunks are embedded.
+
+A one-line edit to a large document therefore embeds and indexes the one or
+two chunks around it; the chunks after it only move, which touches their
+metadata rows but not the FAISS index. Chunk boundaries next to an edit
+can differ from those of a from-scratch re-chunk; a full rebuild with
+incremental_index.py restores them.
+
+`sync_directory` does this for every document under data/ whose content
+hash changed since it was last synced, indexes new documents and drops
+deleted ones, then checkpoints the index. With --watch it polls the
+directory every few seconds. Retriever (or `server.py --index
+incremental_index.bin`) picks up each checkpoint on its next query.
+
+Usage:
+    python change_capture.py                  # sync data/ once
+    python change_capture.py --watch --interval 5
+"""
+import argparse
+import hashlib
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from chunker import Chunk, TextChunker
+from embedding_cache import EmbeddingCache
+from embedding_engine import EmbeddingEngine
+from incremental_index import INCREMENTAL_INDEX, IncrementalIndex, chunk_ids
+from ingest import document_id, find_documents, normalize_text, read_document
+
+# How far past its expected offset a stored chunk's text is looked for
+# (beyond the document's overall change in length)
+ANCHOR_WINDOW = 4096
+
+@dataclass
+class DocumentChanges:
+    """Chunk-level changes that bring one document's indexed chunks up to date"""
+    doc_id: str
+    added: List[Chunk] = field(default_factory=list)
+    moved: List[Tuple[int, Chunk]] = field(default_factory=list)
+    removed: List[int] = field(default_factory=list)
+    kept: int = 0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.moved or self.removed)
+
+def anchor_chunks(stored: List[Tuple[int, Dict]], text: str, window: int) -> List[Optional[int]]:
+    """New start offset of each stored chunk's text in `text` (None if gone), monotone in chunk order"""
+    anchors = []
+    shift = 0
+    floor = 0
+    for _, record in stored:
+        chunk_text = record["text"]
+        expected = record["start_char"] + shift
+        if expected >= floor and text.startswith(chunk_text, expected):
+            position = expected
+        else:
+            position = text.find(chunk_text, floor, max(expected, floor) + window + len(chunk_text))
+        if not chunk_text or position < 0:
+            anchors.append(None)
+            continue
+        anchors.append(position)
+        shift = position - record["start_char"]
+        floor = position + 1
+    return anchors
+
+def diff_document(doc_id: str, text: str, stored: List[Tuple[int, Dict]], chunker: TextChunker,
+                  strategy: str = "characters") -> DocumentChanges:
+    """
+    Changes turning a document's stored chunks (IncrementalIndex.document_chunks) into chunks of `text`
+
+    Stored chunks are matched as they are; only uncovered stretches of the
+    new text are re-chunked with `chunker` and `strategy`.
+    """
+    changes = DocumentChanges(doc_id)
+    old_length = max((record["end_char"] for _, record in stored), default=0)
+    anchors = anchor_chunks(stored, text, abs(len(text) - old_length) + ANCHOR_WINDOW)
+
+    covered = []
+    for (old_id, record), position in zip(stored, anchors):
+        if position is None:
+            changes.removed.append(old_id)
+        elif position == record["start_char"]:
+            changes.kept += 1
+            covered.append((position, record["end_char"]))
+        else:
+            end = position + len(record["text"])
+            changes.moved.append((old_id, Chunk(record["text"], record["metadata"], position, end)))
+            covered.append((position, end))
+    covered.sort()
+
+    # Uncovered stretches with content, each with the start of the anchor before it
+    gaps = []
+    cursor, previous_start = 0, -1
+    for start, end in covered + [(len(text), len(text))]:
+        if start > cursor and text[cursor:start].strip():
+            gaps.append((cursor, start, previous_start))
+        if end > cursor:
+            cursor, previous_start = end, start
+
+    anchored_starts = {start for start, _ in covered}
+    pad = chunker.chunk_overlap if strategy == "characters" else 0
+    for start, end, previous_start in gaps:
+        # Overlap the neighbouring chunks, but never start where the previous one does
+        region_start = max(start - pad, previous_start + 1, 0)
+        region_end = min(end + pad, len(text)) if end < len(text) else end
+        for chunk in getattr(chunker, f"chunk_by_{strategy}")(text[region_start:region_end], doc_id):
+            if region_start + chunk.start_char not in anchored_starts:
+                changes.added.append(Chunk(chunk.text, chunk.metadata, region_start + chunk.start_char,
+                                           region_start + chunk.end_char))
+    return changes
+
+def embed_texts(texts: List[str], engine: EmbeddingEngine, cache: EmbeddingCache) -> Tuple[np.ndarray, int]:
+    """Vectors for texts, from the embedding cache or the API; returns them and the number embedded"""
+    vectors = cache.get_many(texts, engine.model)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        new_vectors = engine.embed([texts[i] for i in missing])
+        if any(vector is None for vector in new_vectors):
+            raise RuntimeError(f"Failed to embed {sum(v is None for v in new_vectors)} chunks")
+        cache.put_many([texts[i] for i in missing], new_vectors, engine.model)
+        for i, vector in zip(missing, new_vectors):
+            vectors[i] = vector
+    return np.array(vectors, dtype=np.float32).reshape(len(texts), -1), len(missing)
+
+def apply_changes(index: IncrementalIndex, changes: DocumentChanges, engine: EmbeddingEngine,
+                  cache: EmbeddingCache) -> int:
+    """
+    Upsert added chunks, move shifted ones, then delete removed ones; returns the number of texts embedded
+
+    Upserting first means an interrupted sync leaves extra chunks rather
+    than missing ones, and the next sync finds them stale.
+    """
+    embedded, new_ids = 0, set()
+    if changes.added:
+        vectors, embedded = embed_texts([chunk.text for chunk in changes.added], engine, cache)
+        # New chunks repeating the text of ones still in the document take the next occurrence
+        removed = set(changes.removed)
+        taken = {i for i in index.document_ids(changes.doc_id) if i not in removed}
+        new_ids = set(index.upsert(changes.added, vectors, chunk_ids(changes.added, taken)))
+    index.move([old_id for old_id, _ in changes.moved],
+               [(chunk.start_char, chunk.end_char) for _, chunk in changes.moved])
+    # A removed chunk whose text was re-added elsewhere was just replaced under the same ID
+    index.delete([old_id for old_id in changes.removed if old_id not in new_ids])
+    return embedded
+
+def sync_directory(index: IncrementalIndex, directory: str = "data", engine: EmbeddingEngine = None,
+                   cache: EmbeddingCache = None, chunk_size: int = 500, chunk_overlap: int = 100,
+                   strategy: str = "characters", file_state: Optional[Dict] = None) -> Dict[str, int]:
+    """
+    Bring the index up to date with the documents under a directory
+
+    Documents already indexed keep the strategy and chunk size their chunks
+    were built with; new ones use the given ones. Pass the same `file_state`
+    dict to repeated calls to skip re-reading files whose mtime and size are
+    unchanged. Returns totals of chunks added, moved, removed, kept and embedded.
+    """
+    if engine is None:
+        from embed_chunks import get_client
+        engine = EmbeddingEngine(get_client())
+    if cache is None:
+        cache = EmbeddingCache()
+    file_state = {} if file_state is None else file_state
+    totals = {"documents": 0, "added": 0, "moved": 0, "removed": 0, "kept": 0, "embedded": 0}
+
+    present = set()
+    for path in find_documents(directory):
+        doc_id = document_id(path, directory)
+        present.add(doc_id)
+        st = os.stat(path)
+        if file_state.get(doc_id) == (st.st_mtime_ns, st.st_size):
+            continue
+        text = normalize_text(read_document(path))
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        if index.document_hash(doc_id) != digest:
+            stored = index.document_chunks(doc_id)
+            metadata = stored[0][1]["metadata"] if stored else {}
+            chunker = TextChunker(metadata.get("chunk_size", chunk_size), chunk_overlap)
+            # Chunk metadata names the strategy in the singular ("character")
+            doc_strategy = f"{metadata['strategy']}s" if "strategy" in metadata else strategy
+            changes = diff_document(doc_id, text, stored, chunker, doc_strategy)
+            embedded = apply_changes(index, changes, engine, cache)
+            index.set_document_hash(doc_id, digest)
+            print(f"{doc_id}: {len(changes.added)} added ({embedded} embedded), {len(changes.moved)} moved, "
+                  f"{len(changes.removed)} removed, {changes.kept} unchanged")
+            totals["documents"] += 1
+            totals["embedded"] += embedded
+            for key in ("added", "moved", "removed"):
+                totals[key] += len(getattr(changes, key))
+            totals["kept"] += changes.kept
+        file_state[doc_id] = (st.st_mtime_ns, st.st_size)
+
+    for doc_id in index.indexed_documents():
+        if doc_id not in present:
+            totals["removed"] += index.delete_document(doc_id)
+            index.set_document_hash(doc_id, None)
+            file_state.pop(doc_id, None)
+            totals["documents"] += 1
+            print(f"{doc_id}: deleted")
+
+    if totals["documents"]:
+        index.checkpoint()
+    return totals
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-chunk and re-embed only the edited parts of documents")
+    parser.add_argument("directory", nargs="?", default="data")
+    parser.add_argument("--index", default=INCREMENTAL_INDEX, help="ID-mapped index (see incremental_index.py)")
+    parser.add_argument("--metadata-db", default=None, help="Defaults to the index path with a .db suffix")
+    parser.add_argument("--chunk-size", type=int, default=500, help="For new documents")
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--strategy", choices=("characters", "sentences", "paragraphs", "tokens"),
+                        default="characters", help="For new documents")
+    parser.add_argument("--watch", action="store_true", help="Keep polling the directory for changes")
+    parser.add_argument("--interval", type=float, default=2.0, help="Seconds between polls with --watch")
+    args = parser.parse_args()
+
+    with IncrementalIndex(args.index, args.metadata_db) as index:
+        file_state = {}
+        while True:
+            totals = sync_directory(index, args.directory, chunk_size=args.chunk_size,
+                                    chunk_overlap=args.chunk_overlap, strategy=args.strategy,
+                                    file_state=file_state)
+            if not args.watch:
+                print(totals)
+                break
+            try:
+                time.sleep(args.interval)
+            except KeyboardInterrupt:
+                break
@@ -1,172 +1,320 @@
 import re
-from typing import List, Dict, Any
-from dataclasses import dataclass
+from bisect import bisect_right
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+
+from tokenizer import get_tokenizer
+
+# Boundaries used by the sentence and paragraph strategies. A paragraph
+# boundary also swallows the indentation that follows the blank line.
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+PARAGRAPH_BOUNDARY = re.compile(r'\n\s*\n\s*')
+NON_SPACE = re.compile(r'\S')
+
+# Sentences repeated at the start of the next sentence chunk
+SENTENCE_OVERLAP = 2
 
-@dataclass
 class Chunk:
-    """Represents a chunk of text with metadata"""
-    text: str
-    metadata: Dict[str, Any]
-    start_char: int
-    end_char: int
+    """
+    Represents a chunk of text with metadata
+
+    A chunk is the span [start_char, end_char) of its source document. Chunks
+    made by TextChunker hold a reference to the source text and only slice
+    `text` out of it when it is first read, and all chunks from one call share
+    a single metadata dict.
+    """
+    __slots__ = ("_text", "_source", "_source_start", "metadata", "start_char", "end_char")
+
+    def __init__(self, text: Optional[str], metadata: Dict[str, Any], start_char: int, end_char: int):
+        self._text = text
+        self._source = None
+        self._source_start = 0
+        self.metadata = metadata
+        self.start_char = start_char
+        self.end_char = end_char
+
+    @classmethod
+    def from_span(cls, source: str, source_start: int, start_char: int, end_char: int,
+                  metadata: Dict[str, Any]) -> "Chunk":
+        """Chunk whose text is source[start_char - source_start:end_char - source_start]"""
+        chunk = cls(None, metadata, start_char, end_char)
+        chunk._source = source
+        chunk._source_start = source_start
+        return chunk
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self._source[self.start_char - self._source_start:
+                                      self.end_char - self._source_start]
+            self._source = None
+        return self._text
+
+    @text.setter
+    def text(self, value: str) -> None:
+        self._text = value
+        self._source = None
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Chunk):
+            return NotImplemented
+        return (self.start_char, self.end_char, self.metadata, self.text) == \
+            (other.start_char, other.end_char, other.metadata, other.text)
+
+    def __repr__(self) -> str:
+        return (f"Chunk(text={self.text!r}, metadata={self.metadata!r}, "
+                f"start_char={self.start_char!r}, end_char={self.end_char!r})")
 
 class TextChunker:
+    """
+    Splits documents into chunks
+
+    chunk_size and chunk_overlap are in characters, except for the token
+    strategy, which measures both in tokens of the shared tokenizer.
+    """
+
     def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
 
     def chunk_by_characters(self, text: str, doc_id: str = None) -> List[Chunk]:
         """Split text into chunks of fixed size with overlap"""
-        chunks = []
-        start = 0
-        
-        while start < len(text):
-            # Calculate end position with overlap
-            end = start + self.chunk_size
-            
-            # If this is not the first chunk, include overlap
-            if start > 0:
-                start = start - self.chunk_overlap
-            
-            # Extract chunk
-            chunk_text = text[start:end]
-            
-            # Create chunk with metadata
-            chunk = Chunk(
-                text=chunk_text,
-                metadata={
-                    "doc_id": doc_id,
-                    "strategy": "character",
-                    "chunk_size": self.chunk_size,
-                },
-                start_char=start,
-                end_char=end
-            )
-            chunks.append(chunk)
-            
-            # Move to next chunk
-            start = end
-            
-            # Break if we've reached the end
-            if start >= len(text):
-                break
-        
-        return chunks
+        return list(self.iter_chunks_by_characters([text], doc_id))
 
     def chunk_by_sentences(self, text: str, doc_id: str = None) -> List[Chunk]:
         """Split text into chunks by sentences"""
-        # Simple sentence detection (can be improved with nltk)
-        sentences = re.split(r'(?<=[.!?])\s+', text)
-        chunks = []
-        current_chunk = []
-        current_length = 0
-        start_char = 0
-        
-        for sentence in sentences:
-            sentence_length = len(sentence)
-            
-            # If adding this sentence would exceed chunk size
-            if current_length + sentence_length > self.chunk_size and current_chunk:
-                # Create chunk from accumulated sentences
-                chunk_text = ' '.join(current_chunk)
-                end_char = start_char + len(chunk_text)
-                
-                chunk = Chunk(
-                    text=chunk_text,
-                    metadata={
-                        "doc_id": doc_id,
-                        "strategy": "sentence",
-                        "chunk_size": self.chunk_size,
-                    },
-                    start_char=start_char,
-                    end_char=end_char
-                )
-                chunks.append(chunk)
-                
-                # Start new chunk with overlap
-                overlap_text = ' '.join(current_chunk[-2:])  # Keep last 2 sentences
-                current_chunk = [overlap_text]
-                current_length = len(overlap_text)
-                start_char = end_char - len(overlap_text)
-            
-            current_chunk.append(sentence)
-            current_length += sentence_length + 1  # +1 for space
-        
-        # Don't forget the last chunk
-        if current_chunk:
-            chunk_text = ' '.join(current_chunk)
-            chunk = Chunk(
-                text=chunk_text,
-                metadata={
-                    "doc_id": doc_id,
-                    "strategy": "sentence",
-                    "chunk_size": self.chunk_size,
-                },
-                start_char=start_char,
-                end_char=start_char + len(chunk_text)
-            )
-            chunks.append(chunk)
-        
-        return chunks
+        return list(self.iter_chunks_by_sentences([text], doc_id))
 
     def chunk_by_paragraphs(self, text: str, doc_id: str = None) -> List[Chunk]:
         """Split text into chunks by paragraphs"""
-        # Split text into paragraphs (double newline)
-        paragraphs = re.split(r'\n\s*\n', text)
-        chunks = []
-        current_chunk = []
-        current_length = 0
-        start_char = 0
+        return list(self.iter_chunks_by_paragraphs([text], doc_id))
+
+    def chunk_by_tokens(self, text: str, doc_id: str = None) -> List[Chunk]:
+        """Split text into chunks of at most chunk_size tokens, overlapping by chunk_overlap tokens"""
+        return list(self.iter_chunks_by_tokens([text], doc_id))
+
+    def iter_chunks_by_characters(self, blocks: Iterable[str], doc_id: str = None) -> Iterator[Chunk]:
+        """
+        Streaming version of chunk_by_characters over text arriving in blocks
+
+        Each chunk is yielded as soon as its end is read; only the overlap window
+        plus the current block is held in memory.
+        """
+        metadata = self._metadata(doc_id, "character")
+        buffer = ""
+        buffer_start = 0  # offset of buffer[0] in the whole text
+        start = 0
         
-        for paragraph in paragraphs:
-            paragraph = paragraph.strip()
-            if not paragraph:
-                continue
-                
-            para_length = len(paragraph)
+        for block in blocks:
+            buffer += block
+            buffer_end = buffer_start + len(buffer)
             
-            # If adding this paragraph would exceed chunk size
-            if current_length + para_length > self.chunk_size and current_chunk:
-                # Create chunk from accumulated paragraphs
-                chunk_text = '\n\n'.join(current_chunk)
-                end_char = start_char + len(chunk_text)
+            # Emit every chunk whose end has been read
+            while start + self.chunk_size <= buffer_end:
+                end = start + self.chunk_size
                 
-                chunk = Chunk(
-                    text=chunk_text,
-                    metadata={
-                        "doc_id": doc_id,
-                        "strategy": "paragraph",
-                        "chunk_size": self.chunk_size,
-                    },
-                    start_char=start_char,
-                    end_char=end_char
-                )
-                chunks.append(chunk)
-                
-                # Start new chunk
-                current_chunk = []
-                current_length = 0
-                start_char = end_char + 2  # +2 for double newline
+                # If this is not the first chunk, include overlap
+                chunk_start = start - self.chunk_overlap if start > 0 else start
+                yield Chunk.from_span(buffer, buffer_start, chunk_start, end, metadata)
+                start = end
             
-            current_chunk.append(paragraph)
-            current_length += para_length + 2  # +2 for paragraph separator
-        
-        # Don't forget the last chunk
-        if current_chunk:
-            chunk_text = '\n\n'.join(current_chunk)
-            chunk = Chunk(
-                text=chunk_text,
-                metadata={
-                    "doc_id": doc_id,
-                    "strategy": "paragraph",
-                    "chunk_size": self.chunk_size,
-                },
-                start_char=start_char,
-                end_char=start_char + len(chunk_text)
-            )
-            chunks.append(chunk)
+            # Keep only what the next chunk (including its overlap) still needs
+            keep_from = max(buffer_start, start - self.chunk_overlap if start > 0 else start)
+            buffer = buffer[keep_from - buffer_start:]
+            buffer_start = keep_from
         
-        return chunks
+        # Last, shorter chunk
+        buffer_end = buffer_start + len(buffer)
+        if start < buffer_end:
+            chunk_start = start - self.chunk_overlap if start > 0 else start
+            yield Chunk.from_span(buffer, buffer_start, chunk_start, buffer_end, metadata)
+
+    def iter_chunks_by_tokens(self, blocks: Iterable[str], doc_id: str = None) -> Iterator[Chunk]:
+        """
+        Streaming version of chunk_by_tokens over text arriving in blocks
+
+        The text is encoded once, a line-aligned piece per block, and chunks
+        are cut from the resulting token start offsets, so chunk text is never
+        re-tokenised. Each chunk, overlap included, holds at most
+        chunk_size tokens.
+        """
+        tokenizer = get_tokenizer()
+        metadata = self._metadata(doc_id, "token")
+        step = max(1, self.chunk_size - self.chunk_overlap)
+        buffer = ""           # encoded text from the next chunk's first token onwards
+        buffer_start = 0      # offset of buffer[0] in the whole text
+        token_starts = []     # offsets of the tokens in buffer
+        pending = ""          # text after the last line break, not yet encoded
+
+        def encode(text: str) -> None:
+            nonlocal buffer
+            offset = buffer_start + len(buffer)
+            token_starts.extend(offset + start for start in tokenizer.token_offsets(text))
+            buffer += text
+
+        for block in blocks:
+            pending += block
+            # Encode up to a lone line break between text: no token spans one,
+            # so the split tokenises exactly as the whole text would
+            cut = pending.rfind("\n")
+            while cut >= 0 and (cut == 0 or cut + 1 == len(pending)
+                                or pending[cut - 1].isspace() or pending[cut + 1].isspace()):
+                cut = pending.rfind("\n", 0, cut)
+            if cut < 0:
+                continue
+            encode(pending[:cut + 1])
+            pending = pending[cut + 1:]
+
+            # Emit every chunk whose end is followed by a token already encoded
+            first = 0
+            while first + self.chunk_size < len(token_starts):
+                yield Chunk.from_span(buffer, buffer_start, token_starts[first],
+                                      token_starts[first + self.chunk_size], metadata)
+                first += step
+            if first:
+                keep_from = token_starts[first]
+                buffer = buffer[keep_from - buffer_start:]
+                buffer_start = keep_from
+                del token_starts[:first]
+
+        encode(pending)
+        buffer_end = buffer_start + len(buffer)
+        first = 0
+        while first < len(token_starts):
+            last = first + self.chunk_size
+            yield Chunk.from_span(buffer, buffer_start, token_starts[first],
+                                  token_starts[last] if last < len(token_starts) else buffer_end,
+                                  metadata)
+            if last >= len(token_starts):
+                break
+            first += step
+
+    def iter_chunks_by_sentences(self, blocks: Iterable[str], doc_id: str = None) -> Iterator[Chunk]:
+        """
+        Streaming version of chunk_by_sentences over text arriving in blocks
+
+        Consecutive sentences are packed into chunks of at most chunk_size
+        characters (a longer sentence becomes a chunk of its own), and the last
+        SENTENCE_OVERLAP sentences of a chunk start the next one.
+        """
+        return self._iter_segment_chunks(blocks, doc_id, "sentence", SENTENCE_BOUNDARY,
+                                         SENTENCE_OVERLAP)
+
+    def iter_chunks_by_paragraphs(self, blocks: Iterable[str], doc_id: str = None) -> Iterator[Chunk]:
+        """
+        Streaming version of chunk_by_paragraphs over text arriving in blocks
+
+        Consecutive paragraphs are packed into chunks of at most chunk_size
+        characters (a longer paragraph becomes a chunk of its own).
+        """
+        return self._iter_segment_chunks(blocks, doc_id, "paragraph", PARAGRAPH_BOUNDARY, 0)
+
+    def _iter_segment_chunks(self, blocks: Iterable[str], doc_id: str, strategy: str,
+                             boundary: re.Pattern, overlap: int) -> Iterator[Chunk]:
+        """
+        Pack the segments between `boundary` matches into chunks
+
+        Each buffer is scanned once for boundaries, giving sorted lists of
+        segment start/end offsets, and chunks are cut from those with a binary
+        search per chunk. Chunks are spans of the original text, so their
+        offsets are exact and whatever separated the segments is kept verbatim.
+        Text from the start of the next chunk onwards is carried into the next
+        block.
+        """
+        metadata = self._metadata(doc_id, strategy)
+        carry = ""
+        carry_start = 0  # offset of carry[0] in the whole text
+        started = False
+
+        for block in blocks:
+            buffer = carry + block
+            buffer_start = carry_start
+            if not started:
+                # Skip leading whitespace so the first chunk starts on text
+                match = NON_SPACE.search(buffer)
+                if match is None:
+                    carry, carry_start = "", buffer_start + len(buffer)
+                    continue
+                buffer, buffer_start = buffer[match.start():], buffer_start + match.start()
+                started = True
+
+            starts, ends, tail_start = segment_spans(buffer, boundary, final=False)
+            groups, next_segment = pack_segments(starts, ends, self.chunk_size, overlap, final=False)
+            for first, last in groups:
+                yield Chunk.from_span(buffer, buffer_start, buffer_start + starts[first],
+                                      buffer_start + ends[last - 1], metadata)
+
+            keep_from = starts[next_segment] if next_segment < len(starts) else tail_start
+            carry, carry_start = buffer[keep_from:], buffer_start + keep_from
+
+        starts, ends, _ = segment_spans(carry, boundary, final=True)
+        groups, _ = pack_segments(starts, ends, self.chunk_size, overlap, final=True)
+        for first, last in groups:
+            yield Chunk.from_span(carry, carry_start, carry_start + starts[first],
+                                  carry_start + ends[last - 1], metadata)
+
+    def _metadata(self, doc_id: str, strategy: str) -> Dict[str, Any]:
+        """Metadata shared by every chunk of one document"""
+        return {
+            "doc_id": doc_id,
+            "strategy": strategy,
+            "chunk_size": self.chunk_size,
+        }
+
+def rstripped_end(text: str, end: int, floor: int = 0) -> int:
+    """Offset just past the last non-whitespace character of text[floor:end]"""
+    while end > floor and text[end - 1].isspace():
+        end -= 1
+    return end
+
+def segment_spans(text: str, boundary: re.Pattern, final: bool) -> Tuple[List[int], List[int], int]:
+    """
+    Start/end offsets of the non-empty, whitespace-trimmed pieces between boundary matches
+
+    Unless `final`, the text may continue in the next block: a match is only
+    trusted once non-whitespace text follows it, and the piece after the last
+    trusted match is left out. Also returns where that piece starts.
+    """
+    safe = rstripped_end(text, len(text))
+    starts, ends = [], []
+    pos = 0
+    for match in boundary.finditer(text):
+        end, next_pos = match.span()
+        if not final and next_pos >= safe:
+            break
+        # Only whitespace on a line before a boundary can trail a piece
+        if end > pos and text[end - 1].isspace():
+            end = rstripped_end(text, end, pos)
+        if end > pos:
+            starts.append(pos)
+            ends.append(end)
+        pos = next_pos
+    if final and safe > pos:
+        starts.append(pos)
+        ends.append(safe)
+    return starts, ends, pos
+
+def pack_segments(starts: List[int], ends: List[int], chunk_size: int, overlap: int,
+                  final: bool) -> Tuple[List[Tuple[int, int]], int]:
+    """
+    Greedily group consecutive segments into chunks spanning at most chunk_size characters
+
+    Returns half-open (first, last) segment index ranges and the segment the
+    next chunk would start at. Unless `final`, a chunk is only emitted once a
+    following segment is known not to fit in it.
+    """
+    groups = []
+    i = 0
+    while i < len(starts):
+        # Segment ends are sorted, so the last one that fits is a binary search away
+        j = max(bisect_right(ends, starts[i] + chunk_size), i + 1)
+        if j >= len(starts):
+            if final:
+                groups.append((i, len(starts)))
+                i = len(starts)
+            break
+        groups.append((i, j))
+        i = max(j - overlap, i + 1)
+    return groups, i
 
 # Example usage
 if __name__ == "__main__":
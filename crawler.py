@@ -0,0 +1,300 @@
+"""
+Concurrent, resumable document crawler
+
+Pages are fetched on a bounded thread pool. Each host gets at most
+`per_host` requests in flight and an AdaptiveRateLimiter (see
+embedding_engine.py) spacing request starts by `delay` seconds, which also
+pauses the host on 429s. HTML is turned into text (and, when following
+links, its links extracted) with BeautifulSoup in a process pool, so the
+download threads only do I/O.
+
+Every fetched page is recorded in a JSON manifest (crawl_manifest.json)
+with its ETag, Last-Modified, content hash, output file and links. Re-runs
+send If-None-Match / If-Modified-Since, so unchanged pages come back as
+304s and are neither downloaded nor re-cleaned; a 200 whose content hash is
+unchanged is not re-cleaned either. The manifest is rewritten after every
+saved page, so an interrupted crawl resumes where it stopped.
+
+Usage:
+    python crawler.py https://platform.openai.com/docs/quickstart --depth 1
+    python mock_docs_server.py &  # local fixture site
+    python crawler.py http://127.0.0.1:8002/docs/ --depth 2 --delay 0
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urldefrag, urljoin, urlsplit
+
+import requests
+
+from embedding_engine import AdaptiveRateLimiter, _header_seconds
+
+CRAWL_MANIFEST = "crawl_manifest.json"
+
+USER_AGENT = "rag-from-scratch-crawler/1.0"
+
+@dataclass
+class Page:
+    """A page to fetch and the name of the text file it is saved as"""
+    name: str
+    url: str
+    depth: int = 0
+
+@dataclass
+class FetchResult:
+    """Outcome of one fetch: status "fetched", "not_modified", "unchanged" or "failed" """
+    page: Page
+    status: str
+    content: bytes = b""
+    headers: Dict[str, str] = field(default_factory=dict)
+    error: Optional[str] = None
+
+def page_name(url: str) -> str:
+    """File-name-safe name for a discovered page, from its host and path"""
+    parts = urlsplit(url)
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", f"{parts.netloc}{parts.path}").strip("_") or "index"
+
+def extract_page(content: bytes, content_type: str, base_url: str,
+                 follow_links: bool) -> Tuple[str, List[str]]:
+    """
+    Visible text of a page, one phrase per line, and the absolute URLs it links to
+
+    Runs in the cleaning process pool. Non-HTML responses are decoded as-is.
+    """
+    if "html" not in content_type:
+        return content.decode("utf-8", errors="replace"), []
+
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, "html.parser")
+    links = []
+    if follow_links:
+        links = [urldefrag(urljoin(base_url, a["href"]))[0] for a in soup.find_all("a", href=True)]
+
+    # Remove script and style elements
+    for script in soup(["script", "style"]):
+        script.decompose()
+
+    # Break into lines, split multi-headlines into a line each and drop blank lines
+    lines = (line.strip() for line in soup.get_text("\n").splitlines())
+    phrases = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return "\n".join(phrase for phrase in phrases if phrase), links
+
+class Crawler:
+    """
+    Bounded-concurrency crawler with per-host politeness and conditional re-fetching.
+
+    `crawl(pages)` fetches the seed pages and, up to `max_depth` links away,
+    pages under the same URL directory as their seed, and writes each page's
+    text to `<output_dir>/<name>.txt`.
+    """
+
+    def __init__(self, output_dir: str = "data", manifest_path: str = CRAWL_MANIFEST,
+                 concurrency: int = 8, per_host: int = 2, delay: float = 1.0,
+                 timeout: float = 30.0, max_retries: int = 2, max_depth: int = 0,
+                 max_pages: int = 100, clean_workers: Optional[int] = None, force: bool = False):
+        self.output_dir = output_dir
+        self.manifest_path = manifest_path
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.delay = delay
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.clean_workers = clean_workers
+        self.force = force
+        self.manifest = self.load_manifest()
+        self._hosts: Dict[str, Tuple[threading.Semaphore, AdaptiveRateLimiter]] = {}
+        self._hosts_lock = threading.Lock()
+        self._local = threading.local()
+        self.stats = {"fetched": 0, "not_modified": 0, "unchanged": 0, "failed": 0,
+                      "bytes": 0, "retries": 0, "seconds": 0.0}
+
+    def load_manifest(self) -> Dict:
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        return {"pages": {}}
+
+    def save_manifest(self) -> None:
+        """Write the manifest atomically, so an interrupted run never leaves it half-written"""
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def output_path(self, page: Page) -> str:
+        return os.path.join(self.output_dir, f"{page.name}.txt")
+
+    def _session(self) -> requests.Session:
+        """One pooled HTTP session per download thread"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.headers["User-Agent"] = USER_AGENT
+        return session
+
+    def _host(self, url: str) -> Tuple[threading.Semaphore, AdaptiveRateLimiter]:
+        host = urlsplit(url).netloc
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = (threading.Semaphore(self.per_host),
+                                     AdaptiveRateLimiter(min_interval=self.delay,
+                                                         max_interval=max(self.delay * 10, 5.0)))
+            return self._hosts[host]
+
+    def fetch(self, page: Page) -> FetchResult:
+        """Fetch one page, revalidating it against the manifest; runs on the download threads"""
+        entry = self.manifest["pages"].get(page.url)
+        headers = {}
+        if entry and not self.force and os.path.exists(self.output_path(page)):
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        slots, limiter = self._host(page.url)
+        attempt = 0
+        while True:
+            with slots:
+                limiter.acquire()
+                try:
+                    response = self._session().get(page.url, headers=headers, timeout=self.timeout)
+                    status, error = response.status_code, None
+                except requests.RequestException as e:
+                    response, status, error = None, None, str(e)
+
+            if status == 429 and attempt < self.max_retries:
+                limiter.on_rate_limited({k.lower(): v for k, v in response.headers.items()})
+            elif (status is None or status >= 500) and attempt < self.max_retries:
+                retry_after = (_header_seconds(response.headers.get("retry-after"))
+                               if response is not None else None)
+                time.sleep(retry_after or min(30.0, 2 ** attempt))
+            else:
+                break
+            attempt += 1
+            with self._hosts_lock:
+                self.stats["retries"] += 1
+
+        if status is None or status >= 400:
+            return FetchResult(page, "failed", error=error or f"HTTP {status}")
+        limiter.on_success()
+        if status == 304:
+            return FetchResult(page, "not_modified")
+        content = response.content
+        response_headers = {"etag": response.headers.get("ETag"),
+                            "last_modified": response.headers.get("Last-Modified"),
+                            "content_type": response.headers.get("Content-Type", "")}
+        if (entry and not self.force and os.path.exists(self.output_path(page))
+                and entry.get("sha256") == hashlib.sha256(content).hexdigest()):
+            return FetchResult(page, "unchanged", content, response_headers)
+        return FetchResult(page, "fetched", content, response_headers)
+
+    def _in_scope(self, url: str, seed: str) -> bool:
+        """Links are followed within the seed's host and URL directory"""
+        seed_parts, parts = urlsplit(seed), urlsplit(url)
+        prefix = seed_parts.path[:seed_parts.path.rfind("/") + 1]
+        return (parts.scheme in ("http", "https") and parts.netloc == seed_parts.netloc
+                and parts.path.startswith(prefix))
+
+    def _record(self, page: Page, result: FetchResult, links: List[str]) -> None:
+        """Update a page's manifest entry (after its text file, if any, is written) and persist it"""
+        entry = self.manifest["pages"].setdefault(page.url, {})
+        entry.update(name=page.name, path=self.output_path(page), fetched_at=time.time(),
+                     status=result.status)
+        if result.status in ("fetched", "unchanged"):
+            entry.update(etag=result.headers.get("etag"),
+                         last_modified=result.headers.get("last_modified"),
+                         sha256=hashlib.sha256(result.content).hexdigest(),
+                         bytes=len(result.content))
+        if result.status == "fetched":
+            entry["links"] = links
+        self.save_manifest()
+
+    def crawl(self, pages: List[Page]) -> Dict:
+        """Fetch the pages (and linked pages up to max_depth), saving each changed page's text"""
+        start = time.perf_counter()
+        os.makedirs(self.output_dir, exist_ok=True)
+        seeds = {}
+        queued = set()
+        fetching, cleaning = {}, {}
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="crawl") as threads, \
+                ProcessPoolExecutor(max_workers=self.clean_workers) as processes:
+
+            def enqueue(page: Page, seed: str) -> None:
+                url = urldefrag(page.url)[0]
+                if url in queued or len(queued) >= self.max_pages:
+                    return
+                queued.add(url)
+                seeds[url] = seed
+                page.url = url
+                fetching[threads.submit(self.fetch, page)] = page
+
+            def follow(page: Page, links: List[str]) -> None:
+                if page.depth >= self.max_depth:
+                    return
+                seed = seeds[page.url]
+                for link in links:
+                    if self._in_scope(link, seed):
+                        enqueue(Page(page_name(link), link, page.depth + 1), seed)
+
+            for page in pages:
+                enqueue(page, page.url)
+
+            while fetching or cleaning:
+                done, _ = wait(list(fetching) + list(cleaning), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in fetching:
+                        page = fetching.pop(future)
+                        result = future.result()
+                        self.stats[result.status] += 1
+                        self.stats["bytes"] += len(result.content)
+                        if result.status == "fetched":
+                            cleaning[processes.submit(extract_page, result.content,
+                                                      result.headers["content_type"], page.url,
+                                                      page.depth < self.max_depth)] = result
+                        elif result.status == "failed":
+                            print(f"Error downloading {page.url}: {result.error}")
+                        else:
+                            self._record(page, result, [])
+                            follow(page, self.manifest["pages"][page.url].get("links", []))
+                    else:
+                        result = cleaning.pop(future)
+                        text, links = future.result()
+                        path = self.output_path(result.page)
+                        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+                            f.write(text)
+                        os.replace(path + ".tmp", path)
+                        print(f"Saved {result.page.url} to {path}")
+                        self._record(result.page, result, links)
+                        follow(result.page, links)
+
+        self.stats["seconds"] = time.perf_counter() - start
+        return dict(self.stats)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent, resumable document crawler")
+    parser.add_argument("urls", nargs="+", help="Seed pages")
+    parser.add_argument("--output", default="data", help="Directory for the pages' text files")
+    parser.add_argument("--manifest", default=CRAWL_MANIFEST)
+    parser.add_argument("--depth", type=int, default=0, help="Follow links this many hops from the seeds")
+    parser.add_argument("--max-pages", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--per-host", type=int, default=2, help="Requests in flight per host")
+    parser.add_argument("--delay", type=float, default=1.0, help="Seconds between request starts per host")
+    parser.add_argument("--clean-workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="Ignore the manifest and re-download everything")
+    args = parser.parse_args()
+
+    crawler = Crawler(args.output, args.manifest, concurrency=args.concurrency, per_host=args.per_host,
+                      delay=args.delay, max_depth=args.depth, max_pages=args.max_pages,
+                      clean_workers=args.clean_workers, force=args.force)
+    print(json.dumps(crawler.crawl([Page(page_name(url), url) for url in args.urls]), indent=2))
@@ -0,0 +1,246 @@
+"""
+Near-duplicate suppression at ingest and retrieval time
+
+Ingest: each chunk's text is reduced to a MinHash signature over its word
+shingles, and locality-sensitive hashing (the signature split into bands)
+finds earlier chunks that may be near duplicates. A chunk whose estimated
+Jaccard similarity with an earlier one reaches the threshold (or whose text
+is identical) is dropped before it is embedded, so repeated boilerplate is
+neither paid for nor indexed. Signatures of the kept chunks are saved as
+`<prefix>.minhash.npy`, row-aligned with the vector store, so a later run
+can deduplicate against the existing corpus.
+
+Retrieval: `mmr` picks k results from a deeper candidate list by maximal
+marginal relevance over the candidates' vectors, skipping any candidate
+whose character span mostly overlaps an already chosen chunk of the same
+document (sliding-window and sentence-overlap chunks). `collapse_overlaps`
+applies only the span rule, for callers without vectors.
+"""
+import hashlib
+import re
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Hash functions per signature; the estimate's standard error is about 1 / sqrt(NUM_PERM)
+NUM_PERM = 64
+
+# Words per shingle
+SHINGLE_SIZE = 3
+
+# Estimated Jaccard similarity at or above which a chunk counts as a duplicate
+DEFAULT_THRESHOLD = 0.9
+
+# Fraction of the shorter chunk's span that, when shared with a chosen
+# chunk of the same document, makes a result redundant
+MAX_SPAN_OVERLAP = 0.5
+
+# Candidates considered per result when diversifying
+DIVERSITY_FETCH_FACTOR = 4
+
+WORD = re.compile(r"\w+")
+
+# Universal hashing (a * x + b) mod p over 32-bit shingle hashes; with a, b < 2**32
+# and p just above 2**32 the products fit in uint64. Fixed seed, so signatures
+# are comparable across runs.
+_PRIME = np.uint64(4294967311)
+_rng = np.random.default_rng(0x5EED)
+_A = _rng.integers(1, 2**32, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, 2**32, size=NUM_PERM, dtype=np.uint64)
+
+def signature_path(prefix: str) -> str:
+    """Path of the MinHash signatures saved next to a vector store"""
+    return f"{prefix}.minhash.npy"
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """Distinct 32-bit hashes of the lowercased word `size`-grams in text"""
+    words = WORD.findall(text.lower())
+    if len(words) <= size:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return np.unique(np.fromiter((zlib.crc32(gram.encode("utf-8")) for gram in grams),
+                                 dtype=np.uint64, count=len(grams)))
+
+def minhash(text: str, shingle_size: int = SHINGLE_SIZE) -> np.ndarray:
+    """MinHash signature (NUM_PERM uint32 values) of a text's shingle set"""
+    hashes = shingles(text, shingle_size)
+    return ((_A[:, None] * hashes[None, :] + _B[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+def estimated_jaccard(a: np.ndarray, b: np.ndarray) -> float:
+    """Jaccard similarity of two shingle sets, estimated from their signatures"""
+    return float(np.count_nonzero(a == b)) / len(a)
+
+def lsh_bands(threshold: float, num_perm: int = NUM_PERM) -> int:
+    """
+    Number of LSH bands for a similarity threshold
+
+    Pairs with similarity s share a band with probability 1 - (1 - s**r)**b;
+    the S-curve's midpoint (1/b)**(1/r) is put at least 0.1 below the threshold
+    so near duplicates are rarely missed, and candidates are verified against
+    the full signature anyway.
+    """
+    options = [b for b in range(1, num_perm + 1) if num_perm % b == 0]
+    for bands in options:
+        rows = num_perm // bands
+        if (1 / bands) ** (1 / rows) <= threshold - 0.1:
+            return bands
+    return options[-1]
+
+class Deduplicator:
+    """
+    Streaming near-duplicate filter over chunk texts.
+
+    `add` registers a text and returns None, or returns the ID of the earlier
+    chunk it duplicates without registering it. IDs are registration order,
+    and `signatures[id]` is that chunk's MinHash signature.
+
+    `add` is `check` followed by `register`. Callers that may still fail to
+    keep a chunk (e.g. its embedding fails) check first and register it only
+    once it is kept, so a lost chunk never stands in for its duplicates.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, shingle_size: int = SHINGLE_SIZE):
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.bands = lsh_bands(threshold)
+        self.rows = NUM_PERM // self.bands
+        self.signatures: List[np.ndarray] = []
+        self._exact: Dict[bytes, int] = {}
+        self._buckets: Dict[Tuple[int, bytes], List[int]] = {}
+        self.stats = {"chunks": 0, "exact_duplicates": 0, "near_duplicates": 0}
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    @classmethod
+    def from_signatures(cls, path: str, **kwargs) -> "Deduplicator":
+        """Seed a deduplicator with the signatures of an existing corpus"""
+        deduplicator = cls(**kwargs)
+        for signature in np.load(path):
+            deduplicator._register(signature)
+        return deduplicator
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def _register(self, signature: np.ndarray) -> int:
+        chunk = len(self.signatures)
+        self.signatures.append(signature)
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, []).append(chunk)
+        return chunk
+
+    def find(self, signature: np.ndarray) -> Optional[int]:
+        """ID of a registered chunk at least `threshold` similar to the signature, if any"""
+        seen = set()
+        for key in self._band_keys(signature):
+            for chunk in self._buckets.get(key, ()):
+                if chunk not in seen:
+                    seen.add(chunk)
+                    if estimated_jaccard(signature, self.signatures[chunk]) >= self.threshold:
+                        return chunk
+        return None
+
+    def check(self, text: str) -> Tuple[Optional[int], Tuple[bytes, Optional[np.ndarray]]]:
+        """
+        ID of the registered chunk a text duplicates (None if none), and the
+        text's fingerprint to pass to `register`; registers nothing
+        """
+        self.stats["chunks"] += 1
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        original = self._exact.get(digest)
+        if original is not None:
+            self.stats["exact_duplicates"] += 1
+            return original, (digest, None)
+        signature = minhash(text, self.shingle_size)
+        original = self.find(signature)
+        if original is not None:
+            self.stats["near_duplicates"] += 1
+        return original, (digest, signature)
+
+    def register(self, fingerprint: Tuple[bytes, Optional[np.ndarray]]) -> Optional[int]:
+        """
+        Register a chunk that passed `check`, unless a chunk registered since
+        duplicates it, whose ID is then returned
+        """
+        digest, signature = fingerprint
+        original = self._exact.get(digest)
+        if original is not None:
+            self.stats["exact_duplicates"] += 1
+            return original
+        original = self.find(signature)
+        if original is not None:
+            self.stats["near_duplicates"] += 1
+            return original
+        self._exact[digest] = self._register(signature)
+        return None
+
+    def add(self, text: str) -> Optional[int]:
+        """Register a chunk unless it duplicates an earlier one, whose ID is then returned"""
+        original, fingerprint = self.check(text)
+        return original if original is not None else self.register(fingerprint)
+
+    def save(self, path: str, ids: Optional[List[int]] = None) -> None:
+        """Write the signatures of the given chunk IDs (all by default) as a (n, NUM_PERM) array"""
+        chosen = self.signatures if ids is None else [self.signatures[i] for i in ids]
+        np.save(path, np.array(chosen, dtype=np.uint32).reshape(-1, NUM_PERM))
+
+def span_overlap(a: Dict, b: Dict) -> float:
+    """Fraction of the shorter chunk's character span shared with the other, if from the same document"""
+    if a.get("metadata", {}).get("doc_id") != b.get("metadata", {}).get("doc_id"):
+        return 0.0
+    shared = min(a["end_char"], b["end_char"]) - max(a["start_char"], b["start_char"])
+    shorter = min(a["end_char"] - a["start_char"], b["end_char"] - b["start_char"])
+    return max(shared, 0) / shorter if shorter > 0 else float(shared >= 0)
+
+def collapse_overlaps(chunks: List[Dict], scores: List[float], k: int,
+                      max_overlap: float = MAX_SPAN_OVERLAP) -> Tuple[List[Dict], List[float]]:
+    """Keep chunks in rank order, dropping any that mostly overlaps a chunk already kept"""
+    kept, kept_scores = [], []
+    for chunk, score in zip(chunks, scores):
+        if len(kept) == k:
+            break
+        if all(span_overlap(chunk, other) < max_overlap for other in kept):
+            kept.append(chunk)
+            kept_scores.append(score)
+    return kept, kept_scores
+
+def mmr(query_vector: Optional[np.ndarray], vectors: np.ndarray, records: List[Dict], k: int,
+        diversity: float = 0.5, max_overlap: float = MAX_SPAN_OVERLAP) -> List[int]:
+    """
+    Maximal marginal relevance over ranked candidates; returns the chosen candidate indices in order
+
+    Each step takes the candidate maximising
+        (1 - diversity) * sim(query, c) - diversity * max sim(c, chosen)
+    with cosine similarities, and candidates whose span overlaps a chosen
+    chunk by `max_overlap` or more are skipped. Without a query vector,
+    relevance falls back to the candidates' rank order.
+    """
+    if not len(records):
+        return []
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    if query_vector is not None:
+        query_vector = np.asarray(query_vector, dtype=np.float32).ravel()
+        relevance = vectors @ (query_vector / max(np.linalg.norm(query_vector), 1e-12))
+    else:
+        relevance = 1.0 - np.arange(len(records), dtype=np.float32) / len(records)
+    similarity = vectors @ vectors.T
+
+    available = np.ones(len(records), dtype=bool)
+    redundancy = np.zeros(len(records), dtype=np.float32)
+    chosen = []
+    while len(chosen) < k and available.any():
+        scores = (1 - diversity) * relevance - diversity * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        chosen.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+        for other in np.flatnonzero(available):
+            if span_overlap(records[best], records[other]) >= max_overlap:
+                available[other] = False
+    return chosen
@@ -1,41 +1,15 @@
-import requests
-import os
-from bs4 import BeautifulSoup
+from crawler import CRAWL_MANIFEST, Crawler, Page
+from download_docs import OPENAI_DOC_PAGES
 
-def download_api_reference():
-    """Download OpenAI API reference"""
-    url = "https://platform.openai.com/docs/api-reference"
+def download_api_reference(output_dir: str = "data", manifest_path: str = CRAWL_MANIFEST):
+    """
+    Download the OpenAI API reference as text to data/openai_api-reference.txt
     
-    # Create data directory if it doesn't exist
-    if not os.path.exists("data"):
-        os.makedirs("data")
-    
-    try:
-        print("Downloading API reference...")
-        response = requests.get(url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Remove script and style elements
-        for script in soup(["script", "style"]):
-            script.decompose()
-        
-        # Get text content
-        text = soup.get_text()
-        
-        # Break into lines and remove leading/trailing space
-        lines = (line.strip() for line in text.splitlines())
-        # Break multi-headlines into a line each
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        # Drop blank lines
-        text = '\n'.join(chunk for chunk in chunks if chunk)
-        
-        # Save to file
-        with open("data/openai_api-reference.txt", 'w', encoding='utf-8') as f:
-            f.write(text)
-        print("Saved to data/openai_api-reference.txt")
-        
-    except Exception as e:
-        print(f"Error downloading API reference: {e}")
+    It is one of the download_docs pages; sharing the crawl manifest, it is
+    only downloaded again if it changed since either script last fetched it.
+    """
+    url = dict(OPENAI_DOC_PAGES)["api-reference"]
+    return Crawler(output_dir, manifest_path).crawl([Page("openai_api-reference", url)])
 
 if __name__ == "__main__":
-    download_api_reference() 
\ No newline at end of file
+    download_api_reference()
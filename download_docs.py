@@ -1,38 +1,27 @@
-import requests
-import os
-import time
+from crawler import CRAWL_MANIFEST, Crawler, Page
 
-def download_openai_docs():
-    """Download OpenAI documentation pages"""
-    # Create docs directory if it doesn't exist
-    if not os.path.exists("data"):
-        os.makedirs("data")
-    
-    # List of documentation pages to download
-    pages = [
-        ("quickstart", "https://platform.openai.com/docs/quickstart"),
-        ("pricing", "https://platform.openai.com/docs/pricing"),
-        ("guides", "https://platform.openai.com/docs/guides"),
-        ("api-reference", "https://platform.openai.com/docs/api-reference"),
-        ("safety", "https://platform.openai.com/docs/safety-best-practices")
-    ]
+# Documentation pages to download, saved as data/openai_<name>.txt
+OPENAI_DOC_PAGES = [
+    ("quickstart", "https://platform.openai.com/docs/quickstart"),
+    ("pricing", "https://platform.openai.com/docs/pricing"),
+    ("guides", "https://platform.openai.com/docs/guides"),
+    ("api-reference", "https://platform.openai.com/docs/api-reference"),
+    ("safety", "https://platform.openai.com/docs/safety-best-practices")
+]
+
+def download_openai_docs(output_dir: str = "data", manifest_path: str = CRAWL_MANIFEST, **kwargs):
+    """
+    Download OpenAI documentation pages as text
     
-    for name, url in pages:
-        try:
-            print(f"Downloading {url}...")
-            response = requests.get(url)
-            
-            # Save raw HTML for now
-            filename = f"data/openai_{name}.txt"
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(response.text)
-            print(f"Saved to {filename}")
-            
-            # Be nice to the server
-            time.sleep(1)
-            
-        except Exception as e:
-            print(f"Error downloading {url}: {e}")
+    Pages are fetched concurrently by crawler.Crawler (one request per second
+    to the host by default) and revalidated against the crawl manifest, so
+    re-runs only download pages that changed.
+    """
+    crawler = Crawler(output_dir, manifest_path, **kwargs)
+    stats = crawler.crawl([Page(f"openai_{name}", url) for name, url in OPENAI_DOC_PAGES])
+    print(f"{stats['fetched']} pages downloaded, {stats['not_modified'] + stats['unchanged']} unchanged, "
+          f"{stats['failed']} failed")
+    return stats
 
 if __name__ == "__main__":
-    download_openai_docs() 
\ No newline at end of file
+    download_openai_docs()
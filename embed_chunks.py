@@ -1,75 +1,183 @@
-import openai
-import time
 import os
 from dotenv import load_dotenv
-from typing import List, Dict
-import json
+from itertools import islice
+from typing import Dict, List, Iterable, Optional, Tuple
 from chunker import Chunk
+from dedup import DEFAULT_THRESHOLD, Deduplicator, signature_path
+from embedding_engine import EmbeddingEngine
+from embedding_cache import EmbeddingCache
+from vector_store import VectorStoreWriter
+from tracing import span, traced, current_span
 
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client
-client = openai.OpenAI(
-    api_key=os.getenv('OPENAI_API_KEY')  # this is also the default, it can be omitted
-)
+# OpenAI client, created on first use so importing this module needs no API key
+_client = None
+
+def get_client():
+    """Return the shared OpenAI client, creating it on first use"""
+    global _client
+    if _client is None:
+        import openai
+        _client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    return _client
 
 def get_embedding(text: str, model: str = "text-embedding-ada-002") -> List[float]:
     """Get embedding for a text chunk"""
-    response = client.embeddings.create(
+    response = get_client().embeddings.create(
         input=text,
         model=model
     )
     return response.data[0].embedding
 
-def embed_chunks(chunks: List[Chunk], output_file: str = "embeddings.json") -> List[Dict]:
-    """Embed all chunks and save results"""
-    embeddings = []
-    total_chunks = len(chunks)
+def embed_cached(texts: List[str], engine: EmbeddingEngine,
+                 cache: EmbeddingCache) -> Tuple[List[Optional[List[float]]], int]:
+    """Vectors for texts, from the cache or the API (None where embedding failed), and the cache hits"""
+    # Reuse cached embeddings; only chunks whose text changed go to the API
+    with span("embedding_cache_lookup", rows=len(texts)):
+        vectors = cache.get_many(texts, engine.model)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    
+    # Embed in token-budgeted batches, several requests in flight at once
+    if missing:
+        with span("embed_batch", rows=len(missing)):
+            new_vectors = engine.embed([texts[i] for i in missing])
+        for i, vector in zip(missing, new_vectors):
+            vectors[i] = vector
+        cache.put_many([texts[i] for i in missing], new_vectors, engine.model)
+    return vectors, len(texts) - len(missing)
+
+@traced()
+def embed_chunks(chunks: Iterable[Chunk], output_prefix: str = "embeddings",
+                 engine: EmbeddingEngine = None,
+                 cache: EmbeddingCache = None,
+                 window_size: int = 2048,
+                 dedup_threshold: Optional[float] = DEFAULT_THRESHOLD,
+                 deduplicator: Optional[Deduplicator] = None) -> int:
+    """
+    Embed all chunks in concurrent batches and save results
     
-    print(f"Starting to embed {total_chunks} chunks...")
+    Vectors go to `<output_prefix>.npy` and chunk text/metadata to
+    `<output_prefix>.jsonl`, written window by window as embeddings arrive.
+    `chunks` may be a generator (e.g. process_docs.stream_document), in which
+    case only one window of chunks is held in memory. Returns the number of
+    chunks embedded.
     
-    for i, chunk in enumerate(chunks):
-        try:
-            # Get embedding
-            vector = get_embedding(chunk.text)
-            
-            # Create embedding record
-            embedding_record = {
-                "text": chunk.text,
-                "embedding": vector,
-                "metadata": chunk.metadata,
-                "start_char": chunk.start_char,
-                "end_char": chunk.end_char
-            }
+    Chunks whose text is identical or near-identical (MinHash Jaccard of at
+    least `dedup_threshold`) to an earlier chunk are dropped before embedding;
+    pass None to keep every chunk, or a `deduplicator` seeded with an existing
+    corpus's signatures. A chunk only counts as seen once it is written:
+    duplicates of a chunk earlier in the same window wait for its embedding,
+    and one of them is embedded in its place only if that fails. Signatures
+    of the embedded chunks are saved to `<output_prefix>.minhash.npy`,
+    row-aligned with the vectors.
+    """
+    engine = engine or EmbeddingEngine(get_client())
+    if cache is None:
+        cache = EmbeddingCache()
+    if deduplicator is None and dedup_threshold:
+        deduplicator = Deduplicator(dedup_threshold)
+    chunks = iter(chunks)
+    total_chunks = 0
+    hits = 0
+    duplicates = 0
+    # Deduplicator ID of each row written, for saving signatures in row order
+    signature_ids = []
+    
+    print("Starting to embed chunks...")
+    
+    with VectorStoreWriter(output_prefix) as writer:
+        while True:
+            window = list(islice(chunks, window_size))
+            if not window:
+                break
+            window_start = total_chunks
+            total_chunks += len(window)
             
-            embeddings.append(embedding_record)
+            # Drop duplicates of chunks already written, in this run or the seeded corpus, and
+            # hold back duplicates of chunks kept earlier in the window until those are embedded
+            fingerprints = [None] * len(window)
+            held: Dict[int, List[int]] = {}
+            candidates = list(range(len(window)))
+            if deduplicator is not None:
+                with span("dedup", rows=len(window)):
+                    in_window = Deduplicator(deduplicator.threshold, deduplicator.shingle_size)
+                    kept = []
+                    for i, chunk in enumerate(window):
+                        original, fingerprints[i] = deduplicator.check(chunk.text)
+                        if original is not None:
+                            continue
+                        original = in_window.register(fingerprints[i])
+                        if original is None:
+                            kept.append(i)
+                        else:
+                            held.setdefault(kept[original], []).append(i)
+                candidates = kept
             
-            # Print progress
-            if (i + 1) % 10 == 0:
-                print(f"Processed {i + 1}/{total_chunks} chunks")
+            vectors: Dict[int, Optional[List[float]]] = {}
+            while candidates:
+                embedded, cached = embed_cached([window[i].text for i in candidates], engine, cache)
+                hits += cached
+                vectors.update(zip(candidates, embedded))
+                # A held duplicate is only embedded if its original could not be
+                candidates = []
+                for i in sorted(held):
+                    if vectors.get(i, True) is None:
+                        promoted, *rest = held.pop(i)
+                        if rest:
+                            held[promoted] = rest
+                        candidates.append(promoted)
             
-            # Sleep to avoid rate limiting
-            time.sleep(0.5)
+            rows = []
+            records = []
+            for i in sorted(vectors):
+                chunk, vector = window[i], vectors[i]
+                # Chunks whose batch failed after all retries are skipped
+                if vector is None:
+                    print(f"Error on chunk {window_start + i}: no embedding returned")
+                    continue
+                
+                # Registered only now that it is kept, so a failed chunk never stands in for others
+                signature_id = None
+                if deduplicator is not None:
+                    if deduplicator.register(fingerprints[i]) is not None:
+                        continue
+                    signature_id = len(deduplicator) - 1
+                
+                rows.append(vector)
+                signature_ids.append(signature_id)
+                records.append({
+                    "text": chunk.text,
+                    "metadata": chunk.metadata,
+                    "start_char": chunk.start_char,
+                    "end_char": chunk.end_char
+                })
+            failed = sum(vector is None for vector in vectors.values())
+            duplicates += len(window) - len(rows) - failed
             
-        except Exception as e:
-            print(f"Error on chunk {i}: {e}")
-            continue
-    
-    # Save embeddings to file
-    with open(output_file, 'w') as f:
-        json.dump(embeddings, f)
+            if rows:
+                with span("write_vectors", rows=len(rows)):
+                    writer.append(rows, records)
+            print(f"Processed {total_chunks} chunks")
     
-    print(f"\nEmbeddings saved to {output_file}")
-    return embeddings
+    print(f"Embedded {writer.rows}/{total_chunks} chunks ({hits} from cache, {duplicates} duplicates "
+          f"skipped) in {engine.stats['requests']} requests ({engine.stats['retries']} retries)")
+    print(f"\nEmbeddings saved to {writer.vectors_path} and {writer.records_path}")
+    if deduplicator is not None:
+        deduplicator.save(signature_path(output_prefix), signature_ids)
+        print(f"MinHash signatures saved to {signature_path(output_prefix)}")
+    current_span().set(rows=writer.rows, cached=hits, duplicates=duplicates,
+                       requests=engine.stats["requests"])
+    return writer.rows
 
 if __name__ == "__main__":
     # Import chunks from process_docs.py
-    from process_docs import process_document
+    from process_docs import stream_document
     
-    # Process document and get chunks
+    # Stream chunks from the document straight into the embedder
     file_path = "data/openai_api_docs.txt"
-    chunks = process_document(file_path)
+    chunks = stream_document(file_path)
     
     # Embed chunks
-    embeddings = embed_chunks(chunks) 
\ No newline at end of file
+    embed_chunks(chunks) 
\ No newline at end of file
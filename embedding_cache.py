@@ -0,0 +1,130 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Dict
+
+import numpy as np
+
+def cache_key(text: str, model: str) -> str:
+    """Content address for an embedding: hash of (model, text)"""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """
+    Persistent, size-bounded embedding cache stored in SQLite.
+
+    Vectors are keyed by a hash of (model, text) and stored as float32 blobs.
+    When the cache grows past `max_entries`, the least recently used entries
+    are evicted. Hit/miss counts are kept per instance.
+    """
+
+    def __init__(self, path: str = "embedding_cache.db", max_entries: int = 100000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+
+    def get_many(self, texts: List[str], model: str) -> List[Optional[List[float]]]:
+        """Look up embeddings for texts, returning None for misses"""
+        keys = [cache_key(text, model) for text in texts]
+        found = {}
+
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+                self._conn.commit()
+
+            results = []
+            for key in keys:
+                blob = found.get(key)
+                if blob is None:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self.hits += 1
+                    results.append(np.frombuffer(blob, dtype=np.float32).tolist())
+        return results
+
+    def get(self, text: str, model: str) -> Optional[List[float]]:
+        """Look up a single embedding"""
+        return self.get_many([text], model)[0]
+
+    def put_many(self, texts: List[str], vectors: List[List[float]], model: str) -> None:
+        """Store embeddings, evicting least recently used entries if over capacity"""
+        now = time.time()
+        rows = [(cache_key(text, model), model,
+                 np.asarray(vector, dtype=np.float32).tobytes(), now)
+                for text, vector in zip(texts, vectors) if vector is not None]
+        if not rows:
+            return
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) "
+                "VALUES (?, ?, ?, ?)", rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def put(self, text: str, vector: List[float], model: str) -> None:
+        """Store a single embedding"""
+        self.put_many([text], [vector], model)
+
+    def _evict(self) -> None:
+        """Trim to 90% of capacity so eviction is not paid on every insert"""
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        excess = count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+        )
+        self.evictions += excess
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters for this instance plus current cache size"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,341 @@
+import hashlib
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Callable, List, Optional, Dict, Tuple
+
+import numpy as np
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for batching (~4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+def make_batches(texts: List[str], max_batch_tokens: int = 50000,
+                 max_batch_size: int = 512) -> List[List[int]]:
+    """
+    Group text positions into batches that fit a token budget
+
+    Args:
+        texts: Texts to embed, in order
+        max_batch_tokens: Estimated token budget for a single request
+        max_batch_size: Maximum number of inputs in a single request
+
+    Returns:
+        List of batches, each a list of positions into `texts`
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+
+        # Close the current batch if this text would overflow it
+        if current and (current_tokens + tokens > max_batch_tokens
+                        or len(current) >= max_batch_size):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+
+        current.append(i)
+        current_tokens += tokens
+
+    if current:
+        batches.append(current)
+
+    return batches
+
+def _header_seconds(value: Optional[str]) -> Optional[float]:
+    """Parse rate-limit header durations such as '1.5', '20ms', '6m0s' or '1s'"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    total = 0.0
+    number = ""
+    i = 0
+    while i < len(value):
+        ch = value[i]
+        if ch.isdigit() or ch == ".":
+            number += ch
+        elif value.startswith("ms", i):
+            total += float(number or 0) / 1000
+            number = ""
+            i += 1
+        elif ch in "hms":
+            total += float(number or 0) * {"h": 3600, "m": 60, "s": 1}[ch]
+            number = ""
+        else:
+            return None
+        i += 1
+    return total
+
+class AdaptiveRateLimiter:
+    """
+    Shared pacing for concurrent embedding requests.
+
+    Workers call `acquire()` before each request. On a 429 the limiter pauses every
+    worker until the server's retry-after/reset hint and widens the spacing between
+    requests; each success narrows it again (AIMD).
+    """
+
+    def __init__(self, min_interval: float = 0.0, max_interval: float = 5.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.throttled = 0
+
+    def acquire(self) -> None:
+        """Block until this worker may issue its next request"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot, self._paused_until)
+            self._next_slot = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def on_success(self, headers: Optional[Dict[str, str]] = None) -> None:
+        """Relax the spacing, unless the server says we are close to the limit"""
+        with self._lock:
+            self.interval = max(self.min_interval, self.interval * 0.9 - 0.001)
+
+            if headers:
+                remaining = headers.get("x-ratelimit-remaining-requests")
+                reset = _header_seconds(headers.get("x-ratelimit-reset-requests"))
+                if remaining is not None and reset is not None:
+                    try:
+                        remaining = int(remaining)
+                    except ValueError:
+                        return
+                    # Spread the remaining budget over the reset window
+                    if remaining <= 1:
+                        self._paused_until = max(self._paused_until, time.monotonic() + reset)
+                    else:
+                        self.interval = min(self.max_interval,
+                                            max(self.interval, reset / remaining))
+
+    def on_rate_limited(self, headers: Optional[Dict[str, str]] = None) -> float:
+        """Back off after a 429 and return how long workers are paused"""
+        headers = headers or {}
+        wait = (_header_seconds(headers.get("retry-after"))
+                or _header_seconds(headers.get("x-ratelimit-reset-requests"))
+                or _header_seconds(headers.get("x-ratelimit-reset-tokens"))
+                or max(self.interval * 2, 0.5))
+        with self._lock:
+            self.throttled += 1
+            self.interval = min(self.max_interval, max(self.interval * 2, 0.05))
+            self._paused_until = max(self._paused_until, time.monotonic() + wait)
+        return wait
+
+def _error_status(error: Exception) -> Optional[int]:
+    """HTTP status carried by an OpenAI (or fake) API error, if any"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+def _is_transport_error(error: Exception) -> bool:
+    """Whether an exception is a connection failure or timeout rather than a bug or bad response"""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # openai is only imported by callers that use its client, so it is checked only if loaded
+    openai = sys.modules.get("openai")
+    return openai is not None and isinstance(error, openai.APIConnectionError)
+
+def _error_headers(error: Exception) -> Dict[str, str]:
+    """Response headers carried by an API error, if any"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    return dict(headers) if headers else {}
+
+class EmbeddingEngine:
+    """
+    Batched, concurrent embedding client.
+
+    Texts are packed into token-budgeted batches, several batches are kept in
+    flight on a thread pool, and all workers share an AdaptiveRateLimiter.
+    Retryable failures (429, 5xx, connection errors) are retried with
+    exponential backoff and jitter.
+    """
+
+    def __init__(self, client, model: str = "text-embedding-ada-002",
+                 max_batch_tokens: int = 50000, max_batch_size: int = 512,
+                 concurrency: int = 4, max_retries: int = 6,
+                 backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 rate_limiter: Optional[AdaptiveRateLimiter] = None):
+        self.client = client
+        self.model = model
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.stats = {"requests": 0, "retries": 0, "failed_batches": 0, "texts": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _create(self, texts: List[str]) -> Tuple[List[List[float]], Dict[str, str]]:
+        """Issue one embeddings request, returning vectors and response headers"""
+        embeddings = self.client.embeddings
+        raw_api = getattr(embeddings, "with_raw_response", None)
+
+        if raw_api is not None:
+            raw = raw_api.create(input=texts, model=self.model)
+            response = raw.parse()
+            headers = dict(raw.headers)
+        else:
+            response = embeddings.create(input=texts, model=self.model)
+            headers = {}
+
+        # The API may return items out of order; `index` ties them back to inputs
+        data = sorted(response.data, key=lambda item: item.index)
+        return [item.embedding for item in data], headers
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed a single batch, retrying retryable errors with backoff"""
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            self._count("requests")
+            try:
+                vectors, headers = self._create(texts)
+                self.rate_limiter.on_success(headers)
+                return vectors
+            except Exception as e:
+                status = _error_status(e)
+                # Anything else (a malformed response, a bug in _create) fails at once
+                retryable = (_is_transport_error(e) if status is None
+                             else status == 429 or status >= 500)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+
+                if status == 429:
+                    self.rate_limiter.on_rate_limited(_error_headers(e))
+                else:
+                    delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+                    time.sleep(delay * random.uniform(0.5, 1.0))
+
+                attempt += 1
+                self._count("retries")
+
+    def embed(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Embed texts concurrently and return vectors in input order.
+
+        Positions whose batch still failed after all retries are None.
+        """
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        batches = make_batches(texts, self.max_batch_tokens, self.max_batch_size)
+
+        def run(batch: List[int]) -> None:
+            try:
+                vectors = self._embed_batch([texts[i] for i in batch])
+            except Exception as e:
+                print(f"Error on batch starting at chunk {batch[0]}: {e}")
+                self._count("failed_batches")
+                return
+            for i, vector in zip(batch, vectors):
+                results[i] = vector
+            self._count("texts", len(batch))
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for _ in pool.map(run, batches):
+                pass
+
+        return results
+
+class FakeRateLimitError(Exception):
+    """429 raised by FakeEmbeddingClient, shaped like openai.RateLimitError"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Rate limit reached (fake)")
+        self.status_code = 429
+        self.response = SimpleNamespace(status_code=429,
+                                        headers={"retry-after": str(retry_after)})
+
+def fake_embedding(text: str, dimension: int = 1536) -> List[float]:
+    """Deterministic unit vector derived from the text's hash"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype("float32")
+    vector /= np.linalg.norm(vector)
+    return vector.tolist()
+
+def hashed_embedding(text: str, dimension: int = 1536) -> List[float]:
+    """
+    Deterministic bag-of-words unit vector (signed feature hashing of lowercased words)
+
+    Unlike fake_embedding, texts that share words get nearby vectors, so
+    retrieval quality can be measured offline.
+    """
+    vector = np.zeros(dimension, dtype="float32")
+    for word in re.findall(r"[a-z0-9_]+", text.lower()):
+        h = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+        vector[h % dimension] += 1.0 if h >> 63 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector.tolist()
+
+class FakeEmbeddingClient:
+    """
+    Offline stand-in for `openai.OpenAI` covering `client.embeddings.create`.
+
+    Vectors are deterministic per text (fake_embedding unless another
+    `embedding_function` is given), each request sleeps `latency` seconds, and
+    if `requests_per_second` is set, requests beyond that rate get a 429 so
+    the rate limiter and retry paths can be exercised in CI.
+    """
+
+    def __init__(self, dimension: int = 1536, latency: float = 0.0,
+                 requests_per_second: Optional[float] = None,
+                 embedding_function: Callable[[str, int], List[float]] = fake_embedding):
+        self.dimension = dimension
+        self.embedding_function = embedding_function
+        self.latency = latency
+        self.requests_per_second = requests_per_second
+        self.requests = 0
+        self.rate_limited = 0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._lock = threading.Lock()
+        self.embeddings = SimpleNamespace(create=self._create)
+
+    def _check_rate(self) -> None:
+        if self.requests_per_second is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start = now
+                self._window_count = 0
+            self._window_count += 1
+            if self._window_count > self.requests_per_second:
+                self.rate_limited += 1
+                raise FakeRateLimitError(retry_after=1.0 - (now - self._window_start))
+
+    def _create(self, input, model: str = "text-embedding-ada-002"):
+        texts = [input] if isinstance(input, str) else list(input)
+        with self._lock:
+            self.requests += 1
+        self._check_rate()
+        if self.latency:
+            time.sleep(self.latency)
+        data = [SimpleNamespace(index=i, embedding=self.embedding_function(text, self.dimension))
+                for i, text in enumerate(texts)]
+        return SimpleNamespace(data=data, model=model)
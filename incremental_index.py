@@ -0,0 +1,444 @@
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import List, Dict, Tuple, Optional, Iterable
+
+import numpy as np
+
+from chunker import Chunk
+
+# Default files of an incremental index; store_faiss.py's faiss_index.bin is a
+# positional index and cannot be updated in place
+INCREMENTAL_INDEX = "incremental_index.bin"
+
+def metadata_db_path(index_file: str) -> str:
+    """Path of the SQLite chunk table kept next to an incremental index"""
+    return os.path.splitext(index_file)[0] + ".db"
+
+def chunk_id(doc_id: str, start_char: int) -> int:
+    """Stable 63-bit chunk ID derived from the document ID and the chunk's offset"""
+    digest = hashlib.blake2b(f"{doc_id}:{start_char}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") & (2 ** 63 - 1)
+
+def content_chunk_id(doc_id: str, text: str, occurrence: int = 0) -> int:
+    """
+    63-bit ID of a chunk in an IncrementalIndex, from its document, text and
+    which repeat of that text in the document it is
+
+    Unlike `chunk_id` it does not change when an edit earlier in the
+    document shifts the chunk's offsets.
+    """
+    hasher = hashlib.blake2b(f"{doc_id}:{occurrence}:".encode("utf-8"), digest_size=8)
+    hasher.update(text.encode("utf-8"))
+    return int.from_bytes(hasher.digest(), "little") & (2 ** 63 - 1)
+
+def chunk_ids(chunks: List[Chunk], taken: Optional[set] = None) -> List[int]:
+    """
+    IncrementalIndex IDs for chunks, in order
+
+    Repeats of the same text in a document take the next occurrence number.
+    IDs in `taken` are skipped and the new ones added to it, so it can carry
+    the IDs already assigned in a document or in earlier batches.
+    """
+    taken = set() if taken is None else taken
+    ids = []
+    for chunk in chunks:
+        doc_id, occurrence = chunk.metadata.get("doc_id"), 0
+        new_id = content_chunk_id(doc_id, chunk.text)
+        while new_id in taken:
+            occurrence += 1
+            new_id = content_chunk_id(doc_id, chunk.text, occurrence)
+        taken.add(new_id)
+        ids.append(new_id)
+    return ids
+
+def chunk_record(chunk: Chunk) -> Dict:
+    """Metadata record stored for a chunk (everything except its vector)"""
+    return {
+        "text": chunk.text,
+        "metadata": chunk.metadata,
+        "start_char": chunk.start_char,
+        "end_char": chunk.end_char,
+    }
+
+def _select_chunks(conn: sqlite3.Connection, ids: List[int]) -> List[Optional[Dict]]:
+    """Metadata records for chunk IDs from a chunks table, in the given order (None if missing)"""
+    rows = {}
+    for start in range(0, len(ids), 500):
+        batch = [int(i) for i in ids[start:start + 500]]
+        placeholders = ",".join("?" * len(batch))
+        for row in conn.execute(
+                f"SELECT id, text, metadata, start_char, end_char FROM chunks "
+                f"WHERE id IN ({placeholders})", batch):
+            rows[row[0]] = {"text": row[1], "metadata": json.loads(row[2]),
+                            "start_char": row[3], "end_char": row[4]}
+    return [rows.get(int(i)) for i in ids]
+
+class IncrementalMetadata:
+    """
+    Read-only view of an incremental index's chunk table, for the Retriever.
+
+    Looks chunks up by the IDs the ID-mapped index returns. The table is
+    updated as soon as a change is applied while the index file only changes
+    at checkpoints, so IDs deleted since the last checkpoint resolve to None.
+    """
+
+    def __init__(self, metadata_db: str):
+        if not os.path.exists(metadata_db):
+            raise FileNotFoundError(f"No chunk table {metadata_db} next to the incremental index")
+        self.metadata_db = metadata_db
+        self._conn = sqlite3.connect(f"file:{metadata_db}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def get_many(self, ids: Iterable[int]) -> List[Optional[Dict]]:
+        """Records for the given chunk IDs, in order (None for IDs no longer indexed)"""
+        with self._lock:
+            return _select_chunks(self._conn, list(ids))
+
+    def close(self) -> None:
+        self._conn.close()
+
+class IncrementalIndex:
+    """
+    FAISS index that supports add/upsert/delete without a full rebuild.
+
+    Vectors live in a `faiss.IndexIDMap2` keyed by chunk IDs derived from each
+    chunk's document and text (`chunk_ids`), so a chunk keeps its ID when an
+    edit shifts it and `move` only rewrites its offsets. Chunk metadata lives
+    in a SQLite table (`<index>.db`) updated in place. Every change is first
+    appended and fsynced to a write-ahead log, then applied; the index file is
+    only rewritten at checkpoints, after which the log is truncated. On open,
+    any logged changes newer than the index file are replayed. All operations
+    are idempotent, so replaying a change that already reached disk is safe.
+
+    The wrapped index must support `remove_ids` (flat or IVF indexes).
+
+    Retriever serves the index file as it was at the last checkpoint, with
+    chunk metadata read from the SQLite table (`Retriever("incremental_index.bin")`,
+    `RAG_INDEX=incremental_index.bin` or `server.py --index incremental_index.bin`).
+    """
+
+    def __init__(self, index_file: str = INCREMENTAL_INDEX, metadata_db: Optional[str] = None,
+                 wal_file: str = None, checkpoint_every: int = 100):
+        self.index_file = index_file
+        self.metadata_db = metadata_db or metadata_db_path(index_file)
+        self.wal_file = wal_file or os.path.splitext(index_file)[0] + ".wal"
+        self.checkpoint_every = checkpoint_every
+        self._pending = 0
+        self._lock = threading.RLock()
+
+        import faiss
+        self.index = None
+        if os.path.exists(index_file):
+            self.index = faiss.read_index(index_file)
+            if not isinstance(self.index, faiss.IndexIDMap2):
+                raise ValueError(f"{index_file} is not an ID-mapped index (store_faiss.py indexes are "
+                                 f"positional); build one with IncrementalIndex.from_vector_store, "
+                                 f"which defaults to {INCREMENTAL_INDEX}")
+
+        self._conn = sqlite3.connect(self.metadata_db, check_same_thread=False)
+        # Lets retrievers read the table while changes are being applied
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " id INTEGER PRIMARY KEY,"
+            " doc_id TEXT,"
+            " text TEXT NOT NULL,"
+            " metadata TEXT NOT NULL,"
+            " start_char INTEGER,"
+            " end_char INTEGER)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_doc_id ON chunks (doc_id)")
+        # Content hash of each document as last synced by change_capture.py
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " doc_id TEXT PRIMARY KEY,"
+            " sha256 TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+        # Bring the index up to date with anything logged after the last checkpoint
+        replayed = self._replay()
+        self._wal = open(self.wal_file, "a", encoding="utf-8")
+        if replayed:
+            print(f"Replayed {replayed} logged changes from {self.wal_file}")
+            self.checkpoint()
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal if self.index is not None else 0
+
+    def _ensure_index(self, dimension: int) -> None:
+        import faiss
+        if self.index is None:
+            self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+
+    def _replay(self) -> int:
+        """Re-apply logged operations; a torn final entry from a crash is ignored"""
+        if not os.path.exists(self.wal_file):
+            return 0
+        count = 0
+        with open(self.wal_file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                self._apply(entry)
+                count += 1
+        return count
+
+    def _log(self, entry: Dict) -> None:
+        """Durably append an operation to the write-ahead log"""
+        self._wal.write(json.dumps(entry) + "\n")
+        self._wal.flush()
+        os.fsync(self._wal.fileno())
+
+    def _apply(self, entry: Dict) -> None:
+        """Apply a logged operation to the metadata table and the in-memory index"""
+        ids = np.array(entry["ids"], dtype=np.int64)
+
+        if entry["op"] == "upsert":
+            vectors = np.frombuffer(base64.b64decode(entry["vectors"]), dtype=np.float32)
+            vectors = vectors.reshape(len(ids), -1)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (id, doc_id, text, metadata, start_char, end_char) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(int(i), r["metadata"].get("doc_id"), r["text"], json.dumps(r["metadata"]),
+                  r["start_char"], r["end_char"]) for i, r in zip(ids, entry["records"])]
+            )
+            self._conn.commit()
+            self._ensure_index(vectors.shape[1])
+            self.index.remove_ids(ids)
+            self.index.add_with_ids(vectors, ids)
+
+        elif entry["op"] == "move":
+            # Same text, new offsets: the vector in the index stays as it is
+            self._conn.executemany("UPDATE chunks SET start_char = ?, end_char = ? WHERE id = ?",
+                                   [(start, end, int(i)) for i, (start, end) in zip(ids, entry["spans"])])
+            self._conn.commit()
+
+        elif entry["op"] == "delete":
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(int(i),) for i in ids])
+            self._conn.commit()
+            if self.index is not None:
+                self.index.remove_ids(ids)
+
+        else:
+            raise ValueError(f"Unknown log operation {entry['op']!r}")
+
+    def _commit(self, entry: Dict) -> None:
+        """Log, apply and, every `checkpoint_every` operations, checkpoint"""
+        self._log(entry)
+        self._apply(entry)
+        self._pending += 1
+        if self._pending >= self.checkpoint_every:
+            self.checkpoint()
+
+    def upsert(self, chunks: List[Chunk], vectors, ids: Optional[List[int]] = None) -> List[int]:
+        """
+        Insert chunks, replacing any existing chunks with the same IDs; returns the IDs
+
+        IDs default to `chunk_ids(chunks)`.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if len(vectors) != len(chunks):
+            raise ValueError("need exactly one vector per chunk")
+        if not chunks:
+            return []
+        ids = chunk_ids(chunks) if ids is None else [int(i) for i in ids]
+        if len(ids) != len(chunks):
+            raise ValueError("need exactly one ID per chunk")
+        with self._lock:
+            self._commit({
+                "op": "upsert",
+                "ids": ids,
+                "vectors": base64.b64encode(vectors.tobytes()).decode("ascii"),
+                "records": [chunk_record(c) for c in chunks],
+            })
+        return ids
+
+    def add(self, chunks: List[Chunk], vectors) -> List[int]:
+        """Insert new chunks; raises ValueError if any chunk ID is already indexed"""
+        ids = chunk_ids(chunks)
+        existing = self.existing_ids(ids)
+        if existing:
+            raise ValueError(f"{len(existing)} chunks are already indexed; use upsert")
+        return self.upsert(chunks, vectors, ids)
+
+    def move(self, ids: List[int], spans: List[Tuple[int, int]]) -> None:
+        """Update the (start_char, end_char) of chunks whose text shifted; their vectors are untouched"""
+        ids = [int(i) for i in ids]
+        if len(spans) != len(ids):
+            raise ValueError("need exactly one span per chunk")
+        if ids:
+            with self._lock:
+                self._commit({"op": "move", "ids": ids, "spans": [[int(a), int(b)] for a, b in spans]})
+
+    def delete(self, ids: Iterable[int]) -> int:
+        """Remove chunks by ID; returns how many were present"""
+        ids = [int(i) for i in ids]
+        present = len(self.existing_ids(ids))
+        if ids:
+            with self._lock:
+                self._commit({"op": "delete", "ids": ids})
+        return present
+
+    def document_ids(self, doc_id: str) -> List[int]:
+        """IDs of all chunks currently indexed for a document"""
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM chunks WHERE doc_id = ?", (doc_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def document_chunks(self, doc_id: str) -> List[Tuple[int, Dict]]:
+        """(ID, record) of every chunk indexed for a document, in offset order"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, text, metadata, start_char, end_char FROM chunks "
+                "WHERE doc_id = ? ORDER BY start_char, end_char", (doc_id,)).fetchall()
+        return [(row[0], {"text": row[1], "metadata": json.loads(row[2]),
+                          "start_char": row[3], "end_char": row[4]}) for row in rows]
+
+    def get_vectors(self, ids: List[int]) -> np.ndarray:
+        """Stored vectors of chunk IDs, as an (n, d) float32 array"""
+        with self._lock:
+            if not ids:
+                return np.zeros((0, self.index.d if self.index is not None else 0), dtype=np.float32)
+            return np.vstack([self.index.reconstruct(int(i)) for i in ids])
+
+    def document_hash(self, doc_id: str) -> Optional[str]:
+        """Content hash recorded for a document by set_document_hash, if any"""
+        with self._lock:
+            row = self._conn.execute("SELECT sha256 FROM documents WHERE doc_id = ?",
+                                     (doc_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_document_hash(self, doc_id: str, sha256: Optional[str]) -> None:
+        """Record (or, with None, forget) the content hash a document's chunks were built from"""
+        with self._lock:
+            if sha256 is None:
+                self._conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            else:
+                self._conn.execute("INSERT OR REPLACE INTO documents (doc_id, sha256) VALUES (?, ?)",
+                                   (doc_id, sha256))
+            self._conn.commit()
+
+    def indexed_documents(self) -> List[str]:
+        """Every document with chunks or a recorded hash"""
+        with self._lock:
+            rows = self._conn.execute("SELECT doc_id FROM chunks WHERE doc_id IS NOT NULL "
+                                      "UNION SELECT doc_id FROM documents").fetchall()
+        return sorted(row[0] for row in rows)
+
+    def delete_document(self, doc_id: str) -> int:
+        """Remove every chunk belonging to a document"""
+        return self.delete(self.document_ids(doc_id))
+
+    def replace_document(self, doc_id: str, chunks: List[Chunk], vectors) -> Tuple[int, int]:
+        """Upsert a document's new chunks and drop its chunks that no longer exist"""
+        new_ids = set(self.upsert(chunks, vectors))
+        stale = [i for i in self.document_ids(doc_id) if i not in new_ids]
+        self.delete(stale)
+        return len(new_ids), len(stale)
+
+    def existing_ids(self, ids: List[int]) -> List[int]:
+        """Subset of `ids` that currently have metadata rows"""
+        found = []
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                found.extend(row[0] for row in self._conn.execute(
+                    f"SELECT id FROM chunks WHERE id IN ({placeholders})", batch))
+        return found
+
+    def get_chunks(self, ids: List[int]) -> List[Optional[Dict]]:
+        """Metadata records for chunk IDs, in the given order (None if missing)"""
+        with self._lock:
+            return _select_chunks(self._conn, ids)
+
+    def search(self, query_vectors, k: int = 5) -> Tuple[List[List[Dict]], List[List[float]]]:
+        """Search the index and resolve the hits to chunk metadata"""
+        chunks, dists = [], []
+        # Writers change the index and table in place, so a search sees neither half-updated
+        with self._lock:
+            query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32).reshape(-1, self.index.d)
+            distances, ids = self.index.search(query_vectors, k)
+            for row_ids, row_distances in zip(ids, distances):
+                keep = row_ids != -1
+                chunks.append(self.get_chunks(row_ids[keep].tolist()))
+                dists.append(row_distances[keep].tolist())
+        return chunks, dists
+
+    def checkpoint(self) -> None:
+        """Atomically write the index to disk, then truncate the write-ahead log"""
+        import faiss
+        with self._lock:
+            if self.index is not None:
+                tmp_file = self.index_file + ".tmp"
+                faiss.write_index(self.index, tmp_file)
+                with open(tmp_file, "rb") as f:
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, self.index_file)
+
+            # Everything in the log is now reflected in the index file
+            self._wal.truncate(0)
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+            self._pending = 0
+
+    def close(self) -> None:
+        """Checkpoint and release file handles"""
+        self.checkpoint()
+        self._wal.close()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @classmethod
+    def from_vector_store(cls, embeddings_prefix: str = "embeddings",
+                          batch_size: int = 4096, **kwargs) -> "IncrementalIndex":
+        """
+        Build (or refresh) an incremental index from a vector store written by embed_chunks
+
+        Every chunk in the store is upserted, and chunks the index holds that
+        are no longer in the store are deleted, so afterwards the index
+        matches the store.
+        """
+        from vector_store import load_vectors, iter_records
+
+        vectors = load_vectors(embeddings_prefix)
+        index = cls(**kwargs)
+        batch = []
+        start = 0
+        # Repeated texts are numbered across batches, as within one
+        taken = set()
+        for record in iter_records(embeddings_prefix):
+            batch.append(Chunk(text=record["text"], metadata=record["metadata"],
+                               start_char=record["start_char"], end_char=record["end_char"]))
+            if len(batch) == batch_size:
+                index.upsert(batch, vectors[start:start + len(batch)], chunk_ids(batch, taken))
+                start += len(batch)
+                batch = []
+        if batch:
+            index.upsert(batch, vectors[start:start + len(batch)], chunk_ids(batch, taken))
+        # `taken` now holds the ID of every chunk in the store
+        with index._lock:
+            stale = [row[0] for row in index._conn.execute("SELECT id FROM chunks")
+                     if row[0] not in taken]
+        index.delete(stale)
+        index.checkpoint()
+        return index
+
+if __name__ == "__main__":
+    # Build an updatable index from embeddings.npy / embeddings.jsonl
+    with IncrementalIndex.from_vector_store() as index:
+        print(f"Incremental index {index.index_file} holds {index.ntotal} chunks "
+              f"(metadata in {index.metadata_db})")
@@ -0,0 +1,328 @@
+"""
+Metadata filters pushed into vector and lexical search
+
+At store_in_faiss time every scalar field of each chunk's metadata (doc_id,
+strategy, chunk_size, ...) is indexed as posting lists: for each
+(field, value) pair, the sorted chunk positions carrying it. Lists of scalars
+post each element. The postings are saved CSR-style next to the FAISS index,
+like the BM25 index, and memory-mapped by the retriever.
+
+Filters are JSON-friendly dicts:
+
+    {"doc_id": "openai_api_docs"}                          equality
+    {"doc_id": {"$in": ["a", "b"]}, "strategy": "sentence"}   keys are ANDed
+    {"chunk_size": {"$gte": 200, "$lt": 1000}}             ranges over numbers or strings
+    {"$or": [{...}, {...}]}, {"$and": [...]}, {"$not": {...}}
+    operators: $eq $ne $in $nin $gt $gte $lt $lte $exists
+
+A filter is resolved into a boolean mask over chunk positions by merging
+postings, so its cost depends on the number of matching chunks rather than
+on the corpus size. The mask is handed to FAISS as an IDSelectorBitmap, so
+non-matching vectors are skipped inside the search and a filtered query
+still returns k results instead of whatever survives post-filtering a
+top-k list. For IVF indexes nprobe is widened in proportion to how selective
+the filter is, and if an approximate index still comes back short the
+search is repeated exhaustively over the matching chunks.
+"""
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from bundle import FILES
+
+# Separates the field name from the JSON-encoded value in posting-list keys;
+# it sorts before any printable character, so one field's keys are contiguous
+KEY_SEPARATOR = b"\x00"
+
+COMPARISONS = ("$eq", "$ne", "$in", "$nin", "$gt", "$gte", "$lt", "$lte", "$exists")
+
+# Resolved filters kept per index, so repeated filters skip merging postings
+MATCH_CACHE_SIZE = 128
+
+# At or below this many matching chunks, HNSW indexes are searched exactly over
+# the matches instead of walking the graph, where most neighbours would be skipped
+EXACT_SEARCH_ROWS = 4096
+
+def filter_paths(prefix: str) -> Dict[str, str]:
+    """Files making up a metadata filter index"""
+    paths = {name: f"{prefix}.{name}.npy" for name in ("keys", "offsets", "positions")}
+    paths["meta"] = f"{prefix}.meta.json"
+    return paths
+
+def filter_prefix(index_file: str) -> str:
+    """Prefix of the metadata filter index stored alongside a FAISS index file"""
+    return os.path.splitext(index_file)[0] + "_filters"
+
+def _encode_value(value) -> str:
+    # 500 and 500.0 are the same value to a filter
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return json.dumps(value, sort_keys=True)
+
+def _key(field: str, value) -> bytes:
+    return field.encode("utf-8") + KEY_SEPARATOR + _encode_value(value).encode("utf-8")
+
+def _is_scalar(value) -> bool:
+    return value is None or isinstance(value, (str, int, float, bool))
+
+class FilterIndexBuilder:
+    """Accumulates metadata postings for chunks added in position order, then writes them to disk"""
+
+    def __init__(self):
+        self.postings: Dict[bytes, List[int]] = {}
+        self.num_docs = 0
+
+    def add(self, metadata: Dict) -> None:
+        position = self.num_docs
+        self.num_docs += 1
+        for field, value in metadata.items():
+            values = value if isinstance(value, list) else [value]
+            # A list may repeat a value; post each position once
+            for key in {_key(field, v) for v in values if _is_scalar(v)}:
+                self.postings.setdefault(key, []).append(position)
+
+    def save(self, prefix: str) -> None:
+        """Write the sorted (field, value) keys and CSR-style position lists"""
+        paths = filter_paths(prefix)
+        keys = sorted(self.postings)
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        for i, key in enumerate(keys):
+            offsets[i + 1] = offsets[i] + len(self.postings[key])
+        positions = np.empty(offsets[-1], dtype=np.int32)
+        for i, key in enumerate(keys):
+            positions[offsets[i]:offsets[i + 1]] = self.postings[key]
+
+        width = max((len(key) for key in keys), default=1)
+        np.save(paths["keys"], np.array(keys, dtype=f"S{width}"))
+        np.save(paths["offsets"], offsets)
+        np.save(paths["positions"], positions)
+        fields: Dict[str, int] = {}
+        for key in keys:
+            field = key.split(KEY_SEPARATOR, 1)[0].decode("utf-8")
+            fields[field] = fields.get(field, 0) + 1
+        with open(paths["meta"], "w") as f:
+            json.dump({"num_docs": self.num_docs, "num_keys": len(keys), "fields": fields}, f)
+
+class FilterMatch:
+    """Chunks matching one filter, as a mask, sorted positions and a FAISS ID selector"""
+    __slots__ = ("mask", "positions", "count", "bitmap", "selector")
+
+    def __init__(self, mask: np.ndarray):
+        import faiss
+        self.mask = mask
+        self.positions = np.flatnonzero(mask)
+        self.count = len(self.positions)
+        # IDSelectorBitmap tests bit i & 7 of byte i >> 3 and only holds a
+        # pointer, so the packed bits are kept alive alongside it
+        self.bitmap = np.packbits(mask, bitorder="little")
+        self.selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(self.bitmap))
+
+    @property
+    def selectivity(self) -> float:
+        """Fraction of chunks that match"""
+        return self.count / max(len(self.mask), 1)
+
+class FilterIndex:
+    """
+    Memory-mapped metadata postings over chunk positions.
+
+    Key lookup is a binary search in the sorted keys, and resolving a filter
+    touches only the postings of the values it names (range operators scan
+    the keys of one field).
+    """
+
+    def __init__(self, prefix: str, sections=FILES):
+        paths = filter_paths(prefix)
+        meta = sections.json(paths["meta"])
+        self.num_docs = meta["num_docs"]
+        self.fields = meta["fields"]
+        self.keys = sections.array(paths["keys"])
+        self.offsets = sections.array(paths["offsets"])
+        self.positions = sections.array(paths["positions"])
+        self._matches: "OrderedDict[str, FilterMatch]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _postings(self, i: int) -> np.ndarray:
+        return self.positions[int(self.offsets[i]):int(self.offsets[i + 1])]
+
+    def _key_range(self, field: str) -> Tuple[int, int]:
+        """Indices of the first and past-the-last key of a field"""
+        prefix = field.encode("utf-8")
+        start = int(np.searchsorted(self.keys, prefix + KEY_SEPARATOR))
+        end = int(np.searchsorted(self.keys, prefix + b"\x01"))
+        return start, end
+
+    def _mask_of_values(self, field: str, values: Iterable) -> np.ndarray:
+        mask = np.zeros(self.num_docs, dtype=bool)
+        for value in values:
+            if not _is_scalar(value):
+                raise ValueError(f"Cannot filter {field!r} on non-scalar value {value!r}")
+            encoded = _key(field, value)
+            # Longer than every stored key, so no chunk has this value
+            if len(encoded) > self.keys.dtype.itemsize:
+                continue
+            key = np.array(encoded, dtype=self.keys.dtype)
+            i = int(np.searchsorted(self.keys, key))
+            if i < len(self.keys) and self.keys[i] == key:
+                mask[self._postings(i)] = True
+        return mask
+
+    def _mask_of_field(self, field: str, accept=None) -> np.ndarray:
+        """Chunks with any value of `field`, or any value for which accept(value) holds"""
+        mask = np.zeros(self.num_docs, dtype=bool)
+        start, end = self._key_range(field)
+        for i in range(start, end):
+            if accept is not None:
+                value = json.loads(self.keys[i].split(KEY_SEPARATOR, 1)[1].decode("utf-8"))
+                if not accept(value):
+                    continue
+            mask[self._postings(i)] = True
+        return mask
+
+    def _compare(self, field: str, op: str, operand) -> np.ndarray:
+        if op == "$eq":
+            return self._mask_of_values(field, [operand])
+        if op == "$ne":
+            return ~self._mask_of_values(field, [operand])
+        if op in ("$in", "$nin"):
+            if not isinstance(operand, list):
+                raise ValueError(f"{op} on {field!r} expects a list, got {operand!r}")
+            mask = self._mask_of_values(field, operand)
+            return mask if op == "$in" else ~mask
+        if op == "$exists":
+            mask = self._mask_of_field(field)
+            return mask if operand else ~mask
+        if op in ("$gt", "$gte", "$lt", "$lte"):
+            numeric = isinstance(operand, (int, float)) and not isinstance(operand, bool)
+            if not numeric and not isinstance(operand, str):
+                raise ValueError(f"{op} on {field!r} expects a number or string, got {operand!r}")
+
+            def accept(value) -> bool:
+                # Only values of the operand's kind are ordered against it
+                if numeric:
+                    if not isinstance(value, (int, float)) or isinstance(value, bool):
+                        return False
+                elif not isinstance(value, str):
+                    return False
+                if op == "$gt":
+                    return value > operand
+                if op == "$gte":
+                    return value >= operand
+                if op == "$lt":
+                    return value < operand
+                return value <= operand
+            return self._mask_of_field(field, accept)
+        raise ValueError(f"Unknown filter operator {op!r}; expected one of {COMPARISONS}")
+
+    def _evaluate(self, filters: Dict) -> np.ndarray:
+        if not isinstance(filters, dict):
+            raise ValueError(f"A filter must be a JSON object, got {filters!r}")
+        mask = np.ones(self.num_docs, dtype=bool)
+        for key, condition in filters.items():
+            if key in ("$and", "$or"):
+                if not isinstance(condition, list) or not condition:
+                    raise ValueError(f"{key} expects a non-empty list of filters")
+                parts = [self._evaluate(part) for part in condition]
+                mask &= np.logical_and.reduce(parts) if key == "$and" else np.logical_or.reduce(parts)
+            elif key == "$not":
+                mask &= ~self._evaluate(condition)
+            elif key.startswith("$"):
+                raise ValueError(f"Unknown filter operator {key!r}")
+            elif isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition):
+                for op, operand in condition.items():
+                    mask &= self._compare(key, op, operand)
+            else:
+                mask &= self._compare(key, "$eq", condition)
+        return mask
+
+    def match(self, filters: Dict) -> FilterMatch:
+        """Resolve a filter into the chunks it matches; recent filters are cached"""
+        cache_key = json.dumps(filters, sort_keys=True)
+        with self._lock:
+            match = self._matches.get(cache_key)
+            if match is not None:
+                self._matches.move_to_end(cache_key)
+                return match
+        match = FilterMatch(self._evaluate(filters))
+        with self._lock:
+            self._matches[cache_key] = match
+            if len(self._matches) > MATCH_CACHE_SIZE:
+                self._matches.popitem(last=False)
+        return match
+
+def _hnsw_of(index: "faiss.Index") -> Optional["faiss.Index"]:
+    """The HNSW index inside `index`, looking through a PCA/truncation transform"""
+    import faiss
+    if isinstance(index, faiss.IndexPreTransform):
+        index = faiss.downcast_index(index.index)
+    return index if isinstance(index, faiss.IndexHNSW) else None
+
+def selector_params(index: "faiss.Index", match: FilterMatch, k: int,
+                    exhaustive: bool = False) -> "faiss.SearchParameters":
+    """
+    Search parameters restricting `index` to the matching chunks
+
+    SearchParameters replace the index's own nprobe/efSearch, so those are
+    carried over; IVF probes nprobe / selectivity lists (all of them when
+    `exhaustive`) and HNSW explores at least k / selectivity candidates, so
+    enough matching vectors are reached to fill k results.
+    """
+    import faiss
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        nprobe = ivf.nlist if exhaustive else min(
+            ivf.nlist, math.ceil(ivf.nprobe / max(match.selectivity, 1e-9)))
+        return faiss.SearchParametersIVF(sel=match.selector, nprobe=nprobe)
+    hnsw = _hnsw_of(index)
+    if hnsw is not None:
+        ef = max(hnsw.hnsw.efSearch, k, min(match.count, math.ceil(k / max(match.selectivity, 1e-9))))
+        return faiss.SearchParametersHNSW(sel=match.selector, efSearch=ef)
+    return faiss.SearchParameters(sel=match.selector)
+
+def exact_search(index: "faiss.Index", query_vectors: np.ndarray, k: int, match: FilterMatch,
+                 vectors: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exact L2 search over the matching chunks only
+
+    Rows are read from `vectors` (the full-precision matrix, usually
+    memory-mapped) when given, otherwise reconstructed from the index.
+    """
+    import faiss
+    rows = (np.asarray(vectors[match.positions], dtype=np.float32) if vectors is not None
+            else index.reconstruct_batch(match.positions))
+    distances = np.full((len(query_vectors), k), np.inf, dtype=np.float32)
+    indices = np.full((len(query_vectors), k), -1, dtype=np.int64)
+    found = min(k, match.count)
+    distances[:, :found], local = faiss.knn(np.ascontiguousarray(query_vectors), rows, found)
+    indices[:, :found] = match.positions[local]
+    return distances, indices
+
+def filtered_search(index: "faiss.Index", query_vectors: np.ndarray, k: int, match: FilterMatch,
+                    vectors: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    FAISS search restricted to the chunks in `match`
+
+    Returns (distances, indices) like index.search, with min(k, match.count)
+    results per query; rows are padded with -1 only when fewer than k
+    chunks match.
+    """
+    import faiss
+    if match.count == 0:
+        return (np.full((len(query_vectors), k), np.inf, dtype=np.float32),
+                np.full((len(query_vectors), k), -1, dtype=np.int64))
+    if _hnsw_of(index) is not None and match.count <= EXACT_SEARCH_ROWS:
+        return exact_search(index, query_vectors, k, match, vectors)
+
+    distances, indices = index.search(query_vectors, k, params=selector_params(index, match, k))
+    if (indices[:, :min(k, match.count)] != -1).all():
+        return distances, indices
+    # The approximate search reached too few matching vectors; IVF can scan
+    # every list under the selector, HNSW falls back to an exact scan
+    if faiss.try_extract_index_ivf(index) is not None:
+        return index.search(query_vectors, k, params=selector_params(index, match, k, exhaustive=True))
+    return exact_search(index, query_vectors, k, match, vectors)
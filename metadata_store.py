@@ -0,0 +1,96 @@
+import json
+import os
+from typing import List, Dict, Iterable, Tuple
+
+import numpy as np
+
+from bundle import FILES
+
+def store_paths(prefix: str) -> Tuple[str, str]:
+    """Paths of the record blob and its offsets table for a store prefix"""
+    return f"{prefix}.bin", f"{prefix}.idx.npy"
+
+class MetadataStoreWriter:
+    """
+    Writes chunk metadata records as a blob of JSON documents plus an offsets table.
+
+    Record i occupies bytes offsets[i]:offsets[i + 1] of `<prefix>.bin`, so it
+    can be read back by position without touching any other record.
+    """
+
+    def __init__(self, prefix: str = "chunk_metadata"):
+        self.blob_path, self.offsets_path = store_paths(prefix)
+        self._blob = open(self.blob_path + ".tmp", "wb")
+        self._offsets = [0]
+        self.rows = 0
+
+    def append(self, record: Dict) -> None:
+        data = json.dumps(record).encode("utf-8")
+        self._blob.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+        self.rows += 1
+
+    def close(self) -> None:
+        """Flush the blob and write the offsets table, replacing any previous store"""
+        self._blob.close()
+        offsets_tmp = self.offsets_path + ".tmp.npy"
+        np.save(offsets_tmp, np.array(self._offsets, dtype=np.int64))
+        os.replace(self.blob_path + ".tmp", self.blob_path)
+        os.replace(offsets_tmp, self.offsets_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class MetadataStore:
+    """
+    Read-only, memory-mapped chunk metadata indexed by integer position.
+
+    Opening the store maps the files without reading them, so cold-start memory
+    stays near zero regardless of corpus size; looking up k records decodes
+    only those k records. `sections` reads the files from elsewhere, such as
+    an index bundle (see bundle.py).
+    """
+
+    def __init__(self, prefix: str = "chunk_metadata", sections=FILES):
+        self.blob_path, self.offsets_path = store_paths(prefix)
+        self.offsets = sections.array(self.offsets_path)
+        self._blob = sections.buffer(self.blob_path)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position: int) -> Dict:
+        position = int(position)
+        if not 0 <= position < len(self):
+            raise IndexError(f"chunk position {position} out of range")
+        start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+        return json.loads(self._blob[start:end])
+
+    def get_many(self, positions: Iterable[int]) -> List[Dict]:
+        """Records for the given positions, in order"""
+        return [self[position] for position in positions]
+
+    def close(self) -> None:
+        if not isinstance(self._blob, bytes):
+            self._blob.close()
+
+def build_metadata_store(records: Iterable[Dict], prefix: str = "chunk_metadata") -> int:
+    """Write records (in position order) to a metadata store, returning the count"""
+    with MetadataStoreWriter(prefix) as writer:
+        for record in records:
+            writer.append(record)
+    return writer.rows
+
+def convert_json_metadata(json_file: str = "chunk_metadata.json",
+                          prefix: str = "chunk_metadata") -> int:
+    """Build a metadata store from a chunk_metadata.json mapping keyed by stringified position"""
+    with open(json_file, "r") as f:
+        mapping = json.load(f)
+    return build_metadata_store((mapping[str(i)] for i in range(len(mapping))), prefix)
+
+if __name__ == "__main__":
+    count = convert_json_metadata()
+    print(f"Wrote {count} records to {', '.join(store_paths('chunk_metadata'))}")
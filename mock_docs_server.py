@@ -0,0 +1,135 @@
+"""
+Local documentation site for exercising crawler.py offline
+
+Serves `pages` generated HTML pages under /docs/, each linking to the next
+few, with ETag and Last-Modified headers; conditional requests that match
+get 304 Not Modified. /docs/ is an index linking to every page.
+    GET /docs/page-N   one page (/docs/page-N.txt serves it as plain text)
+    GET /_stats        request counts by status and the peak number of
+                       requests in flight, as JSON
+
+With background=True the server is returned and can be changed while it
+runs: `edit_page(server, n, "...")` changes page n (new ETag and
+Last-Modified), and `server.settings["fail"][n] = 503` makes it fail with
+that status.
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class MockDocsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def settings(self):
+        return self.server.settings
+
+    def log_message(self, format, *args):
+        if self.settings.get("verbose"):
+            super().log_message(format, *args)
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "text/html; charset=utf-8",
+              headers=None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        stats = self.settings["stats"]
+        with self.server.lock:
+            stats["statuses"][str(status)] = stats["statuses"].get(str(status), 0) + 1
+
+    def _page(self, n: int) -> str:
+        edit = self.settings["edits"].get(n, "")
+        links = "".join(f'<li><a href="page-{m}#top">Page {m}</a></li>'
+                        for m in range(n + 1, min(n + 4, self.settings["pages"])))
+        return (f"<html><head><title>Page {n}</title><style>body {{color: black}}</style>"
+                f"<script>var tracking = {n};</script></head><body><h1>Page {n}</h1>"
+                f"<p>Documentation page {n} describes endpoint_{n} and its parameters.  "
+                f"It has a second phrase.</p><p>{edit}</p><ul>{links}</ul></body></html>")
+
+    def do_GET(self):
+        stats = self.settings["stats"]
+        with self.server.lock:
+            stats["requests"] += 1
+            stats["in_flight"] += 1
+            stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            time.sleep(self.settings["latency"])
+            self._handle()
+        finally:
+            with self.server.lock:
+                stats["in_flight"] -= 1
+
+    def _handle(self):
+        path = self.path.split("?")[0]
+        if path == "/_stats":
+            with self.server.lock:
+                body = json.dumps(self.settings["stats"]).encode("utf-8")
+            self._send(200, body, "application/json")
+            return
+        if path in ("/docs", "/docs/"):
+            links = "".join(f'<a href="/docs/page-{n}">Page {n}</a> ' for n in range(self.settings["pages"]))
+            self._send(200, f"<html><body><h1>Docs</h1>{links}</body></html>".encode("utf-8"))
+            return
+
+        name = path.rsplit("/", 1)[-1]
+        plain = name.endswith(".txt")
+        try:
+            n = int(name[len("page-"):-len(".txt") if plain else None])
+        except ValueError:
+            n = -1
+        if not path.startswith("/docs/page-") or not 0 <= n < self.settings["pages"]:
+            self._send(404, b"Not found")
+            return
+        if n in self.settings["fail"]:
+            self._send(self.settings["fail"][n], b"Unavailable", headers={"Retry-After": "0"})
+            return
+
+        html = self._page(n)
+        body = (html.replace("<", " <") if plain else html).encode("utf-8")
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        last_modified = formatdate(self.settings["modified"].get(n, self.settings["started"]), usegmt=True)
+        headers = {"ETag": etag, "Last-Modified": last_modified}
+        if self.headers.get("If-None-Match") == etag:
+            self._send(304, headers=headers)
+            return
+        self._send(200, body, "text/plain; charset=utf-8" if plain else "text/html; charset=utf-8", headers)
+
+def run_mock_docs_server(host: str = "127.0.0.1", port: int = 8002, pages: int = 20,
+                         latency: float = 0.0, background: bool = False,
+                         verbose: bool = False) -> ThreadingHTTPServer:
+    """Start the fixture site; with background=True it runs on a daemon thread and is returned"""
+    server = ThreadingHTTPServer((host, port), MockDocsHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.settings = {"pages": pages, "latency": latency, "verbose": verbose,
+                       "started": time.time(), "edits": {}, "modified": {}, "fail": {},
+                       "stats": {"requests": 0, "statuses": {}, "in_flight": 0, "max_in_flight": 0}}
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        print(f"Mock docs site listening on http://{host}:{server.server_port}/docs/")
+        server.serve_forever()
+    return server
+
+def edit_page(server: ThreadingHTTPServer, n: int, text: str) -> None:
+    """Change a page's content, so its ETag and Last-Modified change"""
+    server.settings["edits"][n] = text
+    server.settings["modified"][n] = time.time()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local documentation site for crawler.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every request")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    run_mock_docs_server(args.host, args.port, args.pages, args.latency, verbose=args.verbose)
@@ -0,0 +1,133 @@
+"""
+Local OpenAI-compatible mock server for offline testing
+
+Implements just enough of the API for this repo:
+    POST /v1/embeddings          deterministic vectors (see embedding_engine.fake_embedding)
+    POST /v1/chat/completions    canned answer, streamed as SSE when "stream": true
+
+Point the OpenAI clients at it with OPENAI_BASE_URL=http://127.0.0.1:8001/v1
+and any OPENAI_API_KEY.
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from embedding_engine import fake_embedding
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # Set on the server instance by run_mock_server
+    @property
+    def settings(self):
+        return self.server.settings
+
+    def log_message(self, format, *args):
+        if self.settings.get("verbose"):
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, payload) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        time.sleep(self.settings["latency"])
+
+        if self.path.endswith("/embeddings"):
+            self._embeddings(request)
+        elif self.path.endswith("/chat/completions"):
+            self._chat(request)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _embeddings(self, request):
+        texts = request["input"]
+        if isinstance(texts, str):
+            texts = [texts]
+        dimension = self.settings["dimension"]
+        self._send_json(200, {
+            "object": "list",
+            "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(text, dimension)}
+                     for i, text in enumerate(texts)],
+            "model": request.get("model"),
+            "usage": {"prompt_tokens": sum(len(t) // 4 + 1 for t in texts),
+                      "total_tokens": sum(len(t) // 4 + 1 for t in texts)},
+        })
+
+    def _chat(self, request):
+        question = request["messages"][-1]["content"].strip().splitlines()[-1]
+        answer = f"Mock answer based on the provided context. {question[-80:]}"
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        if not request.get("stream"):
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": request.get("model"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": answer}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+            return
+
+        # Server-sent events, one word per chunk, with a small delay between tokens
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for i, word in enumerate(answer.split(" ")):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": request.get("model"),
+                "choices": [{"index": 0, "finish_reason": None,
+                             "delta": {"content": word if i == 0 else " " + word}}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.settings["token_latency"])
+        done = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                "model": request.get("model"),
+                "choices": [{"index": 0, "finish_reason": "stop", "delta": {}}]}
+        self.wfile.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        self.wfile.flush()
+        self.close_connection = True
+
+def run_mock_server(host: str = "127.0.0.1", port: int = 8001, dimension: int = 1536,
+                    latency: float = 0.0, token_latency: float = 0.0,
+                    background: bool = False, verbose: bool = False) -> ThreadingHTTPServer:
+    """Start the mock server; with background=True it runs on a daemon thread and is returned"""
+    server = ThreadingHTTPServer((host, port), MockOpenAIHandler)
+    server.daemon_threads = True
+    server.settings = {"dimension": dimension, "latency": latency,
+                       "token_latency": token_latency, "verbose": verbose}
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        print(f"Mock OpenAI server listening on http://{host}:{server.server_port}/v1")
+        server.serve_forever()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible mock server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every request")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="Seconds between streamed tokens")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    run_mock_server(args.host, args.port, args.dimension, args.latency, args.token_latency,
+                    verbose=args.verbose)
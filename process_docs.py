@@ -1,6 +1,6 @@
-from chunker import TextChunker
+from chunker import TextChunker, Chunk
 import os
-from typing import List, Dict
+from typing import List, Dict, Iterator
 
 def load_document(file_path: str) -> str:
     """Load a document from file"""
@@ -9,10 +9,36 @@ def load_document(file_path: str) -> str:
     
     with open(file_path, 'r', encoding='utf-8') as f:
         content = f.read()
-        print(f"Number of lines: {len(content.splitlines())}")
+        # Count newlines rather than building a list of lines
+        num_lines = content.count('\n')
+        if content and not content.endswith('\n'):
+            num_lines += 1
+        print(f"Number of lines: {num_lines}")
         print(f"Total characters: {len(content)}")
         return content
 
+def iter_document_blocks(file_path: str, block_size: int = 1 << 20) -> Iterator[str]:
+    """Read a document in blocks of `block_size` characters"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            yield block
+
+def stream_document(file_path: str, chunk_size: int = 500, chunk_overlap: int = 100,
+                    strategy: str = "characters", doc_id: str = "api_reference",
+                    block_size: int = 1 << 20) -> Iterator[Chunk]:
+    """
+    Chunk a document without loading it whole
+    
+    Yields the same chunks as process_document, but reads the file block by block
+    so memory stays constant however large the file is.
+    """
+    chunker = TextChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunk_blocks = getattr(chunker, f"iter_chunks_by_{strategy}")
+    return chunk_blocks(iter_document_blocks(file_path, block_size), doc_id)
+
 def process_document(file_path: str, chunk_size: int = 500, chunk_overlap: int = 100):
     """Process a single document"""
     chunker = TextChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
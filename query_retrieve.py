@@ -1,67 +1,748 @@
-import faiss
+import hashlib
 import numpy as np
 import json
-import openai
 import os
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
+from embedding_cache import EmbeddingCache
+from answer_cache import AnswerCache
+from embedding_engine import EmbeddingEngine
+from store_faiss import index_config_path, apply_search_params, rerank, rerank_vectors_path
+from metadata_store import MetadataStore, store_paths, convert_json_metadata
+from bm25_index import BM25Index, bm25_paths, bm25_prefix, reciprocal_rank_fusion
+from dedup import DIVERSITY_FETCH_FACTOR, mmr
+from metadata_filter import FilterIndex, FilterMatch, filter_paths, filter_prefix, filtered_search
+from reranker import DEFAULT_CANDIDATES, get_reranker, rerank_texts
+from tokenizer import count_tokens
+from tracing import span, traced, current_span
+from bundle import FILES, Bundle, is_bundle
+from incremental_index import IncrementalMetadata, metadata_db_path
 
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client
-client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# OpenAI client, created on first use: importing openai takes longer than
+# loading a bundle, and cached query embeddings never need it
+_client = None
 
-def get_embedding(text: str, model: str = "text-embedding-ada-002") -> List[float]:
-    """Get embedding for a query text"""
-    response = client.embeddings.create(
+def get_client():
+    """Return the shared OpenAI client, creating it on first use"""
+    global _client
+    if _client is None:
+        import openai
+        _client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    return _client
+
+# Tokens of retrieved context put in the prompt, leaving room in gpt-3.5-turbo's
+# 4k-token window for the instructions, the question and the answer
+CONTEXT_TOKEN_BUDGET = 3000
+
+# Model query embeddings come from, unless an index bundle records another
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Retrieval modes: FAISS only, BM25 only, or both fused with reciprocal rank fusion
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+
+# Persistent embedding and answer caches, opened on first use
+_embedding_cache: Optional[EmbeddingCache] = None
+_answer_cache: Optional[AnswerCache] = None
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Return the shared embedding cache, opening it on first use"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache()
+    return _embedding_cache
+
+def get_answer_cache() -> AnswerCache:
+    """Return the shared answer cache, opening it on first use"""
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = AnswerCache()
+    return _answer_cache
+
+@traced()
+def get_embedding(text: str, model: str = "text-embedding-ada-002",
+                  api_client=None, cache: Optional[EmbeddingCache] = None) -> List[float]:
+    """Get embedding for a query text, checking the embedding cache first"""
+    if cache is None:
+        cache = get_embedding_cache()
+    cached = cache.get(text, model)
+    current_span().set(rows=1, cached=cached is not None)
+    if cached is not None:
+        return cached
+    
+    response = (api_client or get_client()).embeddings.create(
         input=text,
         model=model
     )
-    return response.data[0].embedding
+    embedding = response.data[0].embedding
+    cache.put(text, embedding, model)
+    return embedding
+
+@traced()
+def get_embeddings(texts: List[str], model: str = "text-embedding-ada-002",
+                   api_client=None, cache: Optional[EmbeddingCache] = None) -> List[List[float]]:
+    """Get embeddings for many query texts, sending all cache misses in bulk requests"""
+    if cache is None:
+        cache = get_embedding_cache()
+    embeddings = cache.get_many(texts, model)
+    
+    # Embed each distinct missing text once
+    missing = list(dict.fromkeys(text for text, e in zip(texts, embeddings) if e is None))
+    current_span().set(rows=len(texts), missing=len(missing))
+    if missing:
+        engine = EmbeddingEngine(api_client or get_client(), model=model)
+        vectors = engine.embed(missing)
+        if any(vector is None for vector in vectors):
+            raise RuntimeError(f"Failed to embed {sum(v is None for v in vectors)} queries")
+        cache.put_many(missing, vectors, model)
+        
+        new_embeddings = dict(zip(missing, vectors))
+        embeddings = [e if e is not None else new_embeddings[text]
+                      for text, e in zip(texts, embeddings)]
+    return embeddings
 
-def load_faiss_index(index_path: str = "faiss_index.bin") -> faiss.IndexFlatL2:
-    """Load the FAISS index from file"""
-    return faiss.read_index(index_path)
+def load_index_params(index_path: str = "faiss_index.bin") -> Dict:
+    """Build/search parameters recorded in the config next to an index, if any"""
+    config_path = index_config_path(index_path)
+    if not os.path.exists(config_path):
+        return {}
+    with open(config_path, 'r') as f:
+        return json.load(f).get("params", {})
+
+def load_faiss_index(index_path: str = "faiss_index.bin",
+                     search_params: Optional[Dict] = None) -> "faiss.Index":
+    """
+    Load the FAISS index from file and restore its search settings
+    
+    nprobe/efSearch are not stored in the index file itself, so they are read from
+    the config saved next to it; `search_params` overrides them for this load.
+    Compressed and dimension-reduced indexes need nothing extra: the encoding and
+    any PCA/truncation transform are part of the index file.
+    """
+    import faiss
+    index = faiss.read_index(index_path)
+    
+    params = load_index_params(index_path)
+    params.update(search_params or {})
+    apply_search_params(index, params)
+    
+    return index
 
 def load_chunk_metadata(metadata_path: str = "chunk_metadata.json") -> List[Dict]:
     """Load chunk metadata from file"""
     with open(metadata_path, 'r') as f:
         return json.load(f)
 
-def search_similar_chunks(query: str, k: int = 5) -> Tuple[List[Dict], List[float]]:
+def ensure_metadata_store(metadata_path: str = "chunk_metadata.json") -> str:
+    """
+    Make sure the positional metadata store next to chunk_metadata.json is current
+    
+    If the store is missing or older than the JSON mapping, it is rebuilt from the
+    JSON once so later loads skip parsing it. Returns the store prefix.
+    """
+    prefix = os.path.splitext(metadata_path)[0]
+    _, offsets_path = store_paths(prefix)
+    if os.path.exists(metadata_path) and (
+            not os.path.exists(offsets_path)
+            or os.path.getmtime(offsets_path) < os.path.getmtime(metadata_path)):
+        print(f"Building metadata store from {metadata_path}")
+        convert_json_metadata(metadata_path, prefix)
+    return prefix
+
+class SwapLock:
+    """
+    Lets any number of searches share the loaded index, and a reload replace it between them
+
+    A reload waiting for `exclusive` holds off new searches, so it cannot be
+    starved under steady load. Neither side is reentrant.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._swapping = False
+
+    @contextmanager
+    def shared(self):
+        with self._condition:
+            while self._swapping:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._condition:
+            while self._swapping:
+                self._condition.wait()
+            self._swapping = True
+            while self._readers:
+                self._condition.wait()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._swapping = False
+                self._condition.notify_all()
+
+class Retriever:
+    """
+    Long-lived retriever that keeps the FAISS index and chunk metadata open.
+
+    The index is loaded once and the metadata store is memory-mapped, and both
+    are reused for every query. Before each search the retriever stats the files
+    on disk and reloads them only if their mtime or size changed, so per-query
+    cost is the embedding call, the FAISS search and k metadata lookups.
+
+    If a BM25 index was built next to the FAISS index, it is memory-mapped too
+    and `mode="hybrid"` fuses lexical and vector rankings.
+
+    If the index is lossy (compressed, dimension-reduced or IVF-PQ) and its
+    full-precision vectors were saved next to it, they are memory-mapped and
+    each search re-ranks rerank_factor * k candidates against them. They are
+    also what diversified searches compare candidates with; otherwise the
+    candidates' vectors are reconstructed from the index.
+
+    Every search takes an optional metadata filter (see metadata_filter.py),
+    resolved against the postings built next to the index and applied inside
+    the FAISS and BM25 searches, so filtered queries still return k results.
+
+    With a `reranker` (see reranker.py), each search fetches
+    `rerank_candidates` chunks and returns the k the re-ranker scores
+    highest, spending at most about `rerank_budget_ms` on re-scoring beyond
+    the first k candidates.
+
+    `index_path` may also be an index bundle (see bundle.py), in which case
+    `metadata_path` is unused: everything is mapped from the one file, which
+    is the only one stat-ed for changes, and queries are embedded with the
+    model the bundle records. Either way the index and metadata must hold the
+    same number of chunks, and query embeddings must match the index's
+    dimension, or loading and searching raise ValueError.
+
+    A retriever can be searched from several threads at once. A reload
+    builds the new index and metadata on the side and swaps them in between
+    searches, so no search sees a mix of the two or a closed store.
+
+    An ID-mapped index built by incremental_index.py returns chunk IDs rather
+    than positions; its metadata is then read from the SQLite table next to
+    it (`incremental_index.db`) and `metadata_path` is unused. Chunks deleted
+    since its last checkpoint are dropped from results.
+    """
+
+    def __init__(self, index_path: str = "faiss_index.bin",
+                 metadata_path: str = "chunk_metadata.json",
+                 search_params: Optional[Dict] = None,
+                 api_client=None, cache: Optional[EmbeddingCache] = None,
+                 reranker=None, rerank_candidates: int = DEFAULT_CANDIDATES,
+                 rerank_budget_ms: Optional[float] = None):
+        self.index_path = index_path
+        self.metadata_path = metadata_path
+        self.search_params = search_params
+        self.api_client = api_client
+        self.cache = cache
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        self.rerank_budget_ms = rerank_budget_ms
+        self.index = None
+        self.metadata = None
+        self.bm25 = None
+        self.filters = None
+        self.rerank_vectors = None
+        self.rerank_factor = 0
+        self.bundle: Optional[Bundle] = None
+        self.embedding_model = EMBEDDING_MODEL
+        self._signature = None
+        self._load_lock = threading.RLock()
+        self._swap = SwapLock()
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "loads": 0,
+            "load_time": 0.0,
+            "queries": 0,
+            "embed_time": 0.0,
+            "search_time": 0.0,
+            "bm25_time": 0.0,
+            "filtered_queries": 0,
+            "reranked_queries": 0,
+            "reranked_chunks": 0,
+            "rerank_time": 0.0,
+        }
+
+    def _count(self, key: str, amount: float = 1) -> None:
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _file_signature(self) -> Tuple:
+        """Cheap change detector for the files backing the retriever"""
+        st = os.stat(self.index_path)
+        signature = [(st.st_mtime_ns, st.st_size)]
+        if is_bundle(self.index_path):
+            return tuple(signature)
+        
+        # The JSON mapping, metadata store, index config, BM25 index, filter
+        # index and re-ranking vectors may each be absent
+        _, offsets_path = store_paths(os.path.splitext(self.metadata_path)[0])
+        bm25_meta_path = bm25_paths(bm25_prefix(self.index_path))["meta"]
+        filters_meta_path = filter_paths(filter_prefix(self.index_path))["meta"]
+        for path in (self.metadata_path, offsets_path, index_config_path(self.index_path),
+                     bm25_meta_path, filters_meta_path, rerank_vectors_path(self.index_path)):
+            if os.path.exists(path):
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size))
+            else:
+                signature.append(None)
+        return tuple(signature)
+
+    def load(self) -> None:
+        """(Re)load the index and metadata from disk, or from a bundle"""
+        # Imported here so callers that never load an index (remote shards, cached answers) skip it
+        import faiss
+        with self._load_lock:
+            start = time.perf_counter()
+            if is_bundle(self.index_path):
+                bundle = sections = Bundle(self.index_path)
+                store_prefix, bm25_path, filters_path, vectors_path = "metadata", "bm25", "filters", "vectors.npy"
+                params = bundle.index_params
+            else:
+                bundle, sections = None, FILES
+                store_prefix = ensure_metadata_store(self.metadata_path)
+                bm25_path, filters_path = bm25_prefix(self.index_path), filter_prefix(self.index_path)
+                vectors_path = rerank_vectors_path(self.index_path)
+                params = load_index_params(self.index_path)
+            signature = self._file_signature()
+
+            # Everything is opened on the side; searches keep using the current files meanwhile
+            metadata = None
+            try:
+                with span("load_index") as load_span:
+                    if bundle is None:
+                        index = load_faiss_index(self.index_path, self.search_params)
+                    else:
+                        index = bundle.read_index()
+                        apply_search_params(index, {**params, **(self.search_params or {})})
+                    if load_span.recording:
+                        load_span.set(rows=index.ntotal, bytes=os.path.getsize(self.index_path))
+                    rerank_factor = params.get("rerank_factor", 0)
+                    rerank_vectors = (sections.array(vectors_path)
+                                      if rerank_factor and sections.exists(vectors_path) else None)
+                    ivf = faiss.try_extract_index_ivf(index)
+                    if ivf is not None and rerank_vectors is None:
+                        # IVF vectors can only be reconstructed by ID (for diversification) with a direct map
+                        ivf.make_direct_map()
+                # Incremental indexes (see incremental_index.py) map chunk IDs to their SQLite table
+                id_mapped = bundle is None and isinstance(index, faiss.IndexIDMap)
+                with span("load_metadata"):
+                    metadata = (IncrementalMetadata(metadata_db_path(self.index_path)) if id_mapped
+                                else MetadataStore(store_prefix, sections))
+                    bm25 = (BM25Index(bm25_path, sections)
+                            if sections.exists(bm25_paths(bm25_path)["meta"]) else None)
+                    filters = (FilterIndex(filters_path, sections)
+                               if sections.exists(filter_paths(filters_path)["meta"]) else None)
+
+                # A mismatched index and metadata would silently return the wrong chunks
+                if not id_mapped and index.ntotal != len(metadata):
+                    raise ValueError(f"{self.index_path} holds {index.ntotal} vectors but its chunk metadata "
+                                     f"has {len(metadata)} records; rebuild them together")
+                if bundle is not None and index.d != bundle.dimension:
+                    raise ValueError(f"{self.index_path} indexes {index.d}-dimensional vectors but its "
+                                     f"manifest says {bundle.dimension}")
+            except BaseException:
+                if metadata is not None:
+                    metadata.close()
+                if bundle is not None:
+                    bundle.close()
+                raise
+
+            with self._swap.exclusive():
+                old_metadata, old_bundle = self.metadata, self.bundle
+                self.index, self.metadata, self.bm25, self.filters = index, metadata, bm25, filters
+                self.rerank_factor, self.rerank_vectors = rerank_factor, rerank_vectors
+                self.bundle = bundle
+                self.embedding_model = bundle.embedding_model if bundle is not None else EMBEDDING_MODEL
+                self._signature = signature
+            # No search can still be using the old files
+            if old_metadata is not None:
+                old_metadata.close()
+            if old_bundle is not None:
+                old_bundle.close()
+            self._count("loads")
+            self._count("load_time", time.perf_counter() - start)
+
+    @property
+    def index_version(self) -> str:
+        """Identifier of the index files currently loaded; changes whenever they are rebuilt"""
+        self.ensure_fresh()
+        return hashlib.sha256(repr(self._signature).encode("utf-8")).hexdigest()[:16]
+
+    def set_search_params(self, params: Dict) -> None:
+        """Tune nprobe/efSearch for subsequent queries without reloading"""
+        self.search_params = {**(self.search_params or {}), **params}
+        if self.index is not None:
+            apply_search_params(self.index, self.search_params)
+
+    def match_filter(self, filters: Optional[Dict]) -> Optional[FilterMatch]:
+        """Resolve a metadata filter into the chunks it matches (None for no filter)"""
+        if not filters:
+            return None
+        if self.filters is None:
+            raise ValueError(f"No metadata filter index next to {self.index_path}; "
+                             f"rebuild it with store_faiss.py")
+        with span("metadata_filter") as filter_span:
+            match = self.filters.match(filters)
+            filter_span.set(rows=match.count)
+        self._count("filtered_queries")
+        return match
+
+    def search_index(self, query_vectors: np.ndarray, k: int,
+                     match: Optional[FilterMatch] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        FAISS search, re-ranked against the full-precision vectors when the index is lossy
+
+        With `match`, only the matching chunks are searched.
+        """
+        factor = (self.search_params or {}).get("rerank_factor", self.rerank_factor)
+        reranking = self.rerank_vectors is not None and factor
+        fetch_k = k * factor if reranking else k
+        with span("faiss_search", rows=len(query_vectors) * fetch_k):
+            if match is None:
+                distances, candidates = self.index.search(query_vectors, fetch_k)
+            else:
+                distances, candidates = filtered_search(self.index, query_vectors, fetch_k,
+                                                        match, self.rerank_vectors)
+        if not reranking:
+            return distances, candidates
+        with span("rerank", rows=int(candidates.size)):
+            return rerank(self.rerank_vectors, query_vectors, candidates, k)
+
+    def check_dimension(self, query_vectors: np.ndarray) -> None:
+        """Raise if query embeddings cannot have come from the model the index was built with"""
+        if query_vectors.shape[1] != self.index.d:
+            raise ValueError(f"Query embeddings have {query_vectors.shape[1]} dimensions but {self.index_path} "
+                             f"expects {self.index.d}; embed queries with the model it was built with "
+                             f"({self.embedding_model})")
+
+    def ensure_fresh(self) -> None:
+        """Load on first use, and reload if the files on disk have changed"""
+        if self.index is None or self._file_signature() != self._signature:
+            with self._load_lock:
+                # Another thread may have reloaded them while this one waited
+                if self.index is None or self._file_signature() != self._signature:
+                    self.load()
+
+    def search(self, query: str, k: int = 5, mode: str = "vector",
+               filters: Optional[Dict] = None, diversity: float = 0.0) -> Tuple[List[Dict], List[float]]:
+        """
+        Embed the query and return the top-k chunks with their scores
+        
+        With mode="vector" the scores are L2 distances (lower is better). With
+        mode="lexical" they are BM25 scores and with mode="hybrid" reciprocal
+        rank fusion scores (both higher is better). `filters` restricts the
+        search to chunks whose metadata matches, e.g. {"doc_id": "openai_api_docs"}.
+        
+        With `diversity` in (0, 1], k results are picked from a deeper
+        candidate list by maximal marginal relevance, trading relevance for
+        novelty, and chunks mostly overlapping a picked chunk are skipped
+        (see dedup.mmr). Results then come in selection order.
+        
+        With a re-ranker configured, the scores are re-ranker scores (higher is
+        better) whatever the mode, and diversity picks among the re-ranked
+        candidates in their new order.
+        """
+        # Load first, so a (re)load is not counted as embedding time
+        self.ensure_fresh()
+        start = time.perf_counter()
+        query_embedding = get_embedding(query, self.embedding_model, self.api_client, self.cache)
+        self._count("embed_time", time.perf_counter() - start)
+
+        return self.search_embedded(query, query_embedding, k, mode, filters, diversity)
+
+    @traced("search")
+    def search_embedded(self, query: str, query_embedding: Optional[List[float]], k: int = 5,
+                        mode: str = "vector", filters: Optional[Dict] = None,
+                        diversity: float = 0.0) -> Tuple[List[Dict], List[float]]:
+        """Like search, for a query whose embedding is already known (optional for mode="lexical")"""
+        current_span().set(mode=mode, k=k)
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {mode!r}, expected one of {SEARCH_MODES}")
+
+        self.ensure_fresh()
+        with self._swap.shared():
+            if mode != "vector" and self.bm25 is None:
+                raise ValueError(f"No BM25 index next to {self.index_path}; rebuild it with store_faiss.py")
+            start = time.perf_counter()
+            match = self.match_filter(filters)
+            query_vector = (np.array([query_embedding]).astype('float32')
+                            if query_embedding is not None else None)
+            if query_vector is not None:
+                self.check_dimension(query_vector)
+
+            fetch_k = self.fetch_depth(k, diversity)
+            if mode == "vector":
+                positions, scores = self.rank_vector(query_vector, fetch_k, match)
+            elif mode == "lexical":
+                positions, scores = self.rank_lexical(query, fetch_k, match)
+            else:
+                positions, scores = self.rank_hybrid(query, query_vector, fetch_k, match)
+
+            top_chunks, scores = self.refine(query, query_vector, positions, scores, k, diversity)
+
+        self._count("queries")
+        self._count("search_time", time.perf_counter() - start)
+
+        return top_chunks, scores
+
+    def rank_vector(self, query_vector: np.ndarray, k: int,
+                    match: Optional[FilterMatch] = None) -> Tuple[List[int], List[float]]:
+        """Top-k chunk positions and L2 distances for one query vector"""
+        distances, indices = self.search_index(query_vector, k, match)
+        # FAISS pads with -1 when k > ntotal (or fewer chunks match the filter)
+        found = indices[0] != -1
+        return indices[0][found].tolist(), distances[0][found].tolist()
+
+    def rank_lexical(self, query: str, k: int,
+                     match: Optional[FilterMatch] = None) -> Tuple[List[int], List[float]]:
+        """Top-k chunk positions and BM25 scores"""
+        start = time.perf_counter()
+        with span("bm25_search", rows=k):
+            ranking = self.bm25.search(query, k, None if match is None else match.mask)
+        self._count("bm25_time", time.perf_counter() - start)
+        return ranking
+
+    def rank_hybrid(self, query: str, query_vector: np.ndarray, k: int,
+                    match: Optional[FilterMatch] = None) -> Tuple[List[int], List[float]]:
+        """Top-k chunk positions and reciprocal rank fusion scores of the vector and BM25 rankings"""
+        # Rank a deeper candidate list from each side so fusion has overlap to work with
+        fetch_k = max(4 * k, 20)
+        vector_ranking, _ = self.rank_vector(query_vector, fetch_k, match)
+        lexical_ranking, _ = self.rank_lexical(query, fetch_k, match)
+        return reciprocal_rank_fusion([vector_ranking, lexical_ranking], k)
+
+    def candidate_vectors(self, positions: List[int]) -> np.ndarray:
+        """Vectors of chunk positions, from the re-ranking vectors or reconstructed from the index"""
+        positions = np.asarray(positions, dtype=np.int64)
+        if self.rerank_vectors is not None:
+            return np.asarray(self.rerank_vectors[positions], dtype=np.float32)
+        return self.index.reconstruct_batch(positions)
+
+    def fetch_depth(self, k: int, diversity: float) -> int:
+        """First-stage candidates to rank for k results; re-ranking and diversification pick from more"""
+        fetch_k = k
+        if self.reranker is not None:
+            fetch_k = max(fetch_k, self.rerank_candidates)
+        if diversity:
+            fetch_k = max(fetch_k, DIVERSITY_FETCH_FACTOR * k, 20)
+        return fetch_k
+
+    def refine(self, query: str, query_vector: Optional[np.ndarray], positions: List[int],
+               scores: List[float], k: int, diversity: float) -> Tuple[List[Dict], List[float]]:
+        """Look up the ranked candidates and narrow them to k: re-rank, then diversify, if enabled"""
+        with span("metadata_lookup", rows=len(positions)):
+            records = self.metadata.get_many(positions)
+        if None in records:
+            # Chunks deleted from an incremental index since its last checkpoint
+            kept = [i for i, record in enumerate(records) if record is not None]
+            positions, scores, records = ([positions[i] for i in kept], [scores[i] for i in kept],
+                                          [records[i] for i in kept])
+        if self.reranker is not None and records:
+            start = time.perf_counter()
+            with span("rerank_candidates", rows=len(records)) as rerank_span:
+                order, scores = rerank_texts(self.reranker, query, [r["text"] for r in records],
+                                             k, self.rerank_budget_ms)
+                rerank_span.set(scored=len(order))
+            positions = [positions[i] for i in order]
+            records = [records[i] for i in order]
+            self._count("reranked_queries")
+            self._count("reranked_chunks", len(order))
+            self._count("rerank_time", time.perf_counter() - start)
+            # Relevance for MMR is now the re-ranked order rather than vector similarity
+            query_vector = None
+        if diversity:
+            with span("diversify", rows=len(positions)):
+                chosen = mmr(query_vector, self.candidate_vectors(positions), records, k, diversity)
+            return [records[i] for i in chosen], [scores[i] for i in chosen]
+        return records[:k], scores[:k]
+
+    def search_lexical(self, query: str, k: int = 5,
+                       filters: Optional[Dict] = None) -> Tuple[List[Dict], List[float]]:
+        """Return the top-k chunks by BM25 score alone"""
+        return self.search_embedded(query, None, k, "lexical", filters)
+
+    def search_vector(self, query_embedding: List[float], k: int = 5, filters: Optional[Dict] = None,
+                      diversity: float = 0.0) -> Tuple[List[Dict], List[float]]:
+        """Return the top-k chunks and distances for an already-embedded query"""
+        return self.search_embedded("", query_embedding, k, "vector", filters, diversity)
+
+    def search_batch(self, queries: List[str], k: int = 5, filters: Optional[Dict] = None,
+                     diversity: float = 0.0) -> List[Tuple[List[Dict], List[float]]]:
+        """
+        Search for many queries at once
+        
+        Queries are embedded in bulk and searched with a single (n, d) matrix, which
+        lets FAISS use its multithreaded BLAS path. Metadata for all hits is then
+        resolved in one pass. Results come back in input order. `filters` and
+        `diversity` apply to every query, as does the re-ranker, per query.
+        """
+        if not queries:
+            return []
+
+        # Get query embeddings in bulk
+        start = time.perf_counter()
+        embeddings = get_embeddings(queries, self.embedding_model, self.api_client, self.cache)
+        self._count("embed_time", time.perf_counter() - start)
+        return self.search_batch_embedded(queries, embeddings, k, filters, diversity)
+
+    def search_batch_embedded(self, queries: List[str], query_embeddings: List[List[float]],
+                              k: int = 5, filters: Optional[Dict] = None,
+                              diversity: float = 0.0) -> List[Tuple[List[Dict], List[float]]]:
+        """Like search_batch, for queries whose embeddings are already known"""
+        self.ensure_fresh()
+        if not queries:
+            return []
+
+        start = time.perf_counter()
+        query_vectors = np.array(query_embeddings).astype('float32')
+        with self._swap.shared():
+            self.check_dimension(query_vectors)
+
+            # One search call for the whole batch
+            fetch_k = self.fetch_depth(k, diversity)
+            distances, indices = self.search_index(query_vectors, fetch_k, self.match_filter(filters))
+
+            found = indices != -1
+            if diversity or self.reranker is not None:
+                results = [self.refine(query, query_vector[None], row_indices[row_found].tolist(),
+                                       row_distances[row_found].tolist(), k, diversity)
+                           for query, query_vector, row_indices, row_distances, row_found
+                           in zip(queries, query_vectors, indices, distances, found)]
+            else:
+                # Decode each distinct hit once, then fan results back out per query
+                hit_positions = np.unique(indices[found])
+                with span("metadata_lookup", rows=len(hit_positions)):
+                    records = dict(zip(hit_positions.tolist(), self.metadata.get_many(hit_positions)))
+                results = []
+                for row_indices, row_distances, row_found in zip(indices, distances, found):
+                    # Chunks deleted from an incremental index since its last checkpoint have no record
+                    hits = [(records[idx], distance) for idx, distance
+                            in zip(row_indices[row_found].tolist(), row_distances[row_found].tolist())
+                            if records[idx] is not None]
+                    results.append(([record for record, _ in hits], [distance for _, distance in hits]))
+
+        self._count("queries", len(queries))
+        self._count("search_time", time.perf_counter() - start)
+
+        return results
+
+    def get_stats(self) -> Dict[str, float]:
+        """Return load/query counters, including per-query averages"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        queries = max(stats["queries"], 1)
+        stats["avg_embed_time"] = stats["embed_time"] / queries
+        stats["avg_search_time"] = stats["search_time"] / queries
+        stats["avg_bm25_time"] = stats["bm25_time"] / queries
+        stats["avg_rerank_time"] = stats["rerank_time"] / max(stats["reranked_queries"], 1)
+        return stats
+
+# Shared retriever used by the module-level helpers
+_default_retriever: Optional[Retriever] = None
+
+# Shard manifest (see sharded_index.py); when set, the module-level helpers fan
+# each query out across the shards instead of searching faiss_index.bin
+SHARD_MANIFEST = os.getenv("RAG_SHARD_MANIFEST")
+
+# Index bundle (see bundle.py) for the module-level helpers, instead of
+# faiss_index.bin and chunk_metadata.json
+BUNDLE = os.getenv("RAG_BUNDLE")
+
+# Index file for the module-level helpers when no bundle is set, e.g.
+# incremental_index.bin to serve the index change_capture.py keeps up to date
+INDEX = os.getenv("RAG_INDEX", "faiss_index.bin")
+
+# Re-ranker for the module-level helpers (a cross-encoder name or "lexical",
+# see reranker.py) and its latency budget in milliseconds; unset disables re-ranking
+RERANKER = os.getenv("RAG_RERANKER")
+RERANK_BUDGET_MS = os.getenv("RAG_RERANK_BUDGET_MS")
+
+def get_retriever() -> Retriever:
+    """Return the process-wide retriever, creating it on first use"""
+    global _default_retriever
+    if _default_retriever is None:
+        rerank_options = {}
+        if RERANKER:
+            rerank_options = {"reranker": get_reranker(RERANKER),
+                              "rerank_budget_ms": float(RERANK_BUDGET_MS) if RERANK_BUDGET_MS else None}
+        if SHARD_MANIFEST:
+            from sharded_index import ShardedRetriever
+            _default_retriever = ShardedRetriever.from_manifest(SHARD_MANIFEST, **rerank_options)
+        else:
+            _default_retriever = Retriever(BUNDLE or INDEX, **rerank_options)
+    return _default_retriever
+
+@traced()
+def search_similar_chunks(query: str, k: int = 5, mode: str = "vector",
+                          filters: Optional[Dict] = None,
+                          diversity: float = 0.0) -> Tuple[List[Dict], List[float]]:
     """
-    Search for similar chunks using FAISS
+    Search for similar chunks using FAISS, BM25 (mode="lexical") or both fused (mode="hybrid")
+    
+    `filters` restricts results to chunks whose metadata matches, e.g.
+    {"doc_id": "openai_api_docs"} or {"chunk_size": {"$gte": 500}}. A
+    `diversity` above 0 swaps near-duplicate and overlapping chunks for
+    novel ones (maximal marginal relevance), so fewer prompt tokens repeat.
     Returns:
         - List of top-k similar chunks with their metadata
-        - List of corresponding distances
+        - List of corresponding distances (BM25 or fused scores in the other modes)
     """
-    # Get query embedding
-    query_embedding = get_embedding(query)
-    query_vector = np.array([query_embedding]).astype('float32')
-    
-    # Load FAISS index
-    index = load_faiss_index()
-    
-    # Search for similar vectors
-    distances, indices = index.search(query_vector, k)
-    
-    # Load chunk metadata
-    metadata = load_chunk_metadata()
-    
-    # Get top-k chunks using dictionary access
-    top_chunks = [metadata[str(int(idx))] for idx in indices[0]]
-    
-    return top_chunks, distances[0].tolist()
+    return get_retriever().search(query, k, mode, filters, diversity)
+
+@traced()
+def search_similar_chunks_batch(queries: List[str], k: int = 5, filters: Optional[Dict] = None,
+                                diversity: float = 0.0) -> List[Tuple[List[Dict], List[float]]]:
+    """Batch version of search_similar_chunks; results are in input order"""
+    return get_retriever().search_batch(queries, k, filters, diversity)
 
-def format_context(chunks: List[Dict]) -> str:
-    """Format retrieved chunks into a context string"""
+@traced()
+def format_context(chunks: List[Dict], max_tokens: Optional[int] = None) -> str:
+    """
+    Format retrieved chunks into a context string
+    
+    With `max_tokens`, chunks are taken in rank order and any chunk that would
+    push the context over the budget is skipped, so as many of the top chunks
+    as possible fit.
+    """
     context = ""
-    for i, chunk in enumerate(chunks):
-        context += f"Chunk {i+1}:\n{chunk['text']}\n\n"
-    return context.strip()
+    used = 0
+    included = 0
+    for chunk in chunks:
+        entry = f"Chunk {included+1}:\n{chunk['text']}\n\n"
+        if max_tokens is not None:
+            tokens = count_tokens(entry)
+            if used + tokens > max_tokens:
+                continue
+            used += tokens
+        context += entry
+        included += 1
+    context = context.strip()
+    format_span = current_span()
+    if format_span.recording:
+        format_span.set(rows=included, skipped=len(chunks) - included,
+                        bytes=len(context.encode("utf-8")))
+    return context
 
-def query_and_retrieve(query: str, k: int = 5) -> Tuple[str, List[float]]:
+def query_and_retrieve(query: str, k: int = 5, mode: str = "vector",
+                       max_context_tokens: int = CONTEXT_TOKEN_BUDGET,
+                       filters: Optional[Dict] = None, diversity: float = 0.0) -> Tuple[str, List[float]]:
     """
     Main function to process query and retrieve relevant chunks
     Returns:
@@ -69,17 +750,23 @@ def query_and_retrieve(query: str, k: int = 5) -> Tuple[str, List[float]]:
         - List of distances for retrieved chunks
     """
     # Search for similar chunks
-    chunks, distances = search_similar_chunks(query, k)
+    chunks, distances = search_similar_chunks(query, k, mode, filters, diversity)
     
     # Format chunks into context
-    context = format_context(chunks)
+    context = format_context(chunks, max_context_tokens)
     
     return context, distances
 
-def generate_answer(query: str, context: str) -> str:
-    """
-    Generate an answer using the retrieved context and OpenAI's chat completion
-    """
+def query_and_retrieve_batch(queries: List[str], k: int = 5,
+                             max_context_tokens: int = CONTEXT_TOKEN_BUDGET,
+                             filters: Optional[Dict] = None,
+                             diversity: float = 0.0) -> List[Tuple[str, List[float]]]:
+    """Batch version of query_and_retrieve for offline evaluation jobs"""
+    return [(format_context(chunks, max_context_tokens), distances)
+            for chunks, distances in search_similar_chunks_batch(queries, k, filters, diversity)]
+
+def build_messages(query: str, context: str) -> List[Dict[str, str]]:
+    """Build the chat messages asking the model to answer from the retrieved context only"""
     system_prompt = """You are a highly accurate assistant. Use ONLY the context below to answer the user's question. 
     If the answer cannot be found in the context, respond with: "I don't know based on the provided information."
     Do not make up or guess information. Be precise and factual."""
@@ -90,34 +777,67 @@ def generate_answer(query: str, context: str) -> str:
     ---------------------
     Given ONLY the context information above and no prior knowledge, answer the question: {query}"""
     
-    response = client.chat.completions.create(
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+@traced()
+def generate_answer(query: str, context: str) -> str:
+    """
+    Generate an answer using the retrieved context and OpenAI's chat completion
+    """
+    response = get_client().chat.completions.create(
         model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
+        messages=build_messages(query, context),
         temperature=0.3  # Lower temperature for more focused, deterministic responses
     )
     
+    if response.usage is not None:
+        current_span().set(prompt_tokens=response.usage.prompt_tokens,
+                           completion_tokens=response.usage.completion_tokens)
     return response.choices[0].message.content
 
-def query_and_answer(query: str, k: int = 5) -> Tuple[str, str, List[float]]:
+@traced()
+def query_and_answer(query: str, k: int = 5, mode: str = "vector",
+                     answer_cache: Optional[AnswerCache] = None,
+                     max_context_tokens: int = CONTEXT_TOKEN_BUDGET,
+                     filters: Optional[Dict] = None, diversity: float = 0.0) -> Tuple[str, str, List[float]]:
     """
     Complete pipeline: query, retrieve context, and generate answer
+    
+    Answers are reused from the answer cache when the same (or a semantically
+    close) query retrieved the same chunks from the current index.
     Returns:
         - Generated answer
         - Retrieved context
         - List of distances for retrieved chunks
     """
-    # Get context and distances
-    context, distances = query_and_retrieve(query, k)
+    retriever = get_retriever()
+    if answer_cache is None:
+        answer_cache = get_answer_cache()
+    
+    # Get context and distances, keeping the query embedding for the semantic cache
+    # Read once, before searching: it reloads a changed index, and the answer
+    # is looked up and cached under the version the chunks come from
+    index_version = retriever.index_version
+    query_embedding = get_embedding(query, retriever.embedding_model, retriever.api_client, retriever.cache)
+    chunks, distances = retriever.search_embedded(query, query_embedding, k, mode, filters, diversity)
+    context = format_context(chunks, max_context_tokens)
     
-    # Generate answer
-    answer = generate_answer(query, context)
+    # Generate answer unless a cached one applies
+    with span("answer_cache_lookup") as lookup_span:
+        answer = answer_cache.get(query, query_embedding, chunks, index_version)
+        lookup_span.set(hit=answer is not None)
+    if answer is None:
+        answer = generate_answer(query, context)
+        answer_cache.put(query, query_embedding, chunks, answer, index_version)
     
     return answer, context, distances
 
 if __name__ == "__main__":
+    from tracing import is_enabled, stage_stats
+    
     # Example usage
     query = "Who is the CEO of Anthropic?"
     answer, context, distances = query_and_answer(query)
@@ -129,4 +849,11 @@ if __name__ == "__main__":
     print("\nAnswer:")
     print(answer)
     print("\nDistances:")
-    print(distances) 
\ No newline at end of file
+    print(distances)
+    print("\nRetriever stats:")
+    print(get_retriever().get_stats())
+    print("\nAnswer cache stats:")
+    print(get_answer_cache().stats())
+    if is_enabled():
+        print("\nPer-stage timings:")
+        print(json.dumps(stage_stats(), indent=2)) 
\ No newline at end of file
@@ -0,0 +1,111 @@
+"""
+Second-stage re-ranking of retrieved candidates
+
+The first stage (FAISS, BM25 or hybrid) over-fetches candidates cheaply; a
+re-ranker then scores each (query, chunk) pair jointly and only the best k
+go into the prompt, so a small k carries the chunks a large k would have
+caught.
+
+Re-rankers, by name:
+    any sentence-transformers CrossEncoder, e.g. the default
+        "cross-encoder/ms-marco-MiniLM-L-6-v2" (22M parameters, a few ms per
+        pair on CPU); needs `pip install sentence-transformers`
+    "lexical": query term and bigram coverage, no model; for offline runs
+        and benchmarks
+
+`rerank_texts` scores candidates batch by batch in first-stage order and stops
+starting batches once the next one is expected to overrun the latency
+budget, timing the batches as it goes. The first k candidates are always
+scored, so every returned result has a re-ranker score; the budget decides
+how many candidates beyond those get a chance to move up.
+"""
+import time
+from collections import Counter
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from bm25_index import tokenize
+
+DEFAULT_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+# First-stage candidates fetched for the re-ranker to choose k from
+DEFAULT_CANDIDATES = 50
+
+# (query, chunk) pairs per model call
+DEFAULT_BATCH_SIZE = 16
+
+class CrossEncoderReranker:
+    """sentence-transformers cross-encoder run on CPU"""
+
+    def __init__(self, model_name: str = DEFAULT_MODEL, max_length: int = 512):
+        from sentence_transformers import CrossEncoder
+        self.name = model_name
+        self.model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        """Relevance of each text to the query, higher is better"""
+        scores = self.model.predict([(query, text) for text in texts],
+                                    batch_size=len(texts), show_progress_bar=False)
+        return [float(score) for score in scores]
+
+class LexicalReranker:
+    """
+    Query term and adjacent-pair coverage, scored per (query, chunk) pair like a cross-encoder
+
+    Each distinct query term found counts 1 (saturating with repeats), and
+    each query bigram found in order counts `bigram_weight`, so chunks that
+    contain the query's phrasing beat chunks that merely share its words.
+    """
+    name = "lexical"
+
+    def __init__(self, k1: float = 1.2, bigram_weight: float = 1.0):
+        self.k1 = k1
+        self.bigram_weight = bigram_weight
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        terms = tokenize(query)
+        distinct = set(terms)
+        bigrams = set(zip(terms, terms[1:]))
+        scores = []
+        for text in texts:
+            tokens = tokenize(text)
+            counts = Counter(tokens)
+            score = sum(counts[term] * (self.k1 + 1) / (counts[term] + self.k1)
+                        for term in distinct if counts[term])
+            if bigrams:
+                score += self.bigram_weight * len(bigrams & set(zip(tokens, tokens[1:])))
+            scores.append(score / max(len(distinct), 1))
+        return scores
+
+@lru_cache(maxsize=None)
+def get_reranker(name: str = DEFAULT_MODEL):
+    """Return the process-wide re-ranker for a name, loading the model on first use"""
+    if name == "lexical":
+        return LexicalReranker()
+    return CrossEncoderReranker(name)
+
+def rerank_texts(reranker, query: str, texts: List[str], k: int, budget_ms: Optional[float] = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE) -> Tuple[List[int], List[float]]:
+    """
+    Re-score candidate texts, given in first-stage order, within a latency budget
+
+    Returns the indices of the candidates that were scored, best first, and
+    their re-ranker scores. At least the first k are scored; later batches
+    only run while they are expected to finish within `budget_ms`.
+    """
+    start = time.perf_counter()
+    deadline = start + budget_ms / 1000 if budget_ms is not None else None
+    scores: List[float] = []
+    end = min(len(texts), max(k, batch_size))
+    while True:
+        scores.extend(reranker.score(query, texts[len(scores):end]))
+        if end == len(texts):
+            break
+        if deadline is not None:
+            now = time.perf_counter()
+            per_text = (now - start) / len(scores)
+            if now + per_text * min(batch_size, len(texts) - end) > deadline:
+                break
+        end = min(len(texts), end + batch_size)
+    order = sorted(range(len(scores)), key=lambda i: (-scores[i], i))
+    return order, [scores[i] for i in order]
@@ -0,0 +1,514 @@
+"""
+Asyncio HTTP service around query_and_retrieve / query_and_answer
+
+Endpoints:
+    POST /retrieve   {"query": "...", "k": 5, "mode": "vector"}  -> {"context", "distances", "chunks"}
+                     "mode": "hybrid" fuses BM25 with the vector search, "lexical" is BM25 only;
+                     an "embedding" list skips embedding the query (used by sharded fan-out);
+                     a "filter" object restricts results by chunk metadata, e.g.
+                     {"doc_id": "openai_api_docs"} (see metadata_filter.py), and
+                     "diversity": 0-1 trades relevance for novel chunks (see dedup.py)
+    POST /answer     {"query": "...", "k": 5, "stream": true}
+                     streams answer tokens as server-sent events; the final event
+                     carries the distances. With "stream": false returns JSON.
+    POST /retrieve_batch {"queries": [...], "k": 5, "embeddings": [[...], ...]}
+                     -> {"results": [{"chunks", "distances"}, ...]}, vector search of the
+                     whole batch in one call (used by sharded fan-out of search_batch)
+    GET  /stats      retriever and server counters, plus per-stage timings when tracing
+    GET  /metrics    per-stage timings and server counters in Prometheus text format
+
+Answers are served from the shared answer cache when the same or a
+semantically close query retrieved the same chunks before.
+
+The FAISS index and metadata stay resident in a Retriever (or, with --shards,
+a ShardedRetriever that fans each query out across shards), and a single
+openai.AsyncOpenAI client (one pooled HTTP connection pool) is shared by all
+requests. At most `max_concurrency` requests run at once; up to `max_queue`
+more wait, and anything beyond that is rejected with 503 so load sheds
+instead of piling up.
+
+Run against a local mock of the API:
+    python mock_openai_server.py &
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=mock python server.py
+
+With --trace, every request records spans for its stages (see tracing.py);
+--trace-file also appends them to a JSONL file, and --profile writes a
+sampling profile as collapsed stacks on shutdown.
+
+With --reranker, every search over-fetches candidates and returns the k a
+re-ranking model scores highest (see reranker.py), within --rerank-budget-ms.
+"""
+import argparse
+import asyncio
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+import openai
+from dotenv import load_dotenv
+
+from answer_cache import AnswerCache
+from embedding_cache import EmbeddingCache
+from query_retrieve import (CONTEXT_TOKEN_BUDGET, SEARCH_MODES, Retriever, build_messages,
+                            format_context, get_answer_cache, get_embedding_cache)
+from reranker import DEFAULT_CANDIDATES, DEFAULT_MODEL, get_reranker
+from tracing import SamplingProfiler, enable, is_enabled, prometheus_text, span, stage_stats
+
+# Load environment variables
+load_dotenv()
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found",
+               405: "Method Not Allowed", 413: "Payload Too Large",
+               500: "Internal Server Error", 503: "Service Unavailable"}
+
+# Largest request body read; a query with a 1536-dimensional embedding is about 40 KB
+MAX_BODY_BYTES = 1 << 20
+
+# Largest k served by default; requests asking for more get this many
+MAX_K = 100
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class RAGServer:
+    """Serves retrieval and answer generation over HTTP with bounded concurrency"""
+
+    def __init__(self, retriever: Retriever, client: "openai.AsyncOpenAI",
+                 cache: Optional[EmbeddingCache] = None,
+                 answer_cache: Optional[AnswerCache] = None,
+                 embedding_model: Optional[str] = None,
+                 chat_model: str = "gpt-3.5-turbo",
+                 max_concurrency: int = 32, max_queue: int = 256,
+                 max_context_tokens: int = CONTEXT_TOKEN_BUDGET, max_k: int = MAX_K):
+        self.retriever = retriever
+        self.client = client
+        self.cache = cache if cache is not None else get_embedding_cache()
+        self.answer_cache = answer_cache if answer_cache is not None else get_answer_cache()
+        self.embedding_model = embedding_model
+        self.chat_model = chat_model
+        self.max_queue = max_queue
+        self.max_context_tokens = max_context_tokens
+        self.max_k = max_k
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+        self.stats = {"requests": 0, "rejected": 0, "errors": 0, "in_flight": 0}
+
+    async def embed_query(self, query: str) -> List[float]:
+        """Embed a query through the shared cache and the pooled async client"""
+        # By default, with the model the retriever's index (or bundle) was built with
+        model = self.embedding_model or self.retriever.embedding_model
+        with span("get_embedding", rows=1) as embed_span:
+            # The caches are SQLite, so their lookups and writes stay off the event loop
+            cached = await asyncio.to_thread(self.cache.get, query, model)
+            embed_span.set(cached=cached is not None)
+            if cached is not None:
+                return cached
+            response = await self.client.embeddings.create(input=query, model=model)
+            embedding = response.data[0].embedding
+            await asyncio.to_thread(self.cache.put, query, embedding, model)
+            return embedding
+
+    async def retrieve(self, query: str, k: int = 5, mode: str = "vector",
+                       embedding: Optional[List[float]] = None,
+                       filters: Optional[Dict] = None,
+                       diversity: float = 0.0) -> Tuple[List[Dict], List[float]]:
+        """Async counterpart of search_similar_chunks"""
+        if embedding is None:
+            embedding = await self.embed_query(query)
+        # FAISS releases the GIL, so searching on a worker thread keeps the loop responsive
+        return await asyncio.to_thread(self.retriever.search_embedded, query, embedding, k, mode,
+                                       filters, diversity)
+
+    async def stream_answer(self, query: str, context: str):
+        """Yield answer tokens from a streamed chat completion"""
+        stream = await self.client.chat.completions.create(
+            model=self.chat_model,
+            messages=build_messages(query, context),
+            temperature=0.3,
+            stream=True,
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def generate_answer(self, query: str, context: str) -> str:
+        """Async counterpart of generate_answer"""
+        with span("generate_answer") as answer_span:
+            response = await self.client.chat.completions.create(
+                model=self.chat_model,
+                messages=build_messages(query, context),
+                temperature=0.3,
+            )
+            if response.usage is not None:
+                answer_span.set(prompt_tokens=response.usage.prompt_tokens,
+                                completion_tokens=response.usage.completion_tokens)
+            return response.choices[0].message.content
+
+    def read_index_version(self) -> str:
+        """Version of the index being served (blocking: stats the index files and may reload them)"""
+        return self.retriever.index_version
+
+    async def cached_answer(self, query: str, embedding: List[float], chunks: List[Dict],
+                            index_version: str) -> Optional[str]:
+        """Look up an answer for this query and context retrieved from `index_version`"""
+        with span("answer_cache_lookup") as lookup_span:
+            answer = await asyncio.to_thread(self.answer_cache.get, query, embedding, chunks,
+                                             index_version, self.chat_model)
+            lookup_span.set(hit=answer is not None)
+            return answer
+
+    async def cache_answer(self, query: str, embedding: List[float], chunks: List[Dict],
+                           answer: str, index_version: str) -> None:
+        await asyncio.to_thread(self.answer_cache.put, query, embedding, chunks, answer,
+                                index_version, self.chat_model)
+
+    async def answer_tokens(self, query: str, embedding: List[float], chunks: List[Dict],
+                            context: str, index_version: str):
+        """Yield answer tokens, from the answer cache when possible, caching completed streams"""
+        cached = await self.cached_answer(query, embedding, chunks, index_version)
+        if cached is not None:
+            yield cached
+            return
+        tokens = []
+        async for token in self.stream_answer(query, context):
+            tokens.append(token)
+            yield token
+        await self.cache_answer(query, embedding, chunks, "".join(tokens), index_version)
+
+    async def _acquire(self) -> None:
+        """Take a concurrency slot, or raise 503 if too many requests are already waiting"""
+        if self._slots.locked() and self._waiting >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise HTTPError(503, "Server is at capacity, retry later")
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        self.stats["in_flight"] += 1
+
+    def limit_k(self, k: int) -> int:
+        """Reject a k below 1 and cap it at max_k"""
+        if k < 1:
+            raise HTTPError(400, '"k" must be at least 1')
+        return min(k, self.max_k)
+
+    def _release(self) -> None:
+        self.stats["in_flight"] -= 1
+        self._slots.release()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve a single HTTP/1.1 request on a connection, then close it"""
+        try:
+            try:
+                method, path, body = await read_request(reader)
+                self.stats["requests"] += 1
+                await self.route(method, path, body, writer)
+            except HTTPError as e:
+                await write_json(writer, e.status, {"error": str(e)},
+                                 {"Retry-After": "1"} if e.status == 503 else None)
+            except Exception as e:
+                self.stats["errors"] += 1
+                await write_json(writer, 500, {"error": str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def metrics(self) -> str:
+        """Per-stage span metrics plus server counters, in Prometheus text format"""
+        lines = [prometheus_text().rstrip("\n")]
+        for name, value in self.stats.items():
+            kind = "gauge" if name == "in_flight" else "counter"
+            metric = f"rag_server_{name}" + ("_total" if kind == "counter" else "")
+            lines += [f"# TYPE {metric} {kind}", f"{metric} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def collect_stats(self) -> Dict:
+        """Everything /stats reports (blocking: it queries the caches and stats the index files)"""
+        stats = {"server": self.stats,
+                 "index_version": self.retriever.index_version,
+                 "retriever": self.retriever.get_stats(),
+                 "embedding_cache": self.cache.stats(),
+                 "answer_cache": self.answer_cache.stats()}
+        if is_enabled():
+            stats["stages"] = stage_stats()
+        return stats
+
+    async def route(self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter) -> None:
+        if path == "/stats":
+            await write_json(writer, 200, await asyncio.to_thread(self.collect_stats))
+            return
+        if path == "/metrics":
+            await write_text(writer, 200, self.metrics(), "text/plain; version=0.0.4")
+            return
+        if path not in ("/retrieve", "/answer", "/retrieve_batch"):
+            raise HTTPError(404, f"Unknown path {path}")
+        if method != "POST":
+            raise HTTPError(405, "Use POST")
+        if path == "/retrieve_batch":
+            await self.route_batch(body, writer)
+            return
+
+        try:
+            request = json.loads(body or b"{}")
+            query = request["query"]
+            k = int(request.get("k", 5))
+            mode = request.get("mode", "vector")
+            embedding = request.get("embedding")
+            if embedding is not None:
+                embedding = [float(x) for x in embedding]
+            diversity = float(request.get("diversity") or 0.0)
+        except (ValueError, KeyError, TypeError):
+            raise HTTPError(400, 'Expected a JSON body like {"query": "...", "k": 5}')
+        if not isinstance(query, str) or not query.strip():
+            raise HTTPError(400, '"query" must be a non-empty string')
+        k = self.limit_k(k)
+        if mode not in SEARCH_MODES:
+            raise HTTPError(400, f'"mode" must be one of {", ".join(SEARCH_MODES)}')
+        if not isinstance(request.get("filter") or {}, dict):
+            raise HTTPError(400, '"filter" must be a JSON object, e.g. {"doc_id": "..."}')
+        if not 0.0 <= diversity <= 1.0:
+            raise HTTPError(400, '"diversity" must be between 0 and 1')
+
+        await self._acquire()
+        try:
+            with span(path.lstrip("/"), mode=mode, k=k):
+                await self.respond(path, request, query, k, mode, embedding, writer, diversity)
+        finally:
+            self._release()
+
+    async def route_batch(self, body: bytes, writer: asyncio.StreamWriter) -> None:
+        """Search many queries with one retriever call; sharded fan-out sends each worker one of these"""
+        try:
+            request = json.loads(body or b"{}")
+            queries = request["queries"]
+            k = int(request.get("k", 5))
+            embeddings = request.get("embeddings")
+            if embeddings is not None:
+                embeddings = [[float(x) for x in embedding] for embedding in embeddings]
+            diversity = float(request.get("diversity") or 0.0)
+        except (ValueError, KeyError, TypeError):
+            raise HTTPError(400, 'Expected a JSON body like {"queries": ["..."], "k": 5}')
+        if not isinstance(queries, list) or not all(isinstance(query, str) and query.strip()
+                                                    for query in queries):
+            raise HTTPError(400, '"queries" must be a list of non-empty strings')
+        k = self.limit_k(k)
+        if embeddings is not None and len(embeddings) != len(queries):
+            raise HTTPError(400, '"embeddings" must hold one embedding per query')
+        if not isinstance(request.get("filter") or {}, dict):
+            raise HTTPError(400, '"filter" must be a JSON object, e.g. {"doc_id": "..."}')
+        if not 0.0 <= diversity <= 1.0:
+            raise HTTPError(400, '"diversity" must be between 0 and 1')
+
+        await self._acquire()
+        try:
+            with span("retrieve_batch", queries=len(queries), k=k):
+                if embeddings is None:
+                    embeddings = await asyncio.gather(*(self.embed_query(query) for query in queries))
+                try:
+                    results = await asyncio.to_thread(self.retriever.search_batch_embedded, queries,
+                                                      embeddings, k, request.get("filter"), diversity)
+                except ValueError as e:
+                    raise HTTPError(400, str(e))
+        finally:
+            self._release()
+        await write_json(writer, 200, {"results": [{"chunks": chunks, "distances": distances}
+                                                   for chunks, distances in results]})
+
+    async def respond(self, path: str, request: Dict, query: str, k: int, mode: str,
+                      embedding: Optional[List[float]], writer: asyncio.StreamWriter,
+                      diversity: float = 0.0) -> None:
+        """Retrieve context for a query and write the /retrieve or /answer response"""
+        if embedding is None:
+            embedding = await self.embed_query(query)
+        index_version = ""
+        if path != "/retrieve":
+            # Read once, before searching, so the answer is looked up and cached
+            # under the version of the index the chunks come from
+            index_version = await asyncio.to_thread(self.read_index_version)
+        try:
+            chunks, distances = await self.retrieve(query, k, mode, embedding, request.get("filter"),
+                                                    diversity)
+        except ValueError as e:
+            # Malformed filters, or a filter or mode the index was not built for
+            raise HTTPError(400, str(e))
+        context = format_context(chunks, self.max_context_tokens)
+
+        if path == "/retrieve":
+            await write_json(writer, 200, {"context": context, "distances": distances,
+                                           "chunks": chunks})
+        elif not request.get("stream", True):
+            answer = await self.cached_answer(query, embedding, chunks, index_version)
+            if answer is None:
+                answer = await self.generate_answer(query, context)
+                await self.cache_answer(query, embedding, chunks, answer, index_version)
+            await write_json(writer, 200, {"answer": answer, "context": context,
+                                           "distances": distances})
+        else:
+            tokens = self.answer_tokens(query, embedding, chunks, context, index_version)
+            # Spans cannot cross the generator's yields, so the stream is timed as a whole
+            with span("stream_answer"):
+                await self.write_stream(writer, tokens, distances)
+
+    async def write_stream(self, writer: asyncio.StreamWriter, tokens,
+                           distances: List[float]) -> None:
+        """Stream answer tokens as server-sent events using chunked transfer encoding"""
+        writer.write(b"HTTP/1.1 200 OK\r\n"
+                     b"Content-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\n"
+                     b"Transfer-Encoding: chunked\r\n"
+                     b"Connection: close\r\n\r\n")
+
+        async def send_event(payload: Dict) -> None:
+            data = f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+            writer.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            # drain() applies backpressure from slow readers to the token stream
+            await writer.drain()
+
+        try:
+            async for token in tokens:
+                await send_event({"token": token})
+        except ConnectionError:
+            raise
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            self.stats["errors"] += 1
+            await send_event({"error": str(e)})
+        await send_event({"done": True, "distances": distances})
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8000) -> asyncio.AbstractServer:
+        """Load the index up front and start listening"""
+        await asyncio.to_thread(self.retriever.ensure_fresh)
+        return await asyncio.start_server(self.handle, host, port)
+
+async def read_request(reader: asyncio.StreamReader) -> Tuple[str, str, bytes]:
+    """Parse the request line, headers and Content-Length body of an HTTP/1.1 request"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("client closed the connection")
+    except asyncio.LimitOverrunError:
+        raise HTTPError(400, "Request headers too large")
+
+    lines = head.decode("latin1").split("\r\n")
+    try:
+        method, target, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        length = -1
+    if length < 0:
+        raise HTTPError(400, "Content-Length must be a non-negative integer")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, f"Request body is larger than {MAX_BODY_BYTES} bytes")
+    try:
+        body = await reader.readexactly(length) if length else b""
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("client closed the connection")
+    return method.upper(), target.split("?", 1)[0], body
+
+async def write_text(writer: asyncio.StreamWriter, status: int, text: str,
+                     content_type: str = "text/plain") -> None:
+    body = text.encode("utf-8")
+    head = (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n")
+    writer.write(head.encode("latin1") + body)
+    await writer.drain()
+
+async def write_json(writer: asyncio.StreamWriter, status: int, payload,
+                     extra_headers: Optional[Dict[str, str]] = None) -> None:
+    body = json.dumps(payload).encode("utf-8")
+    headers = {"Content-Type": "application/json", "Content-Length": str(len(body)),
+               "Connection": "close", **(extra_headers or {})}
+    head = f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+    head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    writer.write(head.encode("latin1") + b"\r\n" + body)
+    await writer.drain()
+
+def make_async_client(base_url: Optional[str] = None, timeout: float = 30.0,
+                      api_key: Optional[str] = None) -> "openai.AsyncOpenAI":
+    """Shared async OpenAI client; its HTTP connection pool is reused by every request"""
+    return openai.AsyncOpenAI(
+        api_key=api_key or os.getenv('OPENAI_API_KEY'),
+        base_url=base_url or os.getenv('OPENAI_BASE_URL'),
+        timeout=timeout,
+        max_retries=2,
+    )
+
+async def main(args) -> None:
+    if args.trace or args.trace_file:
+        enable(args.trace_file)
+    rerank_options = {}
+    if args.reranker:
+        rerank_options = {"reranker": get_reranker(args.reranker),
+                          "rerank_candidates": args.rerank_candidates,
+                          "rerank_budget_ms": args.rerank_budget_ms}
+    if args.shards:
+        from sharded_index import ShardedRetriever
+        retriever = ShardedRetriever.from_manifest(args.shards, args.shard_urls, **rerank_options)
+    else:
+        retriever = Retriever(args.index, args.metadata, **rerank_options)
+    server = RAGServer(
+        retriever,
+        make_async_client(args.openai_base_url),
+        max_concurrency=args.max_concurrency,
+        max_queue=args.max_queue,
+        max_k=args.max_k,
+    )
+    listener = await server.serve(args.host, args.port)
+    print(f"Serving on http://{args.host}:{args.port} "
+          f"(max {args.max_concurrency} concurrent, {args.max_queue} queued)")
+    async with listener:
+        await listener.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Async HTTP service for RAG retrieval and answers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--index", default="faiss_index.bin",
+                        help="FAISS index, index bundle (bundle.py) or incremental_index.bin")
+    parser.add_argument("--metadata", default="chunk_metadata.json")
+    parser.add_argument("--shards", default=None,
+                        help="Shard manifest (see sharded_index.py) to fan queries out over instead")
+    parser.add_argument("--shard-urls", nargs="+", default=None,
+                        help="With --shards, query these shard worker servers instead of local shards")
+    parser.add_argument("--openai-base-url", default=None,
+                        help="e.g. http://127.0.0.1:8001/v1 for mock_openai_server.py")
+    parser.add_argument("--reranker", default=None,
+                        help=f"Re-rank candidates with this cross-encoder (e.g. {DEFAULT_MODEL}) or 'lexical'")
+    parser.add_argument("--rerank-candidates", type=int, default=DEFAULT_CANDIDATES,
+                        help="First-stage candidates fetched per query for the re-ranker")
+    parser.add_argument("--rerank-budget-ms", type=float, default=None,
+                        help="Stop re-scoring candidates beyond the top k after about this long")
+    parser.add_argument("--max-concurrency", type=int, default=32)
+    parser.add_argument("--max-queue", type=int, default=256)
+    parser.add_argument("--max-k", type=int, default=MAX_K, help="Largest k a request is served")
+    parser.add_argument("--trace", action="store_true", help="Record per-stage spans (/metrics, /stats)")
+    parser.add_argument("--trace-file", default=None, help="Also append spans to this JSONL file")
+    parser.add_argument("--profile", default=None,
+                        help="Sample stacks while serving and write collapsed stacks here on exit")
+    args = parser.parse_args()
+    profiler = SamplingProfiler().start() if args.profile else None
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.write_collapsed(args.profile)
+            print(f"Wrote {profiler.num_samples} stack samples to {args.profile}")
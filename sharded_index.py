@@ -0,0 +1,539 @@
+"""
+Sharded FAISS index with parallel fan-out search
+
+The corpus is partitioned into shards, by hashing each chunk's doc_id (a
+document's chunks stay together, so it can be re-indexed by rebuilding one
+shard) or by hashing the chunk ID (most even sizes). Each shard is an
+ordinary index built by store_in_faiss, so any index type or compression
+works per shard:
+
+    <root>/shards.json                          partitioning and shard names
+    <root>/shard-000/embeddings.npy / .jsonl    the shard's vectors and records
+    <root>/shard-000/gen-1/                     one build: faiss_index.bin, chunk_metadata.*, BM25
+    <root>/shard-000/current -> gen-1           switched atomically when a build finishes
+
+Shards are built in a process pool. A rebuild writes a new generation next
+to the live one and only then flips the `current` symlink, so queries keep
+hitting the old generation until the new one is complete. Each shard's
+Retriever notices the flip on its next query and reloads that shard alone;
+queries to the other shards are not held up.
+
+ShardedRetriever sends a query to every shard concurrently on a thread pool
+(FAISS and file reads release the GIL) and merges the per-shard top-k lists
+with a heap. A shard can also be a server.py worker process on another port,
+queried over HTTP with the already-computed query embedding.
+
+    python sharded_index.py build --shards 4 --partition doc
+    python sharded_index.py rebuild 2
+    python sharded_index.py serve-workers --base-port 8101
+    python server.py --shards shards/shards.json --shard-urls http://127.0.0.1:8101 ...
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Dict, List, Optional, Set, Tuple
+
+import requests
+
+from bm25_index import reciprocal_rank_fusion
+from dedup import DIVERSITY_FETCH_FACTOR, collapse_overlaps
+from embedding_cache import EmbeddingCache
+from incremental_index import chunk_id
+from query_retrieve import EMBEDDING_MODEL, SEARCH_MODES, Retriever, get_embedding, get_embeddings
+from reranker import DEFAULT_CANDIDATES, rerank_texts
+from store_faiss import INDEX_TYPES, store_in_faiss
+from tracing import span
+from vector_store import VectorStoreWriter, iter_records, load_vectors
+
+# What the shard of a chunk is derived from
+PARTITIONS = ("doc", "chunk")
+
+MANIFEST_NAME = "shards.json"
+
+def shard_name(shard: int) -> str:
+    return f"shard-{shard:03d}"
+
+def shard_of(record: Dict, num_shards: int, partition: str = "doc") -> int:
+    """Shard a chunk record belongs to; stable across runs and processes"""
+    doc_id = record["metadata"].get("doc_id", "")
+    if partition == "chunk":
+        return chunk_id(doc_id, record["start_char"]) % num_shards
+    digest = hashlib.blake2b(doc_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % num_shards
+
+def shard_paths(root: str, name: str) -> Tuple[str, str]:
+    """Index and metadata paths of a shard's live generation"""
+    current = os.path.join(root, name, "current")
+    return os.path.join(current, "faiss_index.bin"), os.path.join(current, "chunk_metadata.json")
+
+def load_manifest(root: str) -> Dict:
+    with open(os.path.join(root, MANIFEST_NAME), 'r') as f:
+        return json.load(f)
+
+def partition_vectors(embeddings_prefix: str, root: str, num_shards: int,
+                      partition: str = "doc", batch_size: int = 4096) -> List[int]:
+    """
+    Split a vector store into one vector store per shard
+
+    Records are streamed and the vectors memory-mapped, so only one batch per
+    shard is held in memory. Returns the number of chunks in each shard.
+    """
+    if partition not in PARTITIONS:
+        raise ValueError(f"Unknown partition {partition!r}; expected one of {PARTITIONS}")
+    vectors = load_vectors(embeddings_prefix)
+    writers = []
+    for shard in range(num_shards):
+        os.makedirs(os.path.join(root, shard_name(shard)), exist_ok=True)
+        writers.append(VectorStoreWriter(os.path.join(root, shard_name(shard), "embeddings")))
+    pending = [([], []) for _ in range(num_shards)]
+
+    def flush(shard: int) -> None:
+        rows, records = pending[shard]
+        if rows:
+            writers[shard].append(vectors[rows], records)
+            pending[shard] = ([], [])
+
+    for position, record in enumerate(iter_records(embeddings_prefix)):
+        shard = shard_of(record, num_shards, partition)
+        pending[shard][0].append(position)
+        pending[shard][1].append(record)
+        if len(pending[shard][0]) >= batch_size:
+            flush(shard)
+    for shard in range(num_shards):
+        flush(shard)
+        writers[shard].close()
+    return [writer.rows for writer in writers]
+
+def build_shard(root: str, name: str, index_type: str = "flat",
+                index_params: Optional[Dict] = None, compression: str = "none",
+                keep_generations: int = 2) -> Dict:
+    """
+    Build a new generation of one shard's index and make it live
+
+    The build goes into a fresh gen-<n> directory; `current` is then swapped
+    to it with an atomic rename, and generations beyond the newest
+    `keep_generations` are deleted (the previous one is kept so queries that
+    started on it can finish).
+    """
+    shard_dir = os.path.join(root, name)
+    generations = sorted(int(entry[4:]) for entry in os.listdir(shard_dir)
+                         if entry.startswith("gen-") and entry[4:].isdigit())
+    generation = f"gen-{generations[-1] + 1 if generations else 1}"
+    generation_dir = os.path.join(shard_dir, generation)
+    os.makedirs(generation_dir)
+
+    summary = store_in_faiss(os.path.join(shard_dir, "embeddings"),
+                             os.path.join(generation_dir, "faiss_index.bin"),
+                             os.path.join(generation_dir, "chunk_metadata.json"),
+                             index_type, index_params, report_recall=False,
+                             compression=compression)
+
+    link = os.path.join(shard_dir, "current")
+    os.symlink(generation, link + ".tmp")
+    os.replace(link + ".tmp", link)
+
+    live = [f"gen-{g}" for g in generations] + [generation]
+    for old in live[:-keep_generations]:
+        shutil.rmtree(os.path.join(shard_dir, old), ignore_errors=True)
+    summary.update(shard=name, generation=generation)
+    return summary
+
+def build_shards(embeddings_prefix: str = "embeddings", root: str = "shards",
+                 num_shards: int = 4, partition: str = "doc", index_type: str = "flat",
+                 index_params: Optional[Dict] = None, compression: str = "none",
+                 workers: Optional[int] = None) -> Dict:
+    """Partition a vector store into shards, build every shard in a process pool and write the manifest"""
+    os.makedirs(root, exist_ok=True)
+    start = time.perf_counter()
+    sizes = partition_vectors(embeddings_prefix, root, num_shards, partition)
+    print(f"Partitioned {sum(sizes)} chunks into {num_shards} shards by {partition}: {sizes}")
+
+    # A shard can be empty when there are fewer documents than shards; it is listed but not built
+    names = [shard_name(shard) for shard in range(num_shards)]
+    built = [name for name, size in zip(names, sizes) if size]
+    with ProcessPoolExecutor(max_workers=workers or min(len(built), os.cpu_count() or 1)) as pool:
+        summaries = list(pool.map(build_shard, [root] * len(built), built,
+                                  [index_type] * len(built), [index_params] * len(built),
+                                  [compression] * len(built)))
+
+    manifest = {"num_shards": num_shards, "partition": partition, "index_type": index_type,
+                "shards": [{"name": name, "chunks": size} for name, size in zip(names, sizes)]}
+    tmp_path = os.path.join(root, MANIFEST_NAME + ".tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(root, MANIFEST_NAME))
+    print(f"Built {num_shards} shards in {time.perf_counter() - start:.2f}s")
+    return {"manifest": manifest, "shards": summaries}
+
+class LocalShard:
+    """A shard searched in this process through its own Retriever"""
+
+    def __init__(self, name: str, index_path: str, metadata_path: str, api_client=None,
+                 cache: Optional[EmbeddingCache] = None):
+        self.name = name
+        self.retriever = Retriever(index_path, metadata_path, api_client=api_client, cache=cache)
+
+    def search(self, query: str, embedding: List[float], k: int, mode: str,
+               filters: Optional[Dict] = None) -> Tuple[List[Dict], List[float]]:
+        return self.retriever.search_embedded(query, embedding, k, mode, filters)
+
+    def search_batch(self, queries: List[str], embeddings: List[List[float]], k: int,
+                     filters: Optional[Dict] = None) -> List[Tuple[List[Dict], List[float]]]:
+        return self.retriever.search_batch_embedded(queries, embeddings, k, filters)
+
+    @property
+    def version(self) -> str:
+        return self.retriever.index_version
+
+    def get_stats(self) -> Dict:
+        return self.retriever.get_stats()
+
+class RemoteShard:
+    """
+    A shard served by a server.py worker process, queried over HTTP
+
+    The worker's index version is fetched from /stats and reused for
+    `version_ttl` seconds, so reading it per query is not a round trip per
+    query; a rebuilt shard is noticed within that time.
+    """
+
+    def __init__(self, name: str, url: str, timeout: float = 10.0, version_ttl: float = 1.0):
+        self.name = name
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.version_ttl = version_ttl
+        self._session = requests.Session()
+        self._version: Optional[str] = None
+        self._version_time = 0.0
+        self._version_lock = threading.Lock()
+
+    def search(self, query: str, embedding: List[float], k: int, mode: str,
+               filters: Optional[Dict] = None) -> Tuple[List[Dict], List[float]]:
+        response = self._session.post(f"{self.url}/retrieve", timeout=self.timeout,
+                                      json={"query": query, "k": k, "mode": mode,
+                                            "embedding": list(embedding), "filter": filters})
+        response.raise_for_status()
+        result = response.json()
+        return result["chunks"], result["distances"]
+
+    def search_batch(self, queries: List[str], embeddings: List[List[float]], k: int,
+                     filters: Optional[Dict] = None) -> List[Tuple[List[Dict], List[float]]]:
+        response = self._session.post(f"{self.url}/retrieve_batch", timeout=self.timeout,
+                                      json={"queries": queries, "k": k, "filter": filters,
+                                            "embeddings": [list(e) for e in embeddings]})
+        response.raise_for_status()
+        return [(result["chunks"], result["distances"]) for result in response.json()["results"]]
+
+    def get_stats(self) -> Dict:
+        response = self._session.get(f"{self.url}/stats", timeout=self.timeout)
+        response.raise_for_status()
+        stats = response.json()
+        with self._version_lock:
+            self._version, self._version_time = stats["index_version"], time.monotonic()
+        return stats
+
+    @property
+    def version(self) -> str:
+        with self._version_lock:
+            if self._version is not None and time.monotonic() - self._version_time < self.version_ttl:
+                return self._version
+        return self.get_stats()["index_version"]
+
+def filter_doc_ids(filters: Optional[Dict]) -> Optional[Set[str]]:
+    """The doc_ids a metadata filter pins at its top level (equality or $in), if any"""
+    condition = (filters or {}).get("doc_id")
+    if isinstance(condition, dict):
+        condition = condition.get("$in", condition.get("$eq"))
+    if isinstance(condition, str):
+        return {condition}
+    if isinstance(condition, list) and all(isinstance(doc_id, str) for doc_id in condition):
+        return set(condition)
+    return None
+
+def chunk_key(chunk: Dict) -> int:
+    """Identity of a chunk across shards"""
+    return chunk_id(chunk["metadata"].get("doc_id", ""), chunk["start_char"])
+
+def merge_top_k(results: List[Tuple[List[Dict], List[float]]], k: int,
+                higher_is_better: bool) -> Tuple[List[Dict], List[float]]:
+    """Merge per-shard result lists, each already sorted best first, into the global top k"""
+    streams = [zip(scores, range(len(scores)), [shard] * len(scores))
+               for shard, (_, scores) in enumerate(results)]
+    merged = heapq.merge(*streams, key=lambda item: item[0], reverse=higher_is_better)
+    chunks, scores = [], []
+    for score, position, shard in merged:
+        if len(chunks) == k:
+            break
+        chunks.append(results[shard][0][position])
+        scores.append(score)
+    return chunks, scores
+
+class ShardedRetriever:
+    """
+    Fans each query out to every shard and merges the results.
+
+    Offers the Retriever interface used by query_retrieve and server.py
+    (search, search_embedded, search_batch, search_batch_embedded,
+    index_version, get_stats), so it can stand in for a single-index
+    Retriever. Vector results are merged by L2 distance and lexical results
+    by BM25 score; hybrid search merges each ranking globally first and then
+    fuses them, as a single index would.
+    Vector results are identical to a single index. BM25 document frequencies
+    are per shard, so lexical scores are approximate when a document's chunks
+    are spread over shards; they are exact with doc partitioning of a
+    one-document-per-shard corpus and converge as shards grow.
+
+    Metadata filters are applied inside each shard's search. With doc
+    partitioning, a filter pinning doc_id is only sent to the shards holding
+    those documents.
+
+    Diversification needs the candidates' vectors, which stay in the shards,
+    so across shards `diversity` only collapses chunks whose spans mostly
+    overlap a better-ranked chunk (dedup.collapse_overlaps).
+
+    A `reranker` runs once here, over the merged candidates, rather than in
+    every shard.
+    """
+
+    def __init__(self, shards: List, api_client=None, cache: Optional[EmbeddingCache] = None,
+                 max_workers: Optional[int] = None, num_shards: Optional[int] = None,
+                 partition: Optional[str] = None, reranker=None,
+                 rerank_candidates: int = DEFAULT_CANDIDATES, rerank_budget_ms: Optional[float] = None):
+        self.shards = shards
+        self.api_client = api_client
+        self.cache = cache
+        self.num_shards = num_shards
+        self.partition = partition
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        self.rerank_budget_ms = rerank_budget_ms
+        self.embedding_model = EMBEDDING_MODEL
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or len(shards),
+                                        thread_name_prefix="shard")
+        self.stats = {"queries": 0, "embed_time": 0.0, "search_time": 0.0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key: str, amount: float = 1) -> None:
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    @classmethod
+    def from_manifest(cls, root: str, shard_urls: Optional[List[str]] = None,
+                      api_client=None, cache: Optional[EmbeddingCache] = None,
+                      **kwargs) -> "ShardedRetriever":
+        """Open the non-empty shards in a manifest, locally or through worker URLs given in shard order"""
+        if os.path.basename(root) == MANIFEST_NAME:
+            root = os.path.dirname(root)
+        manifest = load_manifest(root)
+        names = [shard["name"] for shard in manifest["shards"] if shard["chunks"]]
+        if shard_urls:
+            if len(shard_urls) != len(names):
+                raise ValueError(f"Expected {len(names)} shard URLs, got {len(shard_urls)}")
+            shards = [RemoteShard(name, url) for name, url in zip(names, shard_urls)]
+        else:
+            shards = [LocalShard(name, *shard_paths(root, name), api_client=api_client, cache=cache)
+                      for name in names]
+        return cls(shards, api_client=api_client, cache=cache, num_shards=manifest["num_shards"],
+                   partition=manifest["partition"], **kwargs)
+
+    def _targets(self, filters: Optional[Dict]) -> List:
+        """Shards that can hold chunks matching the filter"""
+        doc_ids = filter_doc_ids(filters)
+        if doc_ids is None or self.partition != "doc" or not self.num_shards:
+            return self.shards
+        names = {shard_name(shard_of({"metadata": {"doc_id": doc_id}}, self.num_shards))
+                 for doc_id in doc_ids}
+        return [shard for shard in self.shards if shard.name in names]
+
+    def _submit(self, query: str, embedding: List[float], k: int, mode: str,
+                filters: Optional[Dict] = None) -> List:
+        # Each shard search runs in a copy of the caller's context so its spans nest under the query
+        return [self._pool.submit(copy_context().run, shard.search, query, embedding, k, mode, filters)
+                for shard in self._targets(filters)]
+
+    def _fan_out(self, query: str, embedding: List[float], k: int, mode: str,
+                 filters: Optional[Dict] = None) -> List[Tuple[List[Dict], List[float]]]:
+        return [future.result() for future in self._submit(query, embedding, k, mode, filters)]
+
+    def search(self, query: str, k: int = 5, mode: str = "vector", filters: Optional[Dict] = None,
+               diversity: float = 0.0) -> Tuple[List[Dict], List[float]]:
+        """Embed the query once and search every shard"""
+        start = time.perf_counter()
+        embedding = get_embedding(query, self.embedding_model, self.api_client, self.cache)
+        self._count("embed_time", time.perf_counter() - start)
+        return self.search_embedded(query, embedding, k, mode, filters, diversity)
+
+    def search_embedded(self, query: str, query_embedding: List[float], k: int = 5,
+                        mode: str = "vector", filters: Optional[Dict] = None,
+                        diversity: float = 0.0) -> Tuple[List[Dict], List[float]]:
+        """Like search, for a query whose embedding is already known"""
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {mode!r}, expected one of {SEARCH_MODES}")
+        start = time.perf_counter()
+        top_k = self._merge_depth(k, diversity)
+        if mode == "hybrid":
+            # Global vector and lexical rankings over a deeper candidate list, then fusion
+            fetch_k = max(4 * top_k, 20)
+            vector_futures = self._submit(query, query_embedding, fetch_k, "vector", filters)
+            lexical = merge_top_k(self._fan_out(query, query_embedding, fetch_k, "lexical", filters),
+                                  fetch_k, higher_is_better=True)
+            vector = merge_top_k([future.result() for future in vector_futures], fetch_k,
+                                 higher_is_better=False)
+            by_key = {chunk_key(chunk): chunk for chunk in vector[0] + lexical[0]}
+            keys, scores = reciprocal_rank_fusion([[chunk_key(chunk) for chunk in vector[0]],
+                                                   [chunk_key(chunk) for chunk in lexical[0]]], top_k)
+            chunks = [by_key[key] for key in keys]
+        else:
+            chunks, scores = merge_top_k(self._fan_out(query, query_embedding, top_k, mode, filters),
+                                         top_k, higher_is_better=mode == "lexical")
+        chunks, scores = self._refine(query, chunks, scores, k, diversity)
+        self._count("queries")
+        self._count("search_time", time.perf_counter() - start)
+        return chunks, scores
+
+    def _merge_depth(self, k: int, diversity: float) -> int:
+        """Re-ranking and overlap collapsing pick k out of a deeper merged list"""
+        top_k = k
+        if self.reranker is not None:
+            top_k = max(top_k, self.rerank_candidates)
+        if diversity:
+            top_k = max(top_k, DIVERSITY_FETCH_FACTOR * k, 20)
+        return top_k
+
+    def _refine(self, query: str, chunks: List[Dict], scores: List[float], k: int,
+                diversity: float) -> Tuple[List[Dict], List[float]]:
+        """Re-rank and collapse merged candidates, then cut them to k"""
+        if self.reranker is not None and chunks:
+            with span("rerank_candidates", rows=len(chunks)) as rerank_span:
+                order, scores = rerank_texts(self.reranker, query, [chunk["text"] for chunk in chunks],
+                                             k, self.rerank_budget_ms)
+                rerank_span.set(scored=len(order))
+            chunks = [chunks[i] for i in order]
+        if diversity:
+            return collapse_overlaps(chunks, scores, k)
+        return chunks[:k], scores[:k]
+
+    def search_batch(self, queries: List[str], k: int = 5, filters: Optional[Dict] = None,
+                     diversity: float = 0.0) -> List[Tuple[List[Dict], List[float]]]:
+        """Embed queries in bulk, then search every shard with the whole batch"""
+        if not queries:
+            return []
+        start = time.perf_counter()
+        embeddings = get_embeddings(queries, self.embedding_model, self.api_client, self.cache)
+        self._count("embed_time", time.perf_counter() - start)
+        return self.search_batch_embedded(queries, embeddings, k, filters, diversity)
+
+    def search_batch_embedded(self, queries: List[str], query_embeddings: List[List[float]],
+                              k: int = 5, filters: Optional[Dict] = None,
+                              diversity: float = 0.0) -> List[Tuple[List[Dict], List[float]]]:
+        """
+        Like search_batch, for queries whose embeddings are already known
+
+        Each shard gets the whole batch in one call (one FAISS search, or one
+        HTTP request to a worker), and the per-shard lists are then merged
+        query by query.
+        """
+        if not queries:
+            return []
+        start = time.perf_counter()
+        top_k = self._merge_depth(k, diversity)
+        futures = [self._pool.submit(copy_context().run, shard.search_batch, queries,
+                                     query_embeddings, top_k, filters)
+                   for shard in self._targets(filters)]
+        per_shard = [future.result() for future in futures]
+        results = []
+        for i, query in enumerate(queries):
+            chunks, scores = merge_top_k([shard_results[i] for shard_results in per_shard], top_k,
+                                         higher_is_better=False)
+            results.append(self._refine(query, chunks, scores, k, diversity))
+        self._count("queries", len(queries))
+        self._count("search_time", time.perf_counter() - start)
+        return results
+
+    def ensure_fresh(self) -> None:
+        """Load every local shard that is not loaded yet or has been rebuilt"""
+        for shard in self.shards:
+            if isinstance(shard, LocalShard):
+                shard.retriever.ensure_fresh()
+
+    @property
+    def index_version(self) -> str:
+        """Combined version of all shards; changes when any shard is rebuilt"""
+        versions = ",".join(shard.version for shard in self.shards)
+        return hashlib.sha256(versions.encode("utf-8")).hexdigest()[:16]
+
+    def get_stats(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        queries = max(stats["queries"], 1)
+        stats["avg_embed_time"] = stats["embed_time"] / queries
+        stats["avg_search_time"] = stats["search_time"] / queries
+        stats["shards"] = {shard.name: shard.get_stats() for shard in self.shards}
+        return stats
+
+def serve_workers(root: str, base_port: int = 8101, host: str = "127.0.0.1") -> List[subprocess.Popen]:
+    """Start one server.py worker process per non-empty shard, on consecutive ports"""
+    from server import MAX_K
+    processes = []
+    shards = [shard for shard in load_manifest(root)["shards"] if shard["chunks"]]
+    for i, shard in enumerate(shards):
+        index_path, metadata_path = shard_paths(root, shard["name"])
+        processes.append(subprocess.Popen([
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"),
+            "--host", host, "--port", str(base_port + i),
+            "--index", index_path, "--metadata", metadata_path,
+            # The coordinator asks shards for deeper lists than k when fusing, re-ranking or diversifying
+            "--max-k", str(100 * MAX_K),
+        ]))
+    return processes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build, rebuild and serve a sharded FAISS index")
+    parser.add_argument("--root", default="shards", help="Directory holding the shards and manifest")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Partition embeddings and build every shard")
+    build.add_argument("--embeddings", default="embeddings", help="Vector store prefix")
+    build.add_argument("--shards", type=int, default=4)
+    build.add_argument("--partition", choices=PARTITIONS, default="doc")
+    build.add_argument("--workers", type=int, default=None)
+
+    rebuild = commands.add_parser("rebuild", help="Rebuild one shard from its vector store")
+    rebuild.add_argument("shard", type=int)
+
+    for command in (build, rebuild):
+        command.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+        command.add_argument("--params", type=json.loads, default=None)
+        command.add_argument("--compression", default="none")
+
+    workers = commands.add_parser("serve-workers", help="Serve each shard from its own process")
+    workers.add_argument("--base-port", type=int, default=8101)
+    workers.add_argument("--host", default="127.0.0.1")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_shards(args.embeddings, args.root, args.shards, args.partition, args.index_type,
+                     args.params, args.compression, args.workers)
+    elif args.command == "rebuild":
+        summary = build_shard(args.root, shard_name(args.shard), args.index_type, args.params,
+                              args.compression)
+        print(f"{summary['shard']} now serving {summary['generation']}")
+    else:
+        processes = serve_workers(args.root, args.base_port, args.host)
+        urls = [f"http://{args.host}:{args.base_port + i}" for i in range(len(processes))]
+        print(f"Shard workers: {' '.join(urls)}")
+        try:
+            for process in processes:
+                process.wait()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
@@ -1,54 +1,379 @@
-import faiss
-import numpy as np
 import json
-from typing import List, Dict
+import math
+import os
+import shutil
+import time
+import numpy as np
+from typing import Dict, Optional, Tuple
+from vector_store import load_vectors, iter_records, convert_json_embeddings
+from metadata_store import MetadataStoreWriter
+from bm25_index import BM25Builder, bm25_prefix
+from metadata_filter import FilterIndexBuilder, filter_prefix
+from tracing import span, traced
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# How vectors are encoded inside the index: float32, float16, 8-bit scalar
+# quantisation or product quantisation
+COMPRESSIONS = ("none", "fp16", "int8", "pq")
+
+# How `dimensions` is reached: a PCA projection learned from the corpus, or
+# keeping the leading components and renormalising (Matryoshka-style models)
+REDUCTIONS = ("pca", "truncate")
+
+# Candidates fetched per result when re-ranking a lossy index against the
+# full-precision vectors
+DEFAULT_RERANK_FACTOR = 4
+
+# Parameters that only affect search, re-applied every time the index is loaded
+SEARCH_PARAMS = ("nprobe", "efSearch")
+
+def index_config_path(index_file: str) -> str:
+    """Path of the JSON file recording how an index was built and should be searched"""
+    return os.path.splitext(index_file)[0] + "_config.json"
+
+def rerank_vectors_path(index_file: str) -> str:
+    """Path of the full-precision vectors kept next to a lossy index for re-ranking"""
+    return os.path.splitext(index_file)[0] + "_vectors.npy"
+
+def default_index_params(index_type: str, num_vectors: int, dimension: int,
+                         compression: str = "none") -> Dict:
+    """Reasonable build/search parameters for an index type, compression and corpus size"""
+    if index_type == "flat":
+        params = {}
+    elif index_type == "hnsw":
+        params = {"M": 32, "efConstruction": 200, "efSearch": 64}
+    else:
+        # IVF: ~4*sqrt(n) lists, but keep at least 39 training points per list
+        nlist = max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+        params = {"nlist": nlist, "nprobe": min(nlist, 8)}
+    if index_type == "ivf_pq" or compression == "pq":
+        # Largest sub-quantizer count that divides the dimension, with >= 4 dims per sub-vector
+        params["m"] = max(m for m in range(1, max(1, min(64, dimension // 4)) + 1)
+                          if dimension % m == 0)
+        # Each sub-quantizer codebook needs at least 2**nbits training points
+        params["nbits"] = max(1, min(8, int(math.log2(max(num_vectors, 2)))))
+    return params
+
+def is_lossy(index_type: str, params: Dict) -> bool:
+    """Whether an index stores less than the full float32 vectors"""
+    return (index_type == "ivf_pq" or params.get("compression", "none") != "none"
+            or bool(params.get("dimensions")))
+
+def encoding_string(params: Dict) -> str:
+    """index_factory description of how vectors are stored"""
+    compression = params.get("compression", "none")
+    if compression == "none":
+        return "Flat"
+    if compression == "fp16":
+        return "SQfp16"
+    if compression == "int8":
+        return "SQ8"
+    if compression == "pq":
+        # "np" skips polysemous training, which search never uses and which
+        # dominates build time on small corpora
+        return f"PQ{params['m']}x{params['nbits']}np"
+    raise ValueError(f"Unknown compression {compression!r}; expected one of {COMPRESSIONS}")
+
+def factory_string(index_type: str, params: Dict) -> str:
+    """faiss.index_factory description for an index type"""
+    if index_type == "ivf_pq":
+        if params.get("compression", "none") != "none":
+            raise ValueError("ivf_pq already uses product quantisation; leave compression as 'none'")
+        description = f"IVF{params['nlist']},PQ{params['m']}x{params['nbits']}np"
+    elif index_type == "flat":
+        description = encoding_string(params)
+    elif index_type == "ivf_flat":
+        description = f"IVF{params['nlist']},{encoding_string(params)}"
+    elif index_type == "hnsw":
+        description = f"HNSW{params['M']},{encoding_string(params)}"
+    else:
+        raise ValueError(f"Unknown index type {index_type!r}; expected one of {INDEX_TYPES}")
+    if params.get("dimensions") and params.get("reduction", "pca") == "pca":
+        description = f"PCA{params['dimensions']},{description}"
+    return description
+
+def apply_search_params(index: "faiss.Index", params: Dict) -> None:
+    """Set query-time knobs (nprobe / efSearch) on an index, including wrapped indexes"""
+    import faiss
+    space = faiss.ParameterSpace()
+    for name in SEARCH_PARAMS:
+        if name in params:
+            space.set_index_parameter(index, name, params[name])
+
+def build_index(embedding_matrix: np.ndarray, index_type: str = "flat",
+                params: Optional[Dict] = None, train_size: int = 100000,
+                add_batch_size: int = 65536, seed: int = 1234) -> Tuple["faiss.Index", Dict]:
+    """
+    Build a FAISS index of the given type over the embedding matrix
+
+    Args:
+        embedding_matrix: (n, d) float32 vectors, possibly memory-mapped
+        index_type: One of INDEX_TYPES
+        params: Overrides for default_index_params (nlist, nprobe, m, nbits, M, efConstruction,
+            efSearch), plus compression (one of COMPRESSIONS), dimensions, reduction (one of
+            REDUCTIONS) and rerank_factor
+        train_size: Maximum number of vectors sampled to train IVF/PQ quantizers
+        add_batch_size: Number of vectors copied into the index at a time
+        seed: Seed for the training sample
+
+    Returns:
+        The populated index and the full parameter set used to build it
+    """
+    import faiss
+    num_vectors, dimension = embedding_matrix.shape
+    params = params or {}
+    compression = params.get("compression", "none")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression!r}; expected one of {COMPRESSIONS}")
+    reduced = params.get("dimensions")
+    if reduced:
+        if params.get("reduction", "pca") not in REDUCTIONS:
+            raise ValueError(f"Unknown reduction {params['reduction']!r}; expected one of {REDUCTIONS}")
+        if not 0 < reduced < dimension:
+            raise ValueError(f"dimensions must be between 1 and {dimension - 1}, got {reduced}")
+
+    full_params = default_index_params(index_type, num_vectors, reduced or dimension, compression)
+    full_params.update(params)
+    if "rerank_factor" not in full_params and is_lossy(index_type, full_params):
+        full_params["rerank_factor"] = DEFAULT_RERANK_FACTOR
+
+    if reduced and full_params.get("reduction", "pca") == "truncate":
+        # Keep the leading components and renormalise before the index sees them
+        index = faiss.IndexPreTransform(faiss.NormalizationTransform(reduced, 2.0),
+                                        faiss.index_factory(reduced, factory_string(index_type, full_params)))
+        index.prepend_transform(faiss.RemapDimensionsTransform(dimension, reduced, False))
+    else:
+        index = faiss.index_factory(dimension, factory_string(index_type, full_params))
+    if index_type == "hnsw":
+        hnsw = faiss.downcast_index(index)
+        if isinstance(hnsw, faiss.IndexPreTransform):
+            hnsw = faiss.downcast_index(hnsw.index)
+        hnsw.hnsw.efConstruction = full_params["efConstruction"]
+
+    # Train quantizers on a random sample rather than the whole corpus
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        sample_size = min(num_vectors, train_size)
+        sample = np.sort(rng.choice(num_vectors, size=sample_size, replace=False))
+        index.train(np.ascontiguousarray(embedding_matrix[sample]))
+
+    # A trained PCA keeps the full d x d eigenvector matrix, but applying it
+    # only needs the projection, so drop the rest before the index is saved
+    if isinstance(index, faiss.IndexPreTransform):
+        for i in range(index.chain.size()):
+            transform = faiss.downcast_VectorTransform(index.chain.at(i))
+            if isinstance(transform, faiss.PCAMatrix):
+                transform.PCAMat.clear()
+
+    # Add vectors to index in slices so only one slice is copied at a time
+    for start in range(0, num_vectors, add_batch_size):
+        index.add(np.ascontiguousarray(embedding_matrix[start:start + add_batch_size]))
+
+    apply_search_params(index, full_params)
+    return index, full_params
+
+def rerank(vectors: np.ndarray, query_vectors: np.ndarray, candidates: np.ndarray,
+           k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Re-score candidate positions by exact squared L2 distance and keep the best k
+
+    `vectors` is the full-precision (n, d) matrix, usually memory-mapped, so only
+    the candidate rows are read. Returns (distances, indices) shaped like
+    faiss search results, padded with -1 where there are fewer than k candidates.
+    """
+    distances = np.full((len(candidates), k), np.inf, dtype=np.float32)
+    indices = np.full((len(candidates), k), -1, dtype=np.int64)
+    for row, (query, ids) in enumerate(zip(query_vectors, candidates)):
+        # Sorted positions read the memory-mapped rows in file order
+        ids = np.unique(ids[ids != -1])
+        if not len(ids):
+            continue
+        exact = ((np.asarray(vectors[ids], dtype=np.float32) - query) ** 2).sum(axis=1)
+        best = np.argsort(exact, kind="stable")[:k]
+        distances[row, :len(best)] = exact[best]
+        indices[row, :len(best)] = ids[best]
+    return distances, indices
+
+def recall_at_k(index: "faiss.Index", embedding_matrix: np.ndarray, k: int = 10,
+                num_queries: int = 200, seed: int = 1234,
+                rerank_factor: int = 0) -> Dict[str, float]:
+    """
+    Measure recall@k of an index against exact (flat L2) search
+
+    Queries are vectors sampled from the corpus itself, so no labelled
+    query set is needed. With `rerank_factor`, recall is also measured after
+    re-ranking k * rerank_factor candidates against the full vectors.
+    """
+    import faiss
+    num_vectors, dimension = embedding_matrix.shape
+    rng = np.random.default_rng(seed)
+    query_ids = np.sort(rng.choice(num_vectors, size=min(num_queries, num_vectors), replace=False))
+    queries = np.ascontiguousarray(embedding_matrix[query_ids])
+    k = min(k, num_vectors)
+
+    exact = faiss.IndexFlatL2(dimension)
+    exact.add(np.ascontiguousarray(embedding_matrix))
+    start = time.perf_counter()
+    _, truth = exact.search(queries, k)
+    exact_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, found = index.search(queries, k)
+    approx_time = time.perf_counter() - start
+
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth.tolist(), found.tolist()))
+    result = {
+        "k": k,
+        "recall": hits / (len(queries) * k),
+        "exact_ms_per_query": 1000 * exact_time / len(queries),
+        "index_ms_per_query": 1000 * approx_time / len(queries),
+    }
 
-def store_in_faiss(embeddings_file: str = "embeddings.json", 
+    if rerank_factor:
+        start = time.perf_counter()
+        _, candidates = index.search(queries, min(k * rerank_factor, num_vectors))
+        _, found = rerank(embedding_matrix, queries, candidates, k)
+        reranked_time = time.perf_counter() - start
+        hits = sum(len(set(t) & set(f)) for t, f in zip(truth.tolist(), found.tolist()))
+        result["reranked_recall"] = hits / (len(queries) * k)
+        result["reranked_ms_per_query"] = 1000 * reranked_time / len(queries)
+    return result
+
+def save_index(index: "faiss.Index", index_file: str, index_type: str, params: Dict) -> None:
+    """Write the index and its build/search configuration next to it"""
+    import faiss
+    faiss.write_index(index, index_file)
+    with open(index_config_path(index_file), 'w') as f:
+        json.dump({
+            "index_type": index_type,
+            "params": params,
+            "dimension": index.d,
+            "ntotal": index.ntotal,
+        }, f, indent=2)
+
+@traced()
+def store_in_faiss(embeddings_prefix: str = "embeddings",
                   index_file: str = "faiss_index.bin",
-                  metadata_file: str = "chunk_metadata.json") -> None:
+                  metadata_file: str = "chunk_metadata.json",
+                  index_type: str = "flat",
+                  index_params: Optional[Dict] = None,
+                  report_recall: bool = True,
+                  compression: str = "none",
+                  dimensions: Optional[int] = None,
+                  reduction: str = "pca") -> Dict:
     """
     Store embeddings in FAISS index and save it to disk along with chunk metadata
-    
+
     Args:
-        embeddings_file: Path to the JSON file containing embeddings
+        embeddings_prefix: Prefix of the binary vector store (`.npy` vectors + `.jsonl` metadata),
+            or a legacy embeddings JSON file, which is converted first
         index_file: Path where to save the FAISS index
         metadata_file: Path where to save the chunk metadata mapping
+        index_type: One of INDEX_TYPES ("flat", "ivf_flat", "ivf_pq", "hnsw")
+        index_params: Overrides for the index's build/search parameters
+        report_recall: For approximate indexes, print recall@10 against exact search
+        compression: One of COMPRESSIONS, how vectors are encoded in the index
+        dimensions: Reduce vectors to this many dimensions inside the index
+        reduction: One of REDUCTIONS, how `dimensions` is reached
+
+    For lossy indexes (compressed, reduced or ivf_pq) the float32 vectors are
+    copied next to the index, and the retriever re-ranks rerank_factor * k
+    candidates against them (set "rerank_factor": 0 in index_params to skip).
+
+    Returns:
+        Build summary: index type, parameters, vector count, build seconds,
+        footprint and, if measured, recall against exact search
     """
-    # Load embeddings from file
-    with open(embeddings_file, 'r') as f:
-        embeddings_data = json.load(f)
-    
-    # Extract just the embedding vectors
-    embeddings = [item['embedding'] for item in embeddings_data]
-    
-    # Create chunk metadata mapping
-    chunk_map = {i: {
-        'text': item['text'],
-        'metadata': item['metadata'],
-        'start_char': item['start_char'],
-        'end_char': item['end_char']
-    } for i, item in enumerate(embeddings_data)}
-    
-    # Save chunk metadata mapping
-    with open(metadata_file, 'w') as f:
-        json.dump(chunk_map, f)
-    print(f"Chunk metadata mapping saved to {metadata_file}")
-    
-    # Convert to numpy array
-    embedding_matrix = np.array(embeddings).astype('float32')
-    
-    # Get dimension from first embedding
-    dimension = len(embeddings[0])
+    # Convert legacy embeddings.json once, then use the binary store
+    if embeddings_prefix.endswith(".json"):
+        json_file = embeddings_prefix
+        embeddings_prefix = embeddings_prefix[:-len(".json")]
+        print(f"Converting {json_file} to {embeddings_prefix}.npy/.jsonl")
+        convert_json_embeddings(json_file, embeddings_prefix)
+
+    # Memory-map the vectors instead of parsing them into Python lists
+    embedding_matrix = load_vectors(embeddings_prefix)
+
+    # Stream the chunk metadata mapping to disk, one record at a time, both as
+    # readable JSON and as the positional store the retriever memory-maps,
+    # collecting BM25 postings for hybrid search and metadata postings for
+    # filtered search along the way
+    store_prefix = os.path.splitext(metadata_file)[0]
+    bm25 = BM25Builder()
+    filters = FilterIndexBuilder()
+    with span("write_metadata") as metadata_span, \
+            open(metadata_file, 'w') as f, MetadataStoreWriter(store_prefix) as store:
+        f.write("{")
+        for i, record in enumerate(iter_records(embeddings_prefix)):
+            if i:
+                f.write(", ")
+            f.write(f'"{i}": {json.dumps(record)}')
+            store.append(record)
+            bm25.add(record["text"])
+            filters.add(record.get("metadata", {}))
+        f.write("}")
+        metadata_span.set(rows=store.rows, bytes=f.tell())
+    print(f"Chunk metadata mapping saved to {metadata_file} and {store.blob_path}")
     
+    with span("save_bm25", rows=len(bm25.doc_lengths)):
+        bm25.save(bm25_prefix(index_file))
+    print(f"BM25 index saved to {bm25_prefix(index_file)}.*")
+    with span("save_filters", rows=filters.num_docs):
+        filters.save(filter_prefix(index_file))
+    print(f"Metadata filter index saved to {filter_prefix(index_file)}.*")
+
     # Create FAISS index
-    index = faiss.IndexFlatL2(dimension)
-    
-    # Add vectors to index
-    index.add(embedding_matrix)
-    
-    # Save index to disk
-    faiss.write_index(index, index_file)
+    start = time.perf_counter()
+    build_params = {"compression": compression} if compression != "none" else {}
+    if dimensions:
+        build_params.update(dimensions=dimensions, reduction=reduction)
+    build_params.update(index_params or {})
+    with span("build_index", index_type=index_type, rows=len(embedding_matrix),
+              bytes=embedding_matrix.nbytes):
+        index, params = build_index(embedding_matrix, index_type, build_params)
+    summary = {"index_type": index_type, "params": params, "num_vectors": index.ntotal,
+               "build_seconds": time.perf_counter() - start}
+    print(f"Built {index_type} index over {index.ntotal} vectors "
+          f"in {summary['build_seconds']:.2f}s with {params}")
+
+    rerank_factor = params.get("rerank_factor", 0)
+    if report_recall and (index_type != "flat" or is_lossy(index_type, params)):
+        with span("recall_at_k"):
+            summary["recall"] = recall_at_k(index, embedding_matrix, rerank_factor=rerank_factor)
+        print(f"Recall vs exact search: {summary['recall']}")
+
+    # Save index to disk along with its configuration, and the vectors to re-rank against
+    with span("save_index") as save_span:
+        save_index(index, index_file, index_type, params)
+        if save_span.recording:
+            save_span.set(bytes=os.path.getsize(index_file))
     print(f"FAISS index saved to {index_file}")
+    vectors_path = rerank_vectors_path(index_file)
+    if rerank_factor:
+        shutil.copyfile(f"{embeddings_prefix}.npy", vectors_path)
+        print(f"Full-precision vectors for re-ranking saved to {vectors_path}")
+    elif os.path.exists(vectors_path):
+        os.remove(vectors_path)
+
+    summary["index_bytes"] = os.path.getsize(index_file)
+    summary["float32_bytes"] = embedding_matrix.nbytes
+    summary["compression_ratio"] = summary["float32_bytes"] / max(summary["index_bytes"], 1)
+    print(f"Index is {summary['index_bytes'] / 2**20:.1f} MiB, "
+          f"{summary['compression_ratio']:.1f}x smaller than float32 vectors")
+    return summary
 
 if __name__ == "__main__":
-    store_in_faiss() 
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Build the FAISS index from embeddings")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    parser.add_argument("--params", type=json.loads, default=None,
+                        help='JSON overrides, e.g. \'{"nlist": 256, "nprobe": 16}\'')
+    parser.add_argument("--compression", choices=COMPRESSIONS, default="none")
+    parser.add_argument("--dimensions", type=int, default=None,
+                        help="Reduce vectors to this many dimensions inside the index")
+    parser.add_argument("--reduction", choices=REDUCTIONS, default="pca")
+    args = parser.parse_args()
+    store_in_faiss(index_type=args.index_type, index_params=args.params,
+                   compression=args.compression, dimensions=args.dimensions,
+                   reduction=args.reduction)
@@ -0,0 +1,61 @@
+"""
+Token counting shared by chunking and prompt building
+
+Uses tiktoken's cl100k_base BPE, the encoding of text-embedding-ada-002 and
+gpt-3.5-turbo. tiktoken loads the BPE ranks from its local cache
+(TIKTOKEN_CACHE_DIR), downloading them only the first time; the encoder is
+built once per process. If tiktoken or the BPE file is unavailable, a
+regex approximation of the same pre-tokenisation is used instead.
+"""
+import re
+from functools import lru_cache
+from typing import List
+
+# Encoding used by text-embedding-ada-002 and gpt-3.5-turbo
+ENCODING_NAME = "cl100k_base"
+
+class BPETokenizer:
+    """tiktoken encoding, treating special-token text as ordinary text"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.name = encoding.name
+
+    def encode(self, text: str) -> List[int]:
+        return self.encoding.encode_ordinary(text)
+
+    def count(self, text: str) -> int:
+        return len(self.encode(text))
+
+    def token_offsets(self, text: str) -> List[int]:
+        """Character offset in `text` at which each token starts"""
+        _, offsets = self.encoding.decode_with_offsets(self.encode(text))
+        return offsets
+
+class ApproximateTokenizer:
+    """Regex stand-in for the BPE: words, short digit runs, punctuation and whitespace runs"""
+    name = "approximate"
+    PATTERN = re.compile(r"'(?:s|t|re|ve|m|ll|d)| ?[^\W\d_]+| ?\d{1,3}| ?(?:[^\s\w]|_)+|\s+(?!\S)|\s+")
+
+    def encode(self, text: str) -> List[str]:
+        return self.PATTERN.findall(text)
+
+    def count(self, text: str) -> int:
+        return sum(1 for _ in self.PATTERN.finditer(text))
+
+    def token_offsets(self, text: str) -> List[int]:
+        return [match.start() for match in self.PATTERN.finditer(text)]
+
+@lru_cache(maxsize=None)
+def get_tokenizer(name: str = ENCODING_NAME):
+    """Return the process-wide tokenizer for an encoding, loading it on first use"""
+    try:
+        import tiktoken
+        return BPETokenizer(tiktoken.get_encoding(name))
+    except Exception as e:
+        print(f"Could not load the {name} tokenizer ({e}); using approximate token counts")
+        return ApproximateTokenizer()
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in text under the shared tokenizer"""
+    return get_tokenizer().count(text)
@@ -0,0 +1,333 @@
+"""
+Per-stage tracing and sampling profiler for the pipeline
+
+Stages (get_embedding, search_similar_chunks, format_context, generate_answer,
+embed_chunks, store_in_faiss and their sub-steps) are wrapped in spans that
+record a duration plus attributes such as row and byte counts. Spans nest:
+each records its parent, so one query_and_answer call can be broken down into
+embedding, index loading, FAISS search, metadata lookups and the completion.
+The current span is held in a contextvar, so nesting also follows asyncio
+tasks and asyncio.to_thread.
+
+Tracing is off by default. While off, `span()` returns a shared no-op object
+and `traced` functions call straight through, so the cost is one flag check.
+Turn it on with `enable()`, or by setting RAG_TRACE=1 (keep spans in memory)
+or RAG_TRACE_FILE=spans.jsonl (also append each finished span to that file).
+
+Recorded spans are kept in a bounded buffer and aggregated per stage:
+`stage_stats()` returns counts and timings, and `prometheus_text()` renders
+them in the Prometheus text exposition format (server.py serves it on
+/metrics).
+
+`SamplingProfiler` samples the Python stacks of all threads at a fixed
+interval and writes them as collapsed stacks for flamegraph.pl or speedscope.
+"""
+import functools
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Upper bounds (seconds) of the stage duration histogram
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Numeric span attributes summed per stage and exported as counters
+COUNTED_ATTRIBUTES = ("rows", "bytes")
+
+_enabled = False
+_current: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+_ids = itertools.count(1)
+
+class Span:
+    """One timed stage; use as a context manager and annotate with set()"""
+    __slots__ = ("name", "attrs", "span_id", "parent_id", "trace_id", "start_time",
+                 "duration", "_start", "_token")
+    recording = True
+
+    def __init__(self, name: str, attrs: Dict):
+        self.name = name
+        self.attrs = attrs
+        self.span_id = next(_ids)
+        self.parent_id = None
+        self.trace_id = self.span_id
+        self.duration = None
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        parent = _current.get()
+        if parent is not None:
+            self.parent_id = parent.span_id
+            self.trace_id = parent.trace_id
+        self._token = _current.set(self)
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._start
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        _recorder.record(self)
+
+    def to_dict(self) -> Dict:
+        return {"name": self.name, "trace_id": self.trace_id, "span_id": self.span_id,
+                "parent_id": self.parent_id, "start": self.start_time,
+                "duration": self.duration, "attrs": self.attrs}
+
+class NoopSpan:
+    """Stands in for a Span while tracing is disabled"""
+    __slots__ = ()
+    recording = False
+
+    def set(self, **attrs) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+NOOP_SPAN = NoopSpan()
+
+class StageStats:
+    """Running totals and duration histogram for one stage"""
+    __slots__ = ("count", "errors", "total", "max", "buckets", "counters")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.counters = dict.fromkeys(COUNTED_ATTRIBUTES, 0)
+
+    def add(self, span: Span) -> None:
+        self.count += 1
+        self.errors += "error" in span.attrs
+        self.total += span.duration
+        self.max = max(self.max, span.duration)
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if span.duration <= bound:
+                self.buckets[i] += 1
+                break
+        for name in COUNTED_ATTRIBUTES:
+            value = span.attrs.get(name)
+            if isinstance(value, (int, float)):
+                self.counters[name] += value
+
+class SpanRecorder:
+    """Keeps recent spans, per-stage aggregates and an optional JSONL sink"""
+
+    def __init__(self, max_spans: int = 10000):
+        self._lock = threading.Lock()
+        self._spans = deque(maxlen=max_spans)
+        self._stages: Dict[str, StageStats] = {}
+        self._file = None
+
+    def configure(self, max_spans: int, trace_file: Optional[str]) -> None:
+        with self._lock:
+            self._spans = deque(self._spans, maxlen=max_spans)
+            if self._file is not None:
+                self._file.close()
+            self._file = open(trace_file, "a", encoding="utf-8") if trace_file else None
+
+    def record(self, span: Span) -> None:
+        with self._lock:
+            self._spans.append(span)
+            stats = self._stages.get(span.name)
+            if stats is None:
+                stats = self._stages[span.name] = StageStats()
+            stats.add(span)
+            if self._file is not None:
+                self._file.write(json.dumps(span.to_dict(), default=str) + "\n")
+                # Flush once per finished trace rather than per span
+                if span.parent_id is None:
+                    self._file.flush()
+
+    def spans(self) -> List[Dict]:
+        with self._lock:
+            return [span.to_dict() for span in self._spans]
+
+    def stages(self) -> Dict[str, StageStats]:
+        with self._lock:
+            return dict(self._stages)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._spans.clear()
+            self._stages.clear()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+_recorder = SpanRecorder()
+
+def enable(trace_file: Optional[str] = None, max_spans: int = 10000) -> None:
+    """Start recording spans, keeping the last `max_spans` and appending to `trace_file` if given"""
+    global _enabled
+    _recorder.configure(max_spans, trace_file)
+    _enabled = True
+
+def disable() -> None:
+    """Stop recording spans and close the trace file; aggregates are kept"""
+    global _enabled
+    _enabled = False
+    _recorder.close()
+
+def is_enabled() -> bool:
+    return _enabled
+
+def span(name: str, **attrs):
+    """Context manager timing one stage; a shared no-op while tracing is disabled"""
+    if not _enabled:
+        return NOOP_SPAN
+    return Span(name, attrs)
+
+def current_span():
+    """The innermost active span, for adding attributes from inside a traced function"""
+    if not _enabled:
+        return NOOP_SPAN
+    return _current.get() or NOOP_SPAN
+
+def traced(name: Optional[str] = None):
+    """Decorator recording each call of a function as a span named after it"""
+    def decorate(func):
+        stage = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(stage, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def spans() -> List[Dict]:
+    """Recently finished spans, oldest first"""
+    return _recorder.spans()
+
+def reset() -> None:
+    """Forget recorded spans and per-stage aggregates"""
+    _recorder.reset()
+
+def stage_stats() -> Dict[str, Dict[str, float]]:
+    """Per-stage call counts, total/average/max seconds and summed row/byte counts"""
+    return {
+        name: {"count": stats.count, "errors": stats.errors, "total_time": stats.total,
+               "avg_time": stats.total / stats.count, "max_time": stats.max, **stats.counters}
+        for name, stats in sorted(_recorder.stages().items())
+    }
+
+def prometheus_text(prefix: str = "rag") -> str:
+    """Per-stage metrics in the Prometheus text exposition format"""
+    stages = sorted(_recorder.stages().items())
+    lines = [f"# HELP {prefix}_stage_duration_seconds Time spent in each pipeline stage",
+             f"# TYPE {prefix}_stage_duration_seconds histogram"]
+    for name, stats in stages:
+        cumulative = 0
+        for bound, count in zip(DURATION_BUCKETS, stats.buckets):
+            cumulative += count
+            lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {stats.count}')
+        lines.append(f'{prefix}_stage_duration_seconds_sum{{stage="{name}"}} {stats.total}')
+        lines.append(f'{prefix}_stage_duration_seconds_count{{stage="{name}"}} {stats.count}')
+
+    lines += [f"# HELP {prefix}_stage_errors_total Stage calls that raised",
+              f"# TYPE {prefix}_stage_errors_total counter"]
+    lines += [f'{prefix}_stage_errors_total{{stage="{name}"}} {stats.errors}' for name, stats in stages]
+    for counter in COUNTED_ATTRIBUTES:
+        lines += [f"# HELP {prefix}_stage_{counter}_total {counter.capitalize()} processed by each stage",
+                  f"# TYPE {prefix}_stage_{counter}_total counter"]
+        lines += [f'{prefix}_stage_{counter}_total{{stage="{name}"}} {stats.counters[counter]}'
+                  for name, stats in stages if stats.counters[counter]]
+    return "\n".join(lines) + "\n"
+
+class SamplingProfiler:
+    """
+    Statistical profiler sampling every thread's Python stack on a background thread.
+
+    Costs nothing until started; while running, each sample walks the frames of
+    all threads, so the overhead scales with 1 / interval. Samples are kept as
+    collapsed stacks ("outer;inner count") for flamegraph tools.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.num_samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _frame_name(frame) -> str:
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+    def _collapse(self, frame) -> str:
+        names = []
+        while frame is not None:
+            names.append(self._frame_name(frame))
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own:
+                    self.samples[self._collapse(frame)] += 1
+            self.num_samples += 1
+
+    def start(self) -> "SamplingProfiler":
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def top(self, n: int = 20) -> List[Dict]:
+        """Functions with the most samples on top of the stack (self time)"""
+        counts = Counter()
+        for stack, count in self.samples.items():
+            counts[stack.rsplit(";", 1)[-1]] += count
+        total = sum(counts.values()) or 1
+        return [{"function": name, "samples": count, "fraction": count / total}
+                for name, count in counts.most_common(n)]
+
+    def write_collapsed(self, path: str) -> None:
+        """Write samples as collapsed stacks, one "frame;frame;frame count" line each"""
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+if os.getenv("RAG_TRACE") or os.getenv("RAG_TRACE_FILE"):
+    enable(os.getenv("RAG_TRACE_FILE"))
@@ -0,0 +1,116 @@
+import json
+import os
+from typing import List, Dict, Iterator, Tuple
+
+import numpy as np
+
+# Fixed-size .npy header so the row count can be rewritten in place as rows are appended
+HEADER_SIZE = 128
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+
+def vector_paths(prefix: str) -> Tuple[str, str]:
+    """Paths of the vector file and its metadata sidecar for a store prefix"""
+    return f"{prefix}.npy", f"{prefix}.jsonl"
+
+def _npy_header(rows: int, dimension: int) -> bytes:
+    """Version 1.0 .npy header for a C-ordered float32 (rows, dimension) array"""
+    header = f"{{'descr': '<f4', 'fortran_order': False, 'shape': ({rows}, {dimension}), }}"
+    header = header.encode("latin1")
+    padding = HEADER_SIZE - len(NPY_MAGIC) - 2 - len(header) - 1
+    return NPY_MAGIC + (HEADER_SIZE - len(NPY_MAGIC) - 2).to_bytes(2, "little") \
+        + header + b" " * padding + b"\n"
+
+class VectorStoreWriter:
+    """
+    Incrementally writes embeddings to a float32 .npy file plus a JSONL sidecar.
+
+    Row i of `<prefix>.npy` is the vector for line i of `<prefix>.jsonl`, which
+    holds the chunk text and metadata. The .npy header is rewritten after every
+    append, so a partially written store is still a valid (shorter) array. The
+    files are written under .tmp names and only moved into place by close();
+    used as a context manager, an exception discards them instead.
+    """
+
+    def __init__(self, prefix: str = "embeddings"):
+        self.vectors_path, self.records_path = vector_paths(prefix)
+        self.rows = 0
+        self.dimension = None
+        self._vectors = open(self.vectors_path + ".tmp", "wb")
+        self._records = open(self.records_path + ".tmp", "w", encoding="utf-8")
+
+    def append(self, vectors, records: List[Dict]) -> None:
+        """Append a batch of vectors and their matching metadata records"""
+        matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2 or len(matrix) != len(records):
+            raise ValueError("vectors must be a 2-D array with one row per record")
+        if len(matrix) == 0:
+            return
+
+        if self.dimension is None:
+            self.dimension = matrix.shape[1]
+            self._vectors.write(_npy_header(0, self.dimension))
+        elif matrix.shape[1] != self.dimension:
+            raise ValueError(f"expected dimension {self.dimension}, got {matrix.shape[1]}")
+
+        # Append rows, then patch the row count in the header
+        self._vectors.seek(0, os.SEEK_END)
+        self._vectors.write(matrix.tobytes())
+        self.rows += len(matrix)
+        self._vectors.seek(0)
+        self._vectors.write(_npy_header(self.rows, self.dimension))
+
+        for record in records:
+            self._records.write(json.dumps(record) + "\n")
+
+    def close(self) -> None:
+        """Flush both files and move them into place"""
+        if self.dimension is None:
+            # Nothing appended: write an empty (0, 0) array so readers still work
+            self._vectors.write(_npy_header(0, 0))
+        for f, path in ((self._vectors, self.vectors_path), (self._records, self.records_path)):
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            os.replace(path + ".tmp", path)
+
+    def abort(self) -> None:
+        """Discard what was written, leaving any previous store in place"""
+        for f, path in ((self._vectors, self.vectors_path), (self._records, self.records_path)):
+            f.close()
+            os.remove(path + ".tmp")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # A failed or interrupted write must not replace a complete store with a truncated one
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+def load_vectors(prefix: str = "embeddings", mmap: bool = True) -> np.ndarray:
+    """Load the (n, d) float32 vector matrix, memory-mapped read-only by default"""
+    vectors_path, _ = vector_paths(prefix)
+    return np.load(vectors_path, mmap_mode="r" if mmap else None)
+
+def iter_records(prefix: str = "embeddings") -> Iterator[Dict]:
+    """Stream metadata records from the JSONL sidecar in row order"""
+    _, records_path = vector_paths(prefix)
+    with open(records_path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+def convert_json_embeddings(json_file: str = "embeddings.json", prefix: str = "embeddings",
+                            batch_size: int = 4096) -> int:
+    """Convert a legacy embeddings.json file into the binary store, returning the row count"""
+    with open(json_file, "r") as f:
+        items = json.load(f)
+
+    with VectorStoreWriter(prefix) as writer:
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            writer.append([item["embedding"] for item in batch],
+                          [{key: value for key, value in item.items() if key != "embedding"}
+                           for item in batch])
+    return len(items)